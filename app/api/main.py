@@ -3,19 +3,44 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 # CAN: 1. 务必在这里导入 agent
-from app.api.routers import users, rag, history, agent 
-from app.db.session import engine
-from app.models.user import Base
+from app.api.routers import users, rag, history, agent, metrics 
+from app.core.config import print_config_summary
 from app.core.model_loader import load_model_on_startup
+from app.services.rerank_service import load_reranker
+from app.services.context_service import load_tokenizer
+from app.services.milvus_service import warm_up_vector_stores
+from app.services.es_service import get_es_client, close_es_client, close_sync_es_client
+from app.services.cache_service import init_redis_pool, close_redis_pool
+from app.services.minio_service import get_shared_minio_client
+from app.services.chat_history_service import start_chat_writer, stop_chat_writer
+from app.services.llm_service import close_llm_clients
 
-# 自动建表
-Base.metadata.create_all(bind=engine)
+# 导入本模块没有副作用 (不连接任何后端)：客户端在 lifespan 中创建，
+# 建表改为显式的迁移步骤 (python scripts/init_db.py)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    print_config_summary()
+    # 创建后端客户端 (只建立连接池对象，实际连接在第一次请求时建立)
+    init_redis_pool()
+    get_es_client()
+    get_shared_minio_client()
     # 启动时加载模型
     load_model_on_startup()
+    # 开启重排时加载交叉编码器
+    load_reranker()
+    # 上下文打包用的 LLM 分词器
+    load_tokenizer()
+    # 预热向量库注册表
+    warm_up_vector_stores()
+    # 会话记录后台写入任务
+    start_chat_writer()
     yield
+    await stop_chat_writer()
+    await close_es_client()
+    close_sync_es_client()
+    await close_redis_pool()
+    await close_llm_clients()
     print("系统关闭")
 
 app = FastAPI(title="RAG Backend", lifespan=lifespan)
@@ -35,6 +60,7 @@ app.include_router(history.router, prefix="/api/history", tags=["history"])
 
 # CAN: 2. 注册 Agent 路由 (没有这一行，访问就会报 404 Not Found)
 app.include_router(agent.router, prefix="/api/agent", tags=["agent"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["metrics"])
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,12 @@
+# app/api/routers/metrics.py
+from fastapi import APIRouter
+from app.core.metrics import get_metrics_snapshot
+
+router = APIRouter()
+
+@router.get("")
+async def read_metrics():
+    """
+    查看进程内性能指标 (计数器与直方图)
+    """
+    return get_metrics_snapshot()
@@ -1,16 +1,12 @@
 # app/api/routers/rag.py
-import os
-import shutil
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
 from fastapi.responses import StreamingResponse
 from app.schemas.rag import ChatRequest
 from app.services.rag_service import stream_rag_answer
-from app.services.ingestion_service import process_and_embed_document
+from app.services.ingestion_job_service import submit_ingest_job, get_ingest_job, IngestQueueFullError
 from app.core.config import settings
-from app.services.minio_service import minio_client
+from app.services.minio_service import get_shared_minio_client
 from app.api.deps import get_current_user
-from sqlalchemy.orm import Session  
-from app.db.session import get_db   
 from app.models.user import User    
 from app.api.deps import get_current_user
 
@@ -20,7 +16,6 @@ from typing import List
 @router.post("/chat")
 async def chat(
     request: ChatRequest,
-    db: Session = Depends(get_db),              # 注入数据库
     # current_user: User = Depends(get_current_user) # 注入当前用户 (需要登录)
 ):
     class FakeUser: id = 1
@@ -34,48 +29,39 @@ async def chat(
             llm_api_key=settings.DEEPSEEK_API_KEY,
             llm_base_url=settings.LLM_BASE_URL,
             llm_model=settings.LLM_MODEL_NAME,
-            db=db,             # 传入 DB
             user=current_user  # 传入用户 # type: ignore
         ),
         media_type="text/event-stream"
     )
     
-@router.post("/upload")
+@router.post("/upload", status_code=202)
 async def upload_document(file: UploadFile = File(...)):
     """
-    上传 PDF 文档 -> 存入 Minio -> 写入 Milvus
+    上传 PDF 文档 -> 登记摄取任务，立即返回 job_id
+    (存入 Minio、写入 Milvus / ES 在后台完成，通过 /jobs/{job_id} 查询进度)
     """
-    allowed_extensions = (".pdf", ".txt")
-    
     if not file.filename:
         raise HTTPException(status_code=400, detail="Filename is missing")
 
-    if not file.filename.endswith(".pdf"):
+    if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
-    # 1. 临时保存上传的文件
-    temp_dir = "data/uploads"
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    temp_path = os.path.join(temp_dir, file.filename)
-    
+
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # 2. 调用摄取服务
-        chunks_count = process_and_embed_document(temp_path)
-        
-        if chunks_count == 0:
-             raise HTTPException(status_code=500, detail="Failed to process document")
-             
-        return {"filename": file.filename, "chunks": chunks_count, "message": "Successfully ingested"}
-        
+        return await submit_ingest_job(file)
+    except IngestQueueFullError:
+        raise HTTPException(status_code=503, detail="Too many ingestion jobs in progress, please retry later")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # 清理临时文件 (可选: 如果你希望保留本地备份则注释掉这行)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+
+@router.get("/jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    """
+    查询摄取任务：status (queued / running / succeeded / failed)、stage、progress、chunks、pages、error
+    """
+    job = await get_ingest_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
     
 @router.get("/files", response_model=List[str])
 async def list_files():
@@ -84,11 +70,12 @@ async def list_files():
     """
     try:
         # 检查 Bucket 是否存在
+        minio_client = get_shared_minio_client()
         if not minio_client.bucket_exists(settings.MINIO_BUCKET_NAME):
             return []
 
-        # 列出所有对象
-        objects = minio_client.list_objects(settings.MINIO_BUCKET_NAME)
+        # 列出所有对象 (同步脚本保留子目录结构，需要递归列出)
+        objects = minio_client.list_objects(settings.MINIO_BUCKET_NAME, recursive=True)
         
         # 提取文件名
         file_names = [obj.object_name for obj in objects]
@@ -4,11 +4,24 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import SecretStr, Field
 from datetime import timedelta
 
+# 未配置时的占位密钥；JWT 与 Embedding 服务的 socket 认证都依赖 SECRET_KEY，生产环境必须修改
+DEFAULT_SECRET_KEY = "your-secret-key-here"
+
 class Settings(BaseSettings):
     # --- 1. LLM API 配置 ---
     DEEPSEEK_API_KEY: SecretStr = Field(default=SecretStr(""), description="DeepSeek API密钥")
     LLM_BASE_URL: str = "https://api.deepseek.com"
     LLM_MODEL_NAME: str = "deepseek-chat"
+    # 进程内共享的 LLM HTTP 连接池：最大连接数、保持的空闲连接数与空闲保持时间 (秒)、是否启用 HTTP/2
+    LLM_MAX_CONNECTIONS: int = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY: float = 60.0
+    LLM_HTTP2: bool = True
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_REQUEST_TIMEOUT: float = 60.0
+    # 连接失败 / 429 / 5xx 的重试次数与退避基数 (秒)，每次退避时间翻倍并带随机抖动
+    LLM_MAX_RETRIES: int = 2
+    LLM_RETRY_BACKOFF: float = 0.5
 
     # --- 2. 数据库配置 (MySQL) ---
     DB_USER: str = "rag_user"
@@ -22,12 +35,55 @@ class Settings(BaseSettings):
     def DATABASE_URL(self) -> str:
         return f"mysql+pymysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
+    # 会话记录异步落库：队列容量 (满时请求方等待)、每批条数、攒批等待时间 (秒)
+    CHAT_WRITE_QUEUE_SIZE: int = 1000
+    CHAT_WRITE_BATCH_SIZE: int = 100
+    CHAT_WRITE_FLUSH_INTERVAL: float = 0.5
+
     # --- 3. 向量数据库配置 (Milvus) ---
     #  修改：默认使用 Docker 服务名 'milvus-standalone'
     MILVUS_HOST: str = "milvus-standalone"  
     MILVUS_PORT: int = 19530
     COLLECTION_NAME: str = "rag_collection"
     EMBEDDING_MODEL_NAME: str = "/app/models/bge-base-zh-v1.5"
+    # 推理后端: torch (有 GPU 时用 CUDA) / onnx (ONNX Runtime CPU，需先运行 scripts/export_onnx.py)
+    EMBEDDING_BACKEND: str = "torch"
+    # ONNX int8 动态量化配置: "" (fp32) / avx512_vnni / avx512 / avx2 / arm64
+    EMBEDDING_ONNX_QUANTIZATION: str = ""
+    # CPU 推理线程数 (0 表示使用框架默认值)
+    EMBEDDING_NUM_THREADS: int = 0
+    # 独立的 Embedding 服务 (python scripts/embedding_server.py) 监听的 Unix socket：
+    # 设置后 API 进程不再各自加载模型，向量计算交给服务进程，结果经共享内存返回。为空时在本进程内加载
+    EMBEDDING_SERVER_SOCKET: str = ""
+    # 每个 API 进程到 Embedding 服务的最大连接数，以及启动时等待服务就绪的时间 (秒)
+    EMBEDDING_SERVER_CONNECTIONS: int = 8
+    EMBEDDING_SERVER_CONNECT_TIMEOUT: float = 30.0
+    # 查询向量动态批处理：时间窗口 (毫秒) 与单批最大条数
+    EMBEDDING_QUERY_BATCHING: bool = True
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 5.0
+    # 文档向量化：每批最大条数，以及每批 padding 后的 token 总量上限
+    EMBEDDING_DOC_BATCH_SIZE: int = 64
+    EMBEDDING_DOC_MAX_BATCH_TOKENS: int = 16384
+    # 文档向量磁盘缓存 (按模型 + 文本哈希寻址)，重复摄取 / 重建集合时不再重新计算
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_DIR: str = "data/embedding_cache"
+    # 向量库注册表检查集合 schema 是否变化的间隔 (秒)
+    MILVUS_SCHEMA_CHECK_INTERVAL: int = 30
+    # 向量索引: FLAT / IVF_FLAT / IVF_SQ8 / IVF_PQ / HNSW
+    # 新建集合时使用；已有集合需运行 scripts/rebuild_index.py 重建后才会生效
+    MILVUS_INDEX_TYPE: str = "IVF_FLAT"
+    # 向量已归一化，L2 与 IP 排序一致；修改度量同样需要重建索引
+    MILVUS_METRIC_TYPE: str = "L2"
+    MILVUS_INDEX_NLIST: int = 1024
+    # IVF_PQ: 子向量个数 (需整除向量维度) 与每个子向量的编码位数
+    MILVUS_INDEX_PQ_M: int = 48
+    MILVUS_INDEX_PQ_NBITS: int = 8
+    MILVUS_HNSW_M: int = 16
+    MILVUS_HNSW_EF_CONSTRUCTION: int = 200
+    # 检索参数: IVF 系列探测的聚类数，HNSW 的候选列表长度 (需 >= top_k)
+    MILVUS_SEARCH_NPROBE: int = 16
+    MILVUS_SEARCH_EF: int = 64
 
     @property
     def MILVUS_URI(self) -> str:
@@ -40,9 +96,15 @@ class Settings(BaseSettings):
     MINIO_SECRET_KEY: str = "minioadmin"
     MINIO_BUCKET_NAME: str = "rag-documents"
     MINIO_SECURE: bool = False
+    # 连接池大小、分片上传的分片大小 (>= 5MB) 与每个文件并发上传的分片数
+    MINIO_MAX_CONNECTIONS: int = 32
+    MINIO_PART_SIZE: int = 16 * 1024 * 1024
+    MINIO_PART_UPLOADS: int = 3
+    # 增量同步的并发文件数
+    MINIO_SYNC_WORKERS: int = 8
 
     # --- 5. 安全配置 ---
-    SECRET_KEY: SecretStr = Field(default=SecretStr("your-secret-key-here"), description="JWT签名密钥")
+    SECRET_KEY: SecretStr = Field(default=SecretStr(DEFAULT_SECRET_KEY), description="JWT签名密钥")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7 
     
     @property
@@ -55,6 +117,20 @@ class Settings(BaseSettings):
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
     CACHE_TTL: int = 3600 
+    # 知识库版本号在进程内的缓存时间 (秒)，以及旧命名空间回收参数
+    CORPUS_VERSION_REFRESH_INTERVAL: float = 2.0
+    CACHE_GC_BATCH_SIZE: int = 500
+    CACHE_GC_LOCK_TTL: int = 300
+    # 进程内 L1 缓存 (LRU)：条目数与有效期 (秒)
+    L1_CACHE_SIZE: int = 1024
+    L1_CACHE_TTL: int = 60
+    # 语义缓存：相似度阈值、接近阈值的统计区间、进程内索引容量、
+    # 从 Redis 同步其他 worker 新写入向量的间隔 (秒)
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_NEAR_MISS_MARGIN: float = 0.05
+    SEMANTIC_CACHE_CAPACITY: int = 10000
+    SEMANTIC_CACHE_SYNC_INTERVAL: float = 30.0
     
     @property
     def REDIS_URL(self) -> str:
@@ -73,19 +149,84 @@ class Settings(BaseSettings):
     ES_HOST: str = "rag_elasticsearch" # 本地开发可能需要改为 localhost，Docker内用服务名
     ES_PORT: int = 9200
     ES_INDEX: str = "rag_documents"
+    # 连接池：每个节点的最大连接数
+    ES_CONNECTIONS_PER_NODE: int = 20
+    ES_REQUEST_TIMEOUT: float = 10.0
+    ES_MAX_RETRIES: int = 3
+    # bulk 写入：每批文档数与可重试错误的重试策略
+    ES_BULK_CHUNK_SIZE: int = 500
+    ES_BULK_MAX_RETRIES: int = 3
+    ES_BULK_INITIAL_BACKOFF: float = 1.0
     
     @property
     def ES_URL(self) -> str:
         return f"http://{self.ES_HOST}:{self.ES_PORT}"
 
+    # --- 8. 混合检索配置 ---
+    # 同步检索调用使用的有界线程池大小
+    RETRIEVAL_MAX_WORKERS: int = 8
+    # 每一路检索的超时时间 (秒)，超时的那一路按空结果处理
+    MILVUS_SEARCH_TIMEOUT: float = 3.0
+    ES_SEARCH_TIMEOUT: float = 3.0
+    # 每一路的候选深度与融合后保留的条数
+    MILVUS_CANDIDATE_K: int = 5
+    ES_CANDIDATE_K: int = 5
+    RETRIEVAL_TOP_N: int = 6
+    # RRF 平滑常数与各路权重
+    RRF_K: int = 60
+    RRF_MILVUS_WEIGHT: float = 1.0
+    RRF_ES_WEIGHT: float = 1.0
+    # 检索结果缓存 (只存融合后的 chunk_id 与分数)
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_TTL: int = 1800
+    # 融合后的交叉编码器重排 (可选)：对前 RERANK_CANDIDATE_N 个候选一次批量打分，保留 RERANK_TOP_N 个；
+    # 打分超过 RERANK_TIMEOUT 秒时沿用 RRF 顺序。模型可从 ModelScope 下载 BAAI/bge-reranker-base
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL_PATH: str = "models/bge-reranker-base"
+    RERANK_CANDIDATE_N: int = 10
+    RERANK_TOP_N: int = 4
+    RERANK_MAX_LENGTH: int = 512
+    RERANK_BATCH_SIZE: int = 32
+    RERANK_TIMEOUT: float = 0.5
+    RERANK_MAX_WORKERS: int = 2
+    # 打分缓存 (问题 + chunk_id -> 分数)：条目数与有效期 (秒)
+    RERANK_CACHE_SIZE: int = 10000
+    RERANK_CACHE_TTL: int = 3600
+    # Prompt 上下文打包：同一页相邻 / 重叠的片段合并并去掉重叠部分，再按相关度顺序填满 token 预算
+    CONTEXT_PACKING_ENABLED: bool = True
+    CONTEXT_MAX_TOKENS: int = 2000
+    # 目标 LLM 的分词器目录 (HuggingFace 格式，例如 DeepSeek 官方提供的 tokenizer)；为空或加载失败时按字符数估算
+    LLM_TOKENIZER_PATH: str = ""
+    # 按字符数估算 token 时预留的余量 (占预算的比例)，估算偏低也不至于超出模型上下文
+    CONTEXT_ESTIMATE_HEADROOM: float = 0.15
+
+    # --- 9. 摄取配置 ---
+    # 摄取清单：记录每个文件的内容哈希与 chunk_id，用于增量摄取
+    INGEST_MANIFEST_PATH: str = "data/ingest_manifest.json"
+    # 流式解析：每个窗口的页数 (解析、切分、向量化、写入都按窗口进行，决定峰值内存)
+    INGEST_WINDOW_PAGES: int = 20
+    # 上传摄取任务：并发执行数、排队上限、临时文件目录与分块大小、状态保留时间 (秒)
+    INGEST_MAX_WORKERS: int = 2
+    INGEST_MAX_PENDING: int = 20
+    INGEST_SPOOL_DIR: str = "data/uploads"
+    INGEST_UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    INGEST_JOB_TTL: int = 86400
+    # 近似重复片段去重 (SimHash)：海明距离不超过阈值的片段视为重复，不再向量化与写入；
+    # 过短的片段特征太少，容易误判，不参与去重
+    INGEST_DEDUP_ENABLED: bool = True
+    INGEST_DEDUP_MAX_DISTANCE: int = 3
+    INGEST_DEDUP_MIN_CHARS: int = 50
+
 # 实例化配置
 settings = Settings()
 
 # --- 启动自检 (DEBUG) ---
-print("\n" + "="*50)
-print(f" RAG Backend Configuration Loaded (Docker Mode)")
-print(f"  DB Host:     {settings.DB_HOST}:{settings.DB_PORT}")
-print(f"  Milvus Host: {settings.MILVUS_HOST}:{settings.MILVUS_PORT}")
-print(f"  Redis Host:  {settings.REDIS_HOST}:{settings.REDIS_PORT}")
-print(f"  Minio Endpoint: {settings.MINIO_ENDPOINT}")
-print("="*50 + "\n")
\ No newline at end of file
+# 由 API 的 lifespan 调用，导入配置模块本身没有输出
+def print_config_summary():
+    print("\n" + "="*50)
+    print(f" RAG Backend Configuration Loaded (Docker Mode)")
+    print(f"  DB Host:     {settings.DB_HOST}:{settings.DB_PORT}")
+    print(f"  Milvus Host: {settings.MILVUS_HOST}:{settings.MILVUS_PORT}")
+    print(f"  Redis Host:  {settings.REDIS_HOST}:{settings.REDIS_PORT}")
+    print(f"  Minio Endpoint: {settings.MINIO_ENDPOINT}")
+    print("="*50 + "\n")
\ No newline at end of file
@@ -0,0 +1,94 @@
+# app/core/document_encoder.py
+import time
+import numpy as np
+from typing import List, Optional, Sequence
+from app.core.config import settings
+from app.core.metrics import counter, histogram
+
+# --- 文档向量化 (摄取链路) ---
+# 先按 token 数从长到短排序，再切成批次：长度相近的片段放在同一批，padding 浪费最少；
+# 每批的 token 总量 (按批内最长片段 × 条数估算) 不超过上限，短片段因此能用更大的批次。
+# 结果直接写进预分配的 float32 矩阵，交给 Milvus 写入时不再转换成 Python 列表。
+
+RATE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+_tokens = counter("embedding_doc_tokens")
+_texts = counter("embedding_doc_texts")
+_batch_ms = histogram("embedding_doc_batch_ms", (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+_tokens_per_sec = histogram("embedding_doc_tokens_per_sec", RATE_BUCKETS)
+
+def token_lengths(model, texts: Sequence[str]) -> List[int]:
+    """按模型的分词器计算 token 数 (截断到 max_seq_length)；分词器不可用时退化为字符数"""
+    tokenizer = getattr(model, "tokenizer", None)
+    max_length = getattr(model, "max_seq_length", None) or 512
+    if tokenizer is None:
+        return [min(len(text), max_length) for text in texts]
+    encoded = tokenizer(
+        list(texts),
+        add_special_tokens=True,
+        truncation=True,
+        max_length=max_length,
+        return_attention_mask=False,
+        return_token_type_ids=False
+    )
+    return [len(ids) for ids in encoded["input_ids"]]
+
+def plan_batches(lengths: Sequence[int], batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+    """
+    返回按长度分桶后的批次 (原始下标列表)。
+    按长度降序排列，最长的批次先跑，显存 / 内存不足会尽早暴露
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches: List[List[int]] = []
+    current: List[int] = []
+    for index in order:
+        # 批内最长的是第一条，padding 后的 token 总量 = 最长长度 × 条数
+        longest = lengths[current[0]] if current else lengths[index]
+        if current and (len(current) >= batch_size or longest * (len(current) + 1) > max_batch_tokens):
+            batches.append(current)
+            current = []
+        current.append(index)
+    if current:
+        batches.append(current)
+    return batches
+
+def encode_documents(
+    model,
+    texts: Sequence[str],
+    batch_size: Optional[int] = None,
+    max_batch_tokens: Optional[int] = None
+) -> np.ndarray:
+    """
+    批量计算文档向量，返回与 texts 顺序一致的 (N, dim) float32 矩阵 (已归一化)
+    """
+    batch_size = batch_size or settings.EMBEDDING_DOC_BATCH_SIZE
+    max_batch_tokens = max_batch_tokens or settings.EMBEDDING_DOC_MAX_BATCH_TOKENS
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    started = time.perf_counter()
+    lengths = token_lengths(model, texts)
+    output: Optional[np.ndarray] = None
+
+    for batch in plan_batches(lengths, batch_size, max_batch_tokens):
+        batch_started = time.perf_counter()
+        vectors = model.encode(
+            [texts[i] for i in batch],
+            batch_size=len(batch),
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        if output is None:
+            output = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+        output[batch] = vectors
+        _batch_ms.observe((time.perf_counter() - batch_started) * 1000)
+
+    total_tokens = sum(lengths)
+    elapsed = time.perf_counter() - started
+    _tokens.inc(total_tokens)
+    _texts.inc(len(texts))
+    if elapsed > 0:
+        _tokens_per_sec.observe(total_tokens / elapsed)
+    assert output is not None
+    return output
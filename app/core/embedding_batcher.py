@@ -0,0 +1,97 @@
+# app/core/embedding_batcher.py
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+from app.core.config import settings
+from app.core.metrics import histogram
+from app.core.model_loader import get_embedding_model
+
+# --- 查询向量动态批处理 ---
+# 并发请求各自提交一条查询文本，后台线程在一个很短的时间窗口内 (或凑满 max_batch_size 条)
+# 把它们合并成一次 encode 调用，再把结果分发回各自的 Future。
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_QueueItem = Tuple[str, Future, float]
+
+class QueryEmbeddingBatcher:
+    def __init__(self, model, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_QueueItem]" = queue.Queue()
+        self._batch_size_hist = histogram("embedding_query_batch_size", BATCH_SIZE_BUCKETS)
+        self._wait_hist = histogram("embedding_query_queue_wait_ms", LATENCY_BUCKETS_MS)
+        self._encode_hist = histogram("embedding_query_encode_ms", LATENCY_BUCKETS_MS)
+        self._thread = threading.Thread(target=self._worker, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """同步接口：阻塞等待所在批次完成"""
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        """异步接口：不占用事件循环线程"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect_batch(self) -> List[_QueueItem]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            # 跳过已被调用方取消的请求 (例如客户端断开)
+            batch = [item for item in self._collect_batch() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = self.model.encode(texts, normalize_embeddings=True, batch_size=len(texts))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            self._batch_size_hist.observe(len(batch))
+            self._encode_hist.observe((finished - started) * 1000)
+            for (_, future, enqueued), vector in zip(batch, vectors):
+                self._wait_hist.observe((started - enqueued) * 1000)
+                future.set_result(vector.tolist())
+
+_batcher: Optional[QueryEmbeddingBatcher] = None
+_batcher_lock = threading.Lock()
+
+def get_query_batcher() -> QueryEmbeddingBatcher:
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                model = get_embedding_model()
+                if model is None:
+                    raise ValueError("Fatal Error: Embedding model failed to initialize. Please check docker logs.")
+                _batcher = QueryEmbeddingBatcher(
+                    model,
+                    max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+                    max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS
+                )
+    return _batcher
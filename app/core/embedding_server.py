@@ -0,0 +1,306 @@
+# app/core/embedding_server.py
+import os
+import time
+import threading
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Sequence, Union
+from app.core.config import DEFAULT_SECRET_KEY, settings
+from app.core.metrics import counter, histogram
+
+# --- 进程外 Embedding 服务 ---
+# 每台机器只运行一个服务进程加载模型，各 uvicorn worker 通过 Unix socket 调用，
+# API 进程里既不加载模型也不在请求线程上跑 encode。
+# 请求 (文本列表) 走 socket；结果矩阵由服务端写进该连接专属的共享内存区，
+# socket 上只回传共享内存的名字与形状，向量本身不经过 pickle。
+# 同一连接上的请求严格一问一答，客户端读完结果后才会发下一个请求，因此共享内存区可以复用。
+# 连接用 SECRET_KEY 认证，之后的消息是 pickle：密钥仍是默认值时服务端拒绝启动、客户端拒绝连接，
+# socket 文件权限为 0600，只有运行服务的用户可以连接。
+
+_rpc_ms = histogram("embedding_server_rpc_ms", (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000))
+_rpc_errors = counter("embedding_server_rpc_errors")
+
+def _authkey() -> bytes:
+    secret = settings.SECRET_KEY.get_secret_value()
+    if secret == DEFAULT_SECRET_KEY:
+        raise RuntimeError("SECRET_KEY 仍是默认值，Embedding 服务的 socket 认证不安全，请在 .env 中设置 SECRET_KEY")
+    return secret.encode("utf-8")
+
+def _attach(name: str) -> SharedMemory:
+    """
+    以只读方式挂载对端创建的共享内存。
+    挂载方不能让自己的 resource_tracker 接管它，否则本进程退出时会把对端仍在使用的内存删掉
+    """
+    try:
+        return SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+# ========== 服务端 ==========
+
+class _Arena:
+    """服务端为每个连接维护的一块共享内存，不够大时按倍数扩容"""
+    MIN_SIZE = 1024 * 1024
+
+    def __init__(self):
+        self.shm: Optional[SharedMemory] = None
+
+    def write(self, array: np.ndarray) -> str:
+        array = np.ascontiguousarray(array, dtype=np.float32)
+        if self.shm is None or self.shm.size < array.nbytes:
+            size = max(array.nbytes, self.MIN_SIZE, 2 * self.shm.size if self.shm else 0)
+            self.close()
+            self.shm = SharedMemory(create=True, size=size)
+        view = np.ndarray(array.shape, dtype=np.float32, buffer=self.shm.buf)
+        view[...] = array
+        del view
+        return self.shm.name
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+class EmbeddingServer:
+    def __init__(self, model, model_name: str, model_path: Optional[str]):
+        self.model = model
+        self.info = {
+            "name": model_name,
+            "path": os.path.abspath(model_path) if model_path else None,
+            "dim": model.get_sentence_embedding_dimension(),
+            "max_seq_length": getattr(model, "max_seq_length", None),
+            "pid": os.getpid()
+        }
+
+    def _handle(self, op: str, payload: Any, arena: _Arena) -> Any:
+        if op == "encode":
+            texts, batch_size, normalize = payload
+            vectors = self.model.encode(
+                texts,
+                batch_size=batch_size,
+                normalize_embeddings=normalize,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            return arena.write(vectors), vectors.shape
+        if op == "info":
+            return self.info
+        raise ValueError(f"未知的请求类型: {op}")
+
+    def _serve_connection(self, conn: Connection):
+        arena = _Arena()
+        try:
+            while True:
+                try:
+                    op, payload = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    conn.send(("ok", self._handle(op, payload, arena)))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+        finally:
+            arena.close()
+            conn.close()
+
+    def serve_forever(self, address: str):
+        authkey = _authkey()
+        if os.path.exists(address):
+            os.unlink(address)
+        # bind 时就以 0600 创建 socket 文件，避免创建到 chmod 之间被其他用户连上
+        previous_umask = os.umask(0o177)
+        try:
+            listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(previous_umask)
+        os.chmod(address, 0o600)
+        print(f"✅ Embedding 服务已启动: {address} (模型 {self.info['name']}, 维度 {self.info['dim']})")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # 认证失败等单个连接的问题不影响服务
+                    print(f"⚠️ 拒绝连接: {e}")
+                    continue
+                # 每个连接一个线程；encode 内部的计算会释放 GIL，多个连接可以同时推理
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+# ========== 客户端 ==========
+
+class _Channel:
+    """一条到服务端的连接，以及它挂载的服务端共享内存"""
+
+    def __init__(self, address: str):
+        self.conn = Client(address, family="AF_UNIX", authkey=_authkey())
+        self.shm: Optional[SharedMemory] = None
+
+    def call(self, op: str, payload: Any = None) -> Any:
+        self.conn.send((op, payload))
+        status, result = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Embedding 服务返回错误: {result}")
+        return result
+
+    def read(self, name: str, shape) -> np.ndarray:
+        # 服务端扩容后会换一块新的共享内存
+        if self.shm is None or self.shm.name.lstrip("/") != name.lstrip("/"):
+            self._detach()
+            self.shm = _attach(name)
+        view = np.ndarray(shape, dtype=np.float32, buffer=self.shm.buf)
+        # 下一个请求会覆盖这块内存，结果复制一份交给调用方
+        result = view.copy()
+        del view
+        return result
+
+    def _detach(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+    def close(self):
+        self._detach()
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+class RemoteEmbeddingModel:
+    """
+    Embedding 服务的客户端，提供与 SentenceTransformer 相同的 encode / tokenizer 等接口，
+    查询批处理、文档向量化与磁盘缓存都可以直接使用它
+    """
+
+    def __init__(self, address: str, max_connections: int = 8, connect_timeout: float = 30.0):
+        # 密钥为默认值时直接失败，不进入等待服务端的重试
+        _authkey()
+        self.address = address
+        self.max_connections = max(1, max_connections)
+        # 空闲连接 (后进先出) 与已打开的连接数；归还或丢弃连接时唤醒等待的线程
+        self._idle: List[_Channel] = []
+        self._opened = 0
+        self._pool_cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._tokenizer = None
+        self._tokenizer_loaded = False
+        self.info: Dict[str, Any] = self._wait_for_server(connect_timeout)
+        self.max_seq_length = self.info.get("max_seq_length") or 512
+
+    def _wait_for_server(self, timeout: float) -> Dict[str, Any]:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self._call("info")
+            except (OSError, EOFError):
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _acquire(self) -> _Channel:
+        with self._pool_cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._opened < self.max_connections:
+                    self._opened += 1
+                    break
+                # 连接数已满，等其他线程归还或丢弃连接 (丢弃后可以新建一条)
+                self._pool_cond.wait()
+        try:
+            return _Channel(self.address)
+        except Exception:
+            self._forget()
+            raise
+
+    def _release(self, channel: _Channel):
+        with self._pool_cond:
+            self._idle.append(channel)
+            self._pool_cond.notify()
+
+    def _forget(self):
+        with self._pool_cond:
+            self._opened -= 1
+            self._pool_cond.notify()
+
+    def _discard(self, channel: _Channel):
+        channel.close()
+        self._forget()
+
+    def _call(self, op: str, payload: Any = None, read: bool = False) -> Any:
+        # 服务重启后旧连接会断开，换一条新连接重试一次
+        for attempt in range(2):
+            channel = self._acquire()
+            try:
+                result = channel.call(op, payload)
+                if read:
+                    result = channel.read(*result)
+            except (OSError, EOFError):
+                self._discard(channel)
+                _rpc_errors.inc()
+                if attempt == 1:
+                    raise
+                continue
+            except Exception:
+                self._release(channel)
+                _rpc_errors.inc()
+                raise
+            self._release(channel)
+            return result
+
+    def encode(
+        self,
+        sentences: Union[str, Sequence[str]],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts: List[str] = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        started = time.perf_counter()
+        vectors = self._call("encode", (texts, batch_size, normalize_embeddings), read=True)
+        _rpc_ms.observe((time.perf_counter() - started) * 1000)
+        return vectors[0] if single else vectors
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.info["dim"]
+
+    @property
+    def tokenizer(self):
+        """分词器在本进程加载 (只依赖 transformers 的 fast tokenizer，不加载模型权重)；加载失败时为 None"""
+        if not self._tokenizer_loaded:
+            with self._lock:
+                if not self._tokenizer_loaded:
+                    from app.core.model_loader import find_model_path
+                    path = find_model_path() or self.info.get("path")
+                    try:
+                        from transformers import AutoTokenizer
+                        self._tokenizer = AutoTokenizer.from_pretrained(path)
+                    except Exception as e:
+                        print(f"⚠️ 分词器加载失败，token 数按字符数估算: {e}")
+                    self._tokenizer_loaded = True
+        return self._tokenizer
+
+    def close(self):
+        with self._pool_cond:
+            channels, self._idle = self._idle, []
+        for channel in channels:
+            self._discard(channel)
+
+def connect_embedding_server() -> RemoteEmbeddingModel:
+    return RemoteEmbeddingModel(
+        settings.EMBEDDING_SERVER_SOCKET,
+        max_connections=settings.EMBEDDING_SERVER_CONNECTIONS,
+        connect_timeout=settings.EMBEDDING_SERVER_CONNECT_TIMEOUT
+    )
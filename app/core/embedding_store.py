@@ -0,0 +1,161 @@
+# app/core/embedding_store.py
+import os
+import json
+import fcntl
+import hashlib
+import threading
+import numpy as np
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from app.core.config import settings
+from app.core.metrics import counter
+
+# --- 文档向量磁盘缓存 ---
+# 按 (模型, 文本) 的哈希寻址：同样的片段文本无论来自哪次摄取、哪个集合，只计算一次。
+# 每个模型一个目录，包含两个只追加的文件：
+#   vectors.f32  向量矩阵 (float32，按行连续存放)，读取时 memmap，不整体载入内存
+#   index.bin    索引记录 (16 字节文本哈希 + 8 字节行号)，启动时载入为 dict
+# 写入先追加向量并 fsync，再追加索引，索引里出现的行一定已经完整落盘；
+# 追加时持有文件锁，API 进程与批量脚本可以同时使用同一个缓存目录，并能看到对方新写入的条目。
+
+RECORD_DTYPE = np.dtype([("key", "V16"), ("row", "<u8")])
+
+_hits = counter("embedding_cache_hits")
+_misses = counter("embedding_cache_misses")
+
+class EmbeddingStore:
+    def __init__(self, directory: str, model_name: str, dim: int):
+        self.namespace = f"{model_name}|dim={dim}|normalized"
+        self.dim = dim
+        self.directory = os.path.join(directory, hashlib.sha1(self.namespace.encode("utf-8")).hexdigest()[:16])
+        self._vectors_path = os.path.join(self.directory, "vectors.f32")
+        self._index_path = os.path.join(self.directory, "index.bin")
+        self._lock_path = os.path.join(self.directory, ".lock")
+        self._row_bytes = dim * 4
+
+        self._rows: Dict[bytes, int] = {}
+        self._index_offset = 0
+        self._mmap: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, "meta.json")
+        if not os.path.exists(meta_path):
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model": model_name, "dim": dim}, f, ensure_ascii=False)
+        with self._lock:
+            self._refresh()
+        if self._rows:
+            print(f"已加载向量缓存: {len(self._rows)} 条 ({self.directory})")
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def make_key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.namespace}\x00{text}".encode("utf-8"), digest_size=16).digest()
+
+    def _vector_rows(self) -> int:
+        if not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // self._row_bytes
+
+    def _refresh(self):
+        """读入其他进程新追加的索引记录 (调用方持有 self._lock)"""
+        if not os.path.exists(self._index_path):
+            return
+        size = os.path.getsize(self._index_path)
+        size -= size % RECORD_DTYPE.itemsize
+        if size <= self._index_offset:
+            return
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_offset)
+            records = np.frombuffer(f.read(size - self._index_offset), dtype=RECORD_DTYPE)
+        self._index_offset = size
+        vector_rows = self._vector_rows()
+        for key, row in zip(records["key"], records["row"]):
+            if row < vector_rows:
+                self._rows[key.tobytes()] = int(row)
+
+    def _vectors(self, rows_needed: int) -> np.memmap:
+        """memmap 覆盖的行数不够时重新映射 (文件只会变长)"""
+        if self._mmap is None or self._mmap.shape[0] < rows_needed:
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._vector_rows(), self.dim))
+        return self._mmap
+
+    def get_many(self, keys: Sequence[bytes]) -> Tuple[List[int], np.ndarray]:
+        """返回 (命中的位置列表, 对应的向量)，未命中的 key 不出现在结果里"""
+        with self._lock:
+            self._refresh()
+            positions = [i for i, key in enumerate(keys) if key in self._rows]
+            if not positions:
+                return [], np.zeros((0, self.dim), dtype=np.float32)
+            rows = [self._rows[keys[i]] for i in positions]
+            # 花式索引会拷贝出独立的数组，之后重新映射也不受影响
+            return positions, self._vectors(max(rows) + 1)[rows]
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray):
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._refresh()
+            new: Dict[bytes, int] = {}
+            for i, key in enumerate(keys):
+                if key not in self._rows and key not in new:
+                    new[key] = i
+            if not new:
+                return
+
+            start = self._vector_rows()
+            # 丢弃上次中断时写了一半的行 / 记录，保证新数据按行对齐
+            if os.path.exists(self._vectors_path):
+                os.truncate(self._vectors_path, start * self._row_bytes)
+            if os.path.exists(self._index_path):
+                os.truncate(self._index_path, self._index_offset)
+
+            block = np.ascontiguousarray(vectors[list(new.values())], dtype=np.float32)
+            with open(self._vectors_path, "ab") as f:
+                f.write(block.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            records = np.empty(len(new), dtype=RECORD_DTYPE)
+            records["key"] = [np.void(key) for key in new]
+            records["row"] = np.arange(start, start + len(new), dtype=np.uint64)
+            with open(self._index_path, "ab") as f:
+                f.write(records.tobytes())
+            self._index_offset += records.nbytes
+            for offset, key in enumerate(new):
+                self._rows[key] = start + offset
+
+    def encode(self, texts: Sequence[str], encode_fn: Callable[[Sequence[str]], np.ndarray]) -> np.ndarray:
+        """
+        先查缓存，只把未命中的文本交给 encode_fn 计算并写回缓存，返回与 texts 顺序一致的矩阵
+        """
+        keys = [self.make_key(text) for text in texts]
+        output = np.empty((len(texts), self.dim), dtype=np.float32)
+        positions, cached = self.get_many(keys)
+        if positions:
+            output[positions] = cached
+        _hits.inc(len(positions))
+
+        hit = set(positions)
+        missing = [i for i in range(len(texts)) if i not in hit]
+        if missing:
+            _misses.inc(len(missing))
+            computed = encode_fn([texts[i] for i in missing])
+            output[missing] = computed
+            try:
+                self.put_many([keys[i] for i in missing], computed)
+            except Exception as e:
+                # 缓存写入失败不影响本次结果
+                print(f"写入向量缓存失败: {e}")
+        return output
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+def get_embedding_store(model_name: str, dim: int) -> EmbeddingStore:
+    """每个 (模型, 维度) 在进程内共享一个缓存对象"""
+    key = f"{model_name}|{dim}"
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(settings.EMBEDDING_CACHE_DIR, model_name, dim)
+        return _stores[key]
@@ -0,0 +1,43 @@
+# app/core/embeddings.py
+import numpy as np
+from typing import List, Sequence
+from langchain_core.embeddings import Embeddings
+from app.core.config import settings
+from app.core.model_loader import get_embedding_model, get_embedding_model_name
+from app.core.embedding_batcher import get_query_batcher
+from app.core.document_encoder import encode_documents
+from app.core.embedding_store import get_embedding_store
+
+# --- Embedding 适配器 ---
+# 检索 (rag_service) 与摄取 (ingestion_service) 共用同一个适配器，
+# 这样向量库注册表里缓存的 Milvus 对象可以在两条链路之间复用
+class GlobalLazyEmbeddings(Embeddings):
+    def __init__(self):
+        # 从全局加载器获取模型
+        model = get_embedding_model()
+        if model is None:
+            raise ValueError("Fatal Error: Embedding model failed to initialize. Please check docker logs.")
+        self.model = model
+
+    def encode_documents(self, texts: Sequence[str]) -> np.ndarray:
+        """摄取链路使用：先查磁盘向量缓存，未命中的按长度分桶批量计算，返回 float32 矩阵"""
+        if not settings.EMBEDDING_CACHE_ENABLED or not texts:
+            return encode_documents(self.model, texts)
+        store = get_embedding_store(get_embedding_model_name(), self.model.get_sentence_embedding_dimension())
+        return store.encode(texts, lambda missing: encode_documents(self.model, missing))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # 开启 normalize_embeddings 以优化余弦相似度 (LangChain 接口要求返回列表)
+        return self.encode_documents(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        if settings.EMBEDDING_QUERY_BATCHING:
+            # 与其他并发请求合并为一次 encode
+            return get_query_batcher().embed(text)
+        embedding = self.model.encode(text, normalize_embeddings=True)
+        return embedding.tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if settings.EMBEDDING_QUERY_BATCHING:
+            return await get_query_batcher().aembed(text)
+        return await super().aembed_query(text)
@@ -0,0 +1,73 @@
+# app/core/metrics.py
+import threading
+from typing import Dict, List, Sequence, Any
+
+# 轻量级进程内指标：计数器与分桶直方图，通过 /api/metrics 查看，用于调参
+
+class Counter:
+    def __init__(self, name: str):
+        self.name = name
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self) -> int:
+        return self._value
+
+class Histogram:
+    def __init__(self, name: str, buckets: Sequence[float]):
+        self.name = name
+        self.buckets: List[float] = sorted(buckets)
+        # 最后一个桶对应 +Inf
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = len(self.buckets)
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        labels = [f"<={b:g}" for b in self.buckets] + ["+Inf"]
+        return {
+            "count": count,
+            "sum": round(total, 3),
+            "avg": round(total / count, 3) if count else 0.0,
+            "buckets": dict(zip(labels, counts))
+        }
+
+_metrics: Dict[str, Any] = {}
+_metrics_lock = threading.Lock()
+
+def counter(name: str) -> Counter:
+    """获取 (或创建) 一个计数器"""
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = Counter(name)
+        return _metrics[name]
+
+def histogram(name: str, buckets: Sequence[float]) -> Histogram:
+    """获取 (或创建) 一个直方图"""
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = Histogram(name, buckets)
+        return _metrics[name]
+
+def get_metrics_snapshot() -> Dict[str, Any]:
+    with _metrics_lock:
+        items = list(_metrics.items())
+    return {name: metric.snapshot() for name, metric in sorted(items)}
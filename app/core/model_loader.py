@@ -1,40 +1,128 @@
 # app/core/model_loader.py
-from sentence_transformers import SentenceTransformer
 import os
+from typing import Optional
+from app.core.config import settings
 
 global_embedding_model = None
+# 实际加载的模型 (路径 + 推理后端)，向量缓存按它区分命名空间
+global_embedding_model_name = None
 
-def load_model_on_startup():
-    global global_embedding_model
-    
-    # CAN: 优先查找 BGE 模型
-    possible_paths = [
-        "models/bge-base-zh-v1.5",           # 本地运行
-        "/app/models/bge-base-zh-v1.5",      # Docker 容器
-        "models/text2vec-base-chinese",      # 旧模型备选
-    ]
-    
-    selected_path = None
+# CAN: 优先查找 BGE 模型
+possible_paths = [
+    "models/bge-base-zh-v1.5",           # 本地运行
+    "/app/models/bge-base-zh-v1.5",      # Docker 容器
+    "models/text2vec-base-chinese",      # 旧模型备选
+]
+
+def find_model_path() -> Optional[str]:
     for path in possible_paths:
         if os.path.exists(path):
-            selected_path = path
-            print(f"发现模型文件: {selected_path}")
-            break
-            
-    if not selected_path:
-        print(f"未找到模型文件，请先运行 download_model.py")
-        return
+            return path
+    return None
+
+def onnx_file_name(quantization: str = settings.EMBEDDING_ONNX_QUANTIZATION) -> str:
+    """导出脚本 (scripts/export_onnx.py) 写入 <模型目录>/onnx/ 下的文件名"""
+    return f"model_qint8_{quantization}.onnx" if quantization else "model.onnx"
 
-    print(f"正在加载 Embedding 模型...")
+def load_torch_model(path: str, device: Optional[str] = None):
+    # sentence-transformers 会连带导入 torch，放到真正加载模型时再导入
+    from sentence_transformers import SentenceTransformer
+    import torch
+    if settings.EMBEDDING_NUM_THREADS > 0:
+        torch.set_num_threads(settings.EMBEDDING_NUM_THREADS)
+    if device:
+        return SentenceTransformer(path, device=device)
     # device='cuda' 利用你的 3060 显卡
     try:
-        global_embedding_model = SentenceTransformer(selected_path, device='cuda')
+        model = SentenceTransformer(path, device='cuda')
         print("模型加载成功 (CUDA Enabled)！")
+        return model
     except Exception:
         print("CUDA 加载失败，尝试使用 CPU...")
-        global_embedding_model = SentenceTransformer(selected_path, device='cpu')
+        return SentenceTransformer(path, device='cpu')
+
+def load_onnx_model(path: str, quantization: str = settings.EMBEDDING_ONNX_QUANTIZATION):
+    """
+    ONNX Runtime (CPU) 后端；quantization 非空时加载 int8 动态量化的模型。
+    模型文件不存在时报错，需要先运行 scripts/export_onnx.py 导出
+    """
+    from sentence_transformers import SentenceTransformer
+    import onnxruntime as ort
+
+    file_name = onnx_file_name(quantization)
+    if not os.path.exists(os.path.join(path, "onnx", file_name)):
+        raise FileNotFoundError(f"未找到 {path}/onnx/{file_name}，请先运行 scripts/export_onnx.py")
+
+    session_options = ort.SessionOptions()
+    if settings.EMBEDDING_NUM_THREADS > 0:
+        session_options.intra_op_num_threads = settings.EMBEDDING_NUM_THREADS
+    # 单个请求内不做算子间并行，并发由查询批处理与摄取批次负责
+    session_options.inter_op_num_threads = 1
+    session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    return SentenceTransformer(
+        path,
+        device="cpu",
+        backend="onnx",
+        model_kwargs={
+            "file_name": file_name,
+            "provider": "CPUExecutionProvider",
+            "session_options": session_options
+        }
+    )
+
+def connect_model_server() -> bool:
+    """设置了 EMBEDDING_SERVER_SOCKET 时改用独立的 Embedding 服务，本进程不加载模型"""
+    global global_embedding_model, global_embedding_model_name
+    from app.core.embedding_server import connect_embedding_server
+
+    print(f"正在连接 Embedding 服务: {settings.EMBEDDING_SERVER_SOCKET}")
+    try:
+        remote = connect_embedding_server()
+    except Exception as e:
+        print(f"Embedding 服务不可用，改为在本进程加载模型: {e}")
+        return False
+    global_embedding_model = remote
+    global_embedding_model_name = remote.info["name"]
+    print(f"已连接 Embedding 服务 (模型 {global_embedding_model_name}, pid {remote.info['pid']})")
+    return True
+
+def load_model_on_startup():
+    if settings.EMBEDDING_SERVER_SOCKET and connect_model_server():
+        return
+    load_local_model()
+
+def load_local_model():
+    global global_embedding_model, global_embedding_model_name
+
+    selected_path = find_model_path()
+    if not selected_path:
+        print(f"未找到模型文件，请先运行 download_model.py")
+        return
+    print(f"发现模型文件: {selected_path}")
+
+    backend = settings.EMBEDDING_BACKEND.lower()
+    base_name = os.path.basename(os.path.normpath(selected_path))
+    print(f"正在加载 Embedding 模型 (backend={backend})...")
+    if backend == "onnx":
+        quantization = settings.EMBEDDING_ONNX_QUANTIZATION
+        try:
+            global_embedding_model = load_onnx_model(selected_path, quantization)
+            global_embedding_model_name = f"{base_name}@onnx-{quantization or 'fp32'}"
+            print(f"模型加载成功 (ONNX Runtime, {'int8 ' + quantization if quantization else 'fp32'})！")
+            return
+        except Exception as e:
+            print(f"ONNX 模型加载失败，改用 PyTorch: {e}")
+
+    global_embedding_model = load_torch_model(selected_path)
+    global_embedding_model_name = base_name
 
 def get_embedding_model():
     if global_embedding_model is None:
         load_model_on_startup()
-    return global_embedding_model
\ No newline at end of file
+    return global_embedding_model
+
+def get_embedding_model_name():
+    get_embedding_model()
+    return global_embedding_model_name
@@ -1,19 +1,19 @@
 # app/services/agent_service.py
 from typing import AsyncGenerator
-from langchain_openai import ChatOpenAI
-from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain_core.prompts import ChatPromptTemplate
-from langchain.tools import tool
 from app.core.config import settings
-from app.services.rag_service import get_retriever, reciprocal_rank_fusion
-from app.services.es_service import search_keyword
-from langchain_core.documents import Document
-import json
+from app.services.rag_service import hybrid_search
+from app.services.rerank_service import rerank_documents
+from app.services.llm_service import get_chat_model, on_llm_clients_closed
+
+# langchain 的 Agent 组件 (langchain.agents / langchain_openai) 导入很慢，
+# 放到第一次创建执行器时再导入，API 启动时不加载。
+# 执行器本身不保存会话状态，创建一次后在所有请求间复用；
+# 它持有 ChatOpenAI (及其 HTTP 客户端)，LLM 连接池关闭时一并丢弃
+_agent_executor = None
 
 # --- 1. 定义工具 (Tools) ---
 
-@tool
-def search_knowledge_base(query: str) -> str:
+async def search_knowledge_base(query: str) -> str:
     """
     这是一个知识库搜索工具。
     当用户询问关于[编程、计算机、Java、Python、Linux]等技术问题时，务必使用此工具。
@@ -22,35 +22,41 @@ def search_knowledge_base(query: str) -> str:
     """
     print(f"Agent 正在调用工具: search_knowledge_base -> {query}")
     
-    # 复用 RAG 的混合检索逻辑
-    # A. Milvus
-    retriever = get_retriever(k=4)
-    milvus_docs = retriever.invoke(query)
-    
-    # B. ES
-    es_hits = search_keyword(query, k=4)
-    es_docs = [
-        Document(page_content=hit["_source"]["content"], metadata=hit["_source"]) 
-        for hit in es_hits
-    ]
-    
-    # C. Fusion
-    final_docs = reciprocal_rank_fusion([milvus_docs, es_docs], k=60)
+    # 复用 RAG 的混合检索逻辑 (Milvus + ES 并行检索，RRF 融合)
+    # 开启重排时融合结果全部作为候选，由交叉编码器挑出 4 个
+    final_docs = await hybrid_search(query, milvus_k=4, es_k=4, top_n=8 if settings.RERANK_ENABLED else 4)
+    if settings.RERANK_ENABLED:
+        final_docs = await rerank_documents(query, final_docs, top_n=4)
     
     # 格式化返回给 Agent
     if not final_docs:
         return "知识库中未找到相关内容。"
         
-    return "\n\n".join([f"[片段{i+1}]: {d.page_content}" for i, d in enumerate(final_docs[:4])])
+    return "\n\n".join([f"[片段{i+1}]: {d.page_content}" for i, d in enumerate(final_docs)])
 
 # --- 2. 初始化 Agent ---
 
 def get_agent_executor():
-    # 定义工具集
-    tools = [search_knowledge_base]
+    global _agent_executor
+    if _agent_executor is None:
+        _agent_executor = build_agent_executor()
+    return _agent_executor
+
+@on_llm_clients_closed
+def reset_agent_executor():
+    global _agent_executor
+    _agent_executor = None
+
+def build_agent_executor():
+    from langchain.agents import AgentExecutor, create_tool_calling_agent
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain.tools import tool
+
+    # 定义工具集 (函数的 docstring 即工具描述)
+    tools = [tool(search_knowledge_base)]
     
     # 定义 LLM (必须支持 Tool Calling)
-    llm = ChatOpenAI(
+    llm = get_chat_model(
         api_key=settings.DEEPSEEK_API_KEY,
         base_url=settings.LLM_BASE_URL,
         model=settings.LLM_MODEL_NAME,
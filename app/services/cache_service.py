@@ -1,41 +1,265 @@
+import re
 import json
+import time
 import hashlib
+import unicodedata
+import asyncio
+import threading
+import redis as redis_sync # type: ignore
 import redis.asyncio as redis # type: ignore
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Callable, Set
 from app.core.config import settings
+from app.core.metrics import counter
 
-# 创建 Redis 连接池
-pool = redis.ConnectionPool.from_url(settings.REDIS_URL, decode_responses=True)
+# Redis 连接池：API 进程在 lifespan 中创建，脚本等其他调用方在第一次使用时创建
+_pool: Optional[redis.ConnectionPool] = None
+
+def init_redis_pool() -> redis.ConnectionPool:
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool.from_url(settings.REDIS_URL, decode_responses=True)
+    return _pool
+
+async def close_redis_pool():
+    """应用关闭时断开连接池"""
+    global _pool
+    if _pool is not None:
+        await _pool.disconnect()
+        _pool = None
 
 def get_redis_client():
-    return redis.Redis(connection_pool=pool)
+    return redis.Redis(connection_pool=init_redis_pool())
+
+# --- 进程内 L1 缓存 (LRU + TTL)，挡在 Redis 前面 ---
+class LocalLRUCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
 
-def generate_cache_key(question: str) -> str:
+# L1 的有效期不超过 Redis 中的有效期
+local_cache = LocalLRUCache(settings.L1_CACHE_SIZE, min(settings.L1_CACHE_TTL, settings.CACHE_TTL))
+_l1_hits = counter("answer_cache_l1_hit")
+_l2_hits = counter("answer_cache_redis_hit")
+_cache_misses = counter("answer_cache_miss")
+
+_CJK = r"\u3000-\u303f\u4e00-\u9fff\uff00-\uffef"
+_SPACE_NEAR_CJK = re.compile(rf"\s+(?=[{_CJK}])|(?<=[{_CJK}])\s+")
+_TRAILING_PUNCT = re.compile(r"[\s?？!！。.,，;；~～]+$")
+
+def normalize_query(question: str) -> str:
     """
-    将问题进行 MD5 哈希，生成唯一的 Key
+    归一化问题文本：全半角统一、大小写统一、合并空白，去掉中文两侧的空格和句尾标点。
+    例如 "什么是 Redis？" 与 "什么是redis?" 归一化后相同
     """
-    # 比如 "rag_cache:md5_of_question"
-    hash_str = hashlib.md5(question.encode("utf-8")).hexdigest()
-    return f"rag_cache:{hash_str}"
+    text = unicodedata.normalize("NFKC", question).lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    text = _SPACE_NEAR_CJK.sub("", text)
+    return _TRAILING_PUNCT.sub("", text)
+
+# --- 知识库版本 (按集合) ---
+# 摄取 / 删除文档时版本号 +1。版本号是所有缓存 Key 的一部分，
+# 因此旧版本的答案与检索结果自然失效，随后由后台任务用 SCAN + UNLINK 回收。
+# 语义缓存的向量表 (Hash) 与写入时间 (ZSET，score 为时间戳，按容量裁剪最旧的条目)：
+# 不同 Embedding 模型 / 维度的向量不可比较，每个向量空间一组 Key，见 semantic_index_keys()
+SEMANTIC_INDEX_KEY = "rag_semantic_index"
+SEMANTIC_ORDER_KEY = "rag_semantic_index_order"
+_known_versions: Dict[str, Tuple[int, float]] = {}
+_version_change_hooks: List[Callable[[str, int], None]] = []
+_background_tasks: Set[asyncio.Task] = set()
+
+def semantic_index_keys(space: str) -> Tuple[str, str]:
+    """向量空间 (模型名:维度) 对应的 (向量表, 写入时间表) Key"""
+    return f"{SEMANTIC_INDEX_KEY}:{space}", f"{SEMANTIC_ORDER_KEY}:{space}"
+
+def _version_key(collection_name: str) -> str:
+    return f"rag_corpus_version:{collection_name}"
+
+def on_corpus_version_change(hook: Callable[[str, int], None]):
+    """注册版本变化回调 (例如清理进程内的语义索引)"""
+    _version_change_hooks.append(hook)
+    return hook
 
-async def get_cache(question: str) -> Optional[Dict[str, Any]]:
+async def get_corpus_version(collection_name: str) -> int:
     """
-    尝试获取缓存
+    读取集合当前的知识库版本号。进程内缓存 CORPUS_VERSION_REFRESH_INTERVAL 秒，
+    发现版本变化时触发回调并在后台回收旧命名空间
+    """
+    known = _known_versions.get(collection_name)
+    now = time.monotonic()
+    if known is not None and now - known[1] < settings.CORPUS_VERSION_REFRESH_INTERVAL:
+        return known[0]
+
+    try:
+        value = await get_redis_client().get(_version_key(collection_name))
+        version = int(value or 0)
+    except Exception as e:
+        print(f"读取知识库版本失败: {e}")
+        return known[0] if known is not None else 0
+
+    _known_versions[collection_name] = (version, now)
+    if version > 0 and (known is None or known[0] != version):
+        _handle_version_change(collection_name, version)
+    return version
+
+def _handle_version_change(collection_name: str, version: int):
+    for hook in _version_change_hooks:
+        try:
+            hook(collection_name, version)
+        except Exception as e:
+            print(f"版本变化回调出错: {e}")
+    task = asyncio.create_task(collect_stale_namespaces(collection_name, version))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def bump_corpus_version(collection_name: str = settings.COLLECTION_NAME) -> int:
+    """
+    知识库内容变化后调用 (同步版本，供摄取流程 / 脚本使用)
+    """
+    client = redis_sync.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    try:
+        version = int(client.incr(_version_key(collection_name)))
+    finally:
+        client.close()
+    # 本进程内的缓存版本立即失效
+    _known_versions.pop(collection_name, None)
+    print(f"知识库 '{collection_name}' 版本更新为 v{version}")
+    return version
+
+def parse_key_version(key: str, prefix: str) -> Optional[int]:
+    """从 '<prefix>v<version>:...' 形式的 Key 中解析版本号"""
+    if not key.startswith(prefix + "v"):
+        return None
+    tag = key[len(prefix) + 1:].split(":", 1)[0]
+    return int(tag) if tag.isdigit() else None
+
+async def collect_stale_namespaces(collection_name: str, current_version: int):
+    """
+    回收比 current_version 旧的缓存命名空间：SCAN 找到 Key 后分批 UNLINK (非阻塞删除)。
+    多个 worker 同时发现版本变化时，用 Redis 锁保证只有一个在回收
     """
     client = get_redis_client()
-    key = generate_cache_key(question)
+    lock_key = f"rag_cache_gc_lock:{collection_name}:v{current_version}"
+    try:
+        if not await client.set(lock_key, current_version, nx=True, ex=settings.CACHE_GC_LOCK_TTL):
+            return
+
+        removed = 0
+        for namespace in ("rag_cache", "rag_retrieval"):
+            prefix = f"{namespace}:{collection_name}:"
+            batch: List[str] = []
+            async for key in client.scan_iter(match=f"{prefix}v*", count=settings.CACHE_GC_BATCH_SIZE):
+                version = parse_key_version(key, prefix)
+                if version is not None and version < current_version:
+                    batch.append(key)
+                if len(batch) >= settings.CACHE_GC_BATCH_SIZE:
+                    removed += await client.unlink(*batch)
+                    batch = []
+            if batch:
+                removed += await client.unlink(*batch)
+
+        # 各向量空间的语义向量表中属于旧版本的条目
+        prefix = f"rag_cache:{collection_name}:"
+        index_keys = [key async for key in client.scan_iter(match=f"{SEMANTIC_INDEX_KEY}:*")]
+        for index_key in index_keys:
+            index_key, order_key = semantic_index_keys(index_key[len(SEMANTIC_INDEX_KEY) + 1:])
+            fields: List[str] = []
+            async for field, _ in client.hscan_iter(index_key, match=f"{prefix}v*", count=settings.CACHE_GC_BATCH_SIZE):
+                version = parse_key_version(field, prefix)
+                if version is not None and version < current_version:
+                    fields.append(field)
+                if len(fields) >= settings.CACHE_GC_BATCH_SIZE:
+                    removed += await client.hdel(index_key, *fields)
+                    await client.zrem(order_key, *fields)
+                    fields = []
+            if fields:
+                removed += await client.hdel(index_key, *fields)
+                await client.zrem(order_key, *fields)
+        # 未区分向量空间的旧版向量表无法判断向量来自哪个模型，直接删除
+        removed += await client.unlink(SEMANTIC_INDEX_KEY, SEMANTIC_ORDER_KEY)
+
+        print(f"已回收 '{collection_name}' v{current_version} 之前的缓存: {removed} 条")
+    except Exception as e:
+        print(f"回收旧缓存失败: {e}")
+
+def generate_cache_key(question: str, collection_name: str = settings.COLLECTION_NAME, version: int = 0) -> str:
+    """
+    将归一化后的问题进行 MD5 哈希，生成唯一的 Key
+    """
+    # 比如 "rag_cache:rag_collection:v3:md5_of_question"
+    hash_str = hashlib.md5(normalize_query(question).encode("utf-8")).hexdigest()
+    return f"rag_cache:{collection_name}:v{version}:{hash_str}"
+
+def cache_namespace(collection_name: str, version: int) -> str:
+    """某个集合、某个版本下所有答案缓存 Key 的公共前缀"""
+    return f"rag_cache:{collection_name}:v{version}:"
+
+async def get_cache_by_key(key: str) -> Optional[Dict[str, Any]]:
+    """
+    按缓存 Key 读取 (语义缓存命中后用它取回答案)
+    """
+    cached = local_cache.get(key)
+    if cached is not None:
+        _l1_hits.inc()
+        return cached
+
+    client = get_redis_client()
     data = await client.get(key)
     if data:
         print(f" 命中 Redis 缓存: {key}")
-        return json.loads(data)
+        _l2_hits.inc()
+        cached = json.loads(data)
+        local_cache.set(key, cached)
+        return cached
+    _cache_misses.inc()
     return None
 
-async def set_cache(question: str, answer: str, sources: list):
+async def get_cache(question: str, collection_name: str = settings.COLLECTION_NAME, version: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    尝试获取缓存
+    """
+    return await get_cache_by_key(generate_cache_key(question, collection_name, version))
+
+async def set_cache(
+    question: str,
+    answer: str,
+    sources: list,
+    collection_name: str = settings.COLLECTION_NAME,
+    version: int = 0
+) -> str:
     """
-    写入缓存
+    写入缓存，返回缓存 Key。
+    version 应为开始检索时读到的版本号，避免生成期间发生摄取导致旧答案写进新命名空间
     """
     client = get_redis_client()
-    key = generate_cache_key(question)
+    key = generate_cache_key(question, collection_name, version)
     
     data = {
         "answer": answer,
@@ -44,4 +268,46 @@ async def set_cache(question: str, answer: str, sources: list):
 
     # 写入并设置过期时间
     await client.setex(key, settings.CACHE_TTL, json.dumps(data, ensure_ascii=False))
-    print(f"已写入 Redis 缓存: {key}")
\ No newline at end of file
+    local_cache.set(key, data)
+    print(f"已写入 Redis 缓存: {key}")
+    return key
+
+# --- 检索结果缓存 ---
+# 与答案缓存分开：只缓存融合后的 chunk_id 与分数，命中时跳过 embedding、Milvus、ES 与融合，
+# 正文按 ID 从 ES 批量取回。Prompt 或 LLM 模型变化不影响这一层的命中。
+_retrieval_hits = counter("retrieval_cache_hit")
+_retrieval_misses = counter("retrieval_cache_miss")
+
+def generate_retrieval_cache_key(question: str, collection_name: str, signature: str, version: int) -> str:
+    """
+    Key = 归一化问题 + 集合 + 检索参数 (各路深度 / top_n) + 知识库版本
+    """
+    hash_str = hashlib.md5(normalize_query(question).encode("utf-8")).hexdigest()
+    return f"rag_retrieval:{collection_name}:v{version}:{signature}:{hash_str}"
+
+async def get_retrieval_cache(
+    question: str, collection_name: str, signature: str, version: int
+) -> Optional[List[Tuple[str, float]]]:
+    """命中时返回 [(chunk_id, score), ...]"""
+    key = generate_retrieval_cache_key(question, collection_name, signature, version)
+    try:
+        data = await get_redis_client().get(key)
+    except Exception as e:
+        print(f"读取检索缓存失败: {e}")
+        return None
+    if not data:
+        _retrieval_misses.inc()
+        return None
+    _retrieval_hits.inc()
+    return [(chunk_id, score) for chunk_id, score in json.loads(data)]
+
+async def set_retrieval_cache(
+    question: str, collection_name: str, signature: str, version: int, results: List[Tuple[str, float]]
+):
+    key = generate_retrieval_cache_key(question, collection_name, signature, version)
+    # 紧凑格式: [["chunk_id", score], ...]
+    payload = json.dumps([[chunk_id, round(score, 6)] for chunk_id, score in results], separators=(",", ":"))
+    try:
+        await get_redis_client().setex(key, settings.RETRIEVAL_CACHE_TTL, payload)
+    except Exception as e:
+        print(f"写入检索缓存失败: {e}")
@@ -0,0 +1,149 @@
+# app/services/chat_history_service.py
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+from sqlalchemy import insert
+from app.core.config import settings
+from app.core.metrics import counter, histogram
+from app.db.session import SessionLocal
+from app.models.chat import Conversation, Message
+
+# --- 会话记录异步落库 (write-behind) ---
+# 问答结束后只把记录放进有界队列，由后台任务攒批写入 MySQL：
+# 一批一个事务，消息用多行 INSERT 一次写入。数据库读写在线程池中执行，不阻塞事件循环。
+# 队列满时请求方等待 (背压)，关闭时把队列中剩余的记录全部写完。
+
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_enqueued = counter("chat_write_enqueued")
+_backpressure = counter("chat_write_backpressure")
+_written = counter("chat_write_written")
+_failed = counter("chat_write_failed")
+_batch_sizes = histogram("chat_write_batch_size", BATCH_SIZE_BUCKETS)
+_flush_ms = histogram("chat_write_flush_ms", (5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+
+def _write_records(db, records: List[Dict[str, Any]]):
+    conversations = [
+        Conversation(user_id=record["user_id"], title=record["question"][:30])
+        for record in records
+    ]
+    db.add_all(conversations)
+    # flush 取回自增 ID，消息行才能关联到会话
+    db.flush()
+
+    rows = []
+    for conversation, record in zip(conversations, records):
+        rows.append({
+            "conversation_id": conversation.id,
+            "role": "user",
+            "content": record["question"],
+            "sources": None
+        })
+        rows.append({
+            "conversation_id": conversation.id,
+            "role": "assistant",
+            "content": record["answer"],
+            "sources": record["sources"]
+        })
+    # executemany，驱动会改写为一条多行 INSERT
+    db.execute(insert(Message), rows)
+
+def _write_batch(records: List[Dict[str, Any]]):
+    """在线程池中执行：整批一个事务；失败时逐条重试，避免一条坏数据拖累整批"""
+    db = SessionLocal()
+    try:
+        try:
+            _write_records(db, records)
+            db.commit()
+            _written.inc(len(records))
+            return
+        except Exception as e:
+            db.rollback()
+            if len(records) == 1:
+                raise
+            print(f"批量保存会话失败，改为逐条写入: {e}")
+
+        for record in records:
+            try:
+                _write_records(db, [record])
+                db.commit()
+                _written.inc()
+            except Exception as e:
+                db.rollback()
+                _failed.inc()
+                print(f"保存数据库失败: {e}")
+    except Exception as e:
+        _failed.inc(len(records))
+        print(f"保存数据库失败: {e}")
+    finally:
+        db.close()
+
+async def _collect_batch(queue: asyncio.Queue) -> List[Dict[str, Any]]:
+    """等到第一条记录后，在 flush 间隔内继续收集，直到凑满一批"""
+    batch = [await queue.get()]
+    deadline = time.monotonic() + settings.CHAT_WRITE_FLUSH_INTERVAL
+    while len(batch) < settings.CHAT_WRITE_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+async def _flush(batch: List[Dict[str, Any]]):
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, _write_batch, batch)
+    _batch_sizes.observe(len(batch))
+    _flush_ms.observe((time.perf_counter() - started) * 1000)
+
+async def _run_worker(queue: asyncio.Queue):
+    while True:
+        batch = await _collect_batch(queue)
+        try:
+            await _flush(batch)
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+def start_chat_writer():
+    """在应用 lifespan 中启动后台写入任务"""
+    global _queue, _worker
+    if _worker is not None and not _worker.done():
+        return
+    # 后台任务异常退出后重启时沿用原队列，其中尚未写入的记录不会丢失
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=settings.CHAT_WRITE_QUEUE_SIZE)
+    _worker = asyncio.create_task(_run_worker(_queue))
+
+async def stop_chat_writer():
+    """关闭时写完队列中剩余的记录"""
+    global _queue, _worker
+    if _worker is None:
+        return
+    if _queue is not None and not _worker.done():
+        await _queue.join()
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    _queue, _worker = None, None
+
+async def enqueue_chat(user_id: int, question: str, answer: str, sources: Optional[List[Any]] = None):
+    """
+    登记一轮问答，由后台任务异步落库。队列已满时等待空位
+    """
+    if _worker is None or _worker.done():
+        # 未经 lifespan 启动 (例如脚本中直接调用) 时按需启动
+        start_chat_writer()
+    assert _queue is not None
+    record = {"user_id": user_id, "question": question, "answer": answer, "sources": sources}
+    if _queue.full():
+        _backpressure.inc()
+    await _queue.put(record)
+    _enqueued.inc()
@@ -0,0 +1,194 @@
+# app/services/context_service.py
+import re
+import math
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from app.core.config import settings
+from app.core.metrics import counter, histogram
+
+# --- Prompt 上下文打包 ---
+# 切分时相邻片段有 chunk_overlap 的重叠，同一页的相邻片段又经常一起被检索到，
+# 直接拼接会让 LLM 重复读同一段文字。这里先按 (source, page) 分组，
+# 依据切分时记录的 start_index (页内字符偏移) 把相邻 / 重叠的片段合并成连续文本块，
+# 再按块内最相关片段的名次依次放入，直到用完 CONTEXT_MAX_TOKENS。
+# 旧数据没有 start_index 时，退化为按正文首尾重叠判断是否相邻。
+
+SEPARATOR = "\n\n------\n\n"
+# 切分器会去掉片段边界上的换行等分隔符，偏移相差不超过这么多字符仍视为相邻
+MAX_GAP = 2
+# 无偏移信息时，首尾重叠至少这么长才认为是同一段文字 (切分重叠为 100 字)
+MIN_TEXT_OVERLAP = 20
+
+_tokens_packed = histogram("context_tokens", (250, 500, 1000, 1500, 2000, 3000, 4000, 8000))
+_tokens_saved = counter("context_tokens_saved")
+_chunks_merged = counter("context_chunks_merged")
+
+# ========== token 计数 ==========
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+_CJK_CHAR = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                if settings.LLM_TOKENIZER_PATH:
+                    try:
+                        from transformers import AutoTokenizer
+                        _tokenizer = AutoTokenizer.from_pretrained(settings.LLM_TOKENIZER_PATH)
+                    except Exception as e:
+                        print(f"⚠️ LLM 分词器加载失败，token 数按字符数估算: {e}")
+                else:
+                    print(
+                        "⚠️ 未设置 LLM_TOKENIZER_PATH，token 数按字符数估算，"
+                        f"上下文预算预留 {settings.CONTEXT_ESTIMATE_HEADROOM:.0%} 余量"
+                    )
+                _tokenizer_loaded = True
+    return _tokenizer
+
+def load_tokenizer():
+    """启动时加载分词器，未配置或加载失败在启动日志里提示，而不是等到第一个请求"""
+    _get_tokenizer()
+
+def estimate_tokens(text: str) -> int:
+    """按 DeepSeek 给出的经验比例估算：1 个中文字符约 0.6 token，1 个英文字符约 0.3 token"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+def count_tokens(text: str) -> int:
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+# ========== 片段合并 ==========
+
+class _Block:
+    """同一页上的一段连续文本，由一个或多个片段合并而来"""
+
+    def __init__(self, doc: Document, rank: int):
+        self.text = doc.page_content
+        self.start: Optional[int] = doc.metadata.get("start_index")
+        self.docs = [doc]
+        self.rank = rank
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+    def absorb(self, other: "_Block", text: str):
+        self.text = text
+        self.docs.extend(other.docs)
+        self.rank = min(self.rank, other.rank)
+
+def _suffix_prefix_overlap(left: str, right: str) -> int:
+    """left 的后缀与 right 的前缀最长的重合长度 (不足 MIN_TEXT_OVERLAP 时返回 0)"""
+    for size in range(min(len(left), len(right)), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def _merge_by_offset(blocks: List[_Block]) -> List[_Block]:
+    blocks = sorted(blocks, key=lambda b: b.start)
+    merged = [blocks[0]]
+    for block in blocks[1:]:
+        current = merged[-1]
+        if block.start > current.end + MAX_GAP:
+            merged.append(block)
+            continue
+        if block.end <= current.end:
+            # 完全包含在前一块里
+            current.absorb(block, current.text)
+        elif block.start >= current.end:
+            # 紧邻 (中间只隔着被切掉的分隔符)
+            current.absorb(block, current.text + ("\n" if block.start > current.end else "") + block.text)
+        else:
+            current.absorb(block, current.text + block.text[current.end - block.start:])
+    return merged
+
+def _merge_by_text(blocks: List[_Block]) -> List[_Block]:
+    merged: List[_Block] = []
+    for block in blocks:
+        for current in merged:
+            if block.text in current.text:
+                current.absorb(block, current.text)
+                break
+            overlap = _suffix_prefix_overlap(current.text, block.text)
+            if overlap:
+                current.absorb(block, current.text + block.text[overlap:])
+                break
+            overlap = _suffix_prefix_overlap(block.text, current.text)
+            if overlap:
+                current.absorb(block, block.text + current.text[overlap:])
+                break
+        else:
+            merged.append(block)
+    return merged
+
+def merge_chunks(docs: List[Document]) -> List[_Block]:
+    """按 (source, page) 分组合并相邻 / 重叠片段，返回按块内最高名次排序的文本块"""
+    groups: Dict[Tuple[Any, Any], List[_Block]] = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append(_Block(doc, rank))
+
+    blocks: List[_Block] = []
+    for group in groups.values():
+        if len(group) == 1:
+            blocks.extend(group)
+        elif all(b.start is not None for b in group):
+            blocks.extend(_merge_by_offset(group))
+        else:
+            blocks.extend(_merge_by_text(group))
+    return sorted(blocks, key=lambda b: b.rank)
+
+# ========== 打包 ==========
+
+def _truncate(text: str, budget: int) -> str:
+    """把文本截到 budget 个 token 以内 (按比例估算后逐步收紧)"""
+    tokens = count_tokens(text)
+    while tokens > budget and text:
+        text = text[:max(0, int(len(text) * budget / tokens) - 1)]
+        tokens = count_tokens(text)
+    return text
+
+def pack_context(docs: List[Document], max_tokens: Optional[int] = None) -> Tuple[str, List[Document]]:
+    """
+    合并片段并按相关度顺序填入 token 预算，返回 (上下文文本, 实际用到的片段)。
+    docs 需已按相关度排好序 (RRF / 重排结果)；放不下的块跳过，继续尝试后面更短的块
+    """
+    max_tokens = max_tokens or settings.CONTEXT_MAX_TOKENS
+    if not docs:
+        return "", []
+    if _get_tokenizer() is None:
+        # 估算值可能偏低，按比例收紧预算
+        max_tokens = max(1, int(max_tokens * (1 - settings.CONTEXT_ESTIMATE_HEADROOM)))
+
+    blocks = merge_chunks(docs)
+    separator_tokens = count_tokens(SEPARATOR)
+    texts: List[str] = []
+    used: List[Document] = []
+    total = 0
+    for block in blocks:
+        cost = count_tokens(block.text) + (separator_tokens if texts else 0)
+        text = block.text
+        if total + cost > max_tokens:
+            if texts:
+                continue
+            # 最相关的一块本身就超出预算时截断放入，保证上下文不为空
+            text = _truncate(text, max_tokens)
+            cost = count_tokens(text)
+        texts.append(text)
+        used.extend(block.docs)
+        total += cost
+
+    raw_tokens = sum(count_tokens(d.page_content) for d in docs) + separator_tokens * (len(docs) - 1)
+    _tokens_packed.observe(total)
+    _tokens_saved.inc(max(0, raw_tokens - total))
+    _chunks_merged.inc(len(docs) - len(blocks))
+    return SEPARATOR.join(texts), used
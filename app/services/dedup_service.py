@@ -0,0 +1,162 @@
+# app/services/dedup_service.py
+import re
+import hashlib
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+from app.core.config import settings
+from app.core.metrics import counter
+from app.services.manifest_service import IngestManifest
+
+# --- 近似重复片段去重 (SimHash) ---
+# 再版的 PDF、每页重复的页眉页脚与免责声明会切出大量几乎相同的片段，
+# 它们各自向量化、写入 Milvus 与 ES，检索时还会挤占融合后的 top-N。
+# 每个片段按字符 n-gram 计算 64 位 SimHash，与已入库片段的签名比较，海明距离不超过阈值即视为重复，直接丢弃。
+# 签名随摄取清单持久化 (每个文件一份)，进程启动时从清单重建索引。
+# 查找用分段索引：把 64 位切成 (阈值 + 1) 段互不重叠的位段，距离不超过阈值的两个签名至少有一段完全相同 (抽屉原理)，
+# 只需在段值相同的候选里逐个比较海明距离。各段宽度相差不超过 1 位，恰好覆盖全部 64 位。
+
+SIGNATURE_BITS = 64
+SHINGLE_SIZE = 4
+
+_dropped = counter("ingest_dedup_dropped")
+_checked = counter("ingest_dedup_checked")
+_bit_positions = np.arange(SIGNATURE_BITS, dtype=np.uint64)
+
+def _normalize(text: str) -> str:
+    # 空白与大小写差异不影响判断 (PDF 再版时换行位置常常不同)
+    return re.sub(r"\s+", "", text).lower()
+
+def simhash(text: str) -> int:
+    """字符 n-gram 的 64 位 SimHash (与语言无关，中文不需要分词)"""
+    normalized = _normalize(text)
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = [normalized]
+    else:
+        shingles = [normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)]
+    # 内置 hash() 每个进程加盐不同，持久化的签名必须用稳定的哈希
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles)
+    )
+    bits = (hashes[:, None] >> _bit_positions) & np.uint64(1)
+    # 每一位上 1 比 0 多则该位为 1
+    votes = bits.sum(axis=0) * 2 > len(shingles)
+    return int(np.packbits(votes[::-1]).view(">u8")[0])
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class SimHashIndex:
+    """签名 -> (chunk_id, 来源) 的分段索引，线程安全"""
+
+    def __init__(self, max_distance: int = settings.INGEST_DEDUP_MAX_DISTANCE):
+        if not 0 <= max_distance < SIGNATURE_BITS:
+            clamped = min(max(max_distance, 0), SIGNATURE_BITS - 1)
+            print(f"⚠️ 去重海明距离阈值 {max_distance} 超出范围 [0, {SIGNATURE_BITS - 1}]，改用 {clamped}")
+            max_distance = clamped
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        # 前 (64 % 段数) 段各多 1 位，使各段互不重叠且正好覆盖 64 位
+        base, extra = divmod(SIGNATURE_BITS, self.bands)
+        self.band_widths = [base + 1 if band < extra else base for band in range(self.bands)]
+        self._band_offsets = [sum(self.band_widths[:band]) for band in range(self.bands)]
+        self._tables: List[Dict[int, List[Tuple[int, str, str]]]] = [{} for _ in range(self.bands)]
+        self._by_source: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_manifest(cls, manifest: IngestManifest, **kwargs) -> "SimHashIndex":
+        index = cls(**kwargs)
+        for source, entry in manifest.items():
+            for chunk_id, signature in zip(entry.get("chunk_ids", []), entry.get("signatures", [])):
+                if signature:
+                    index.add(int(signature, 16), chunk_id, source)
+        return index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(signatures) for signatures in self._by_source.values())
+
+    def _band_keys(self, signature: int):
+        for band, (offset, width) in enumerate(zip(self._band_offsets, self.band_widths)):
+            yield band, (signature >> offset) & ((1 << width) - 1)
+
+    def find(self, signature: int) -> Optional[Tuple[str, str]]:
+        """返回第一个近似重复片段的 (chunk_id, 来源)，没有时返回 None"""
+        with self._lock:
+            for band, key in self._band_keys(signature):
+                for candidate, chunk_id, source in self._tables[band].get(key, ()):
+                    if hamming_distance(candidate, signature) <= self.max_distance:
+                        return chunk_id, source
+        return None
+
+    def add(self, signature: int, chunk_id: str, source: str):
+        with self._lock:
+            for band, key in self._band_keys(signature):
+                self._tables[band].setdefault(key, []).append((signature, chunk_id, source))
+            self._by_source.setdefault(source, []).append(signature)
+
+    def remove_source(self, source: str):
+        """文件重新摄取或写入失败时，移除它登记过的签名"""
+        with self._lock:
+            signatures = self._by_source.pop(source, [])
+            for signature in set(signatures):
+                for band, key in self._band_keys(signature):
+                    bucket = self._tables[band].get(key)
+                    if bucket is None:
+                        continue
+                    bucket[:] = [item for item in bucket if item[2] != source]
+                    if not bucket:
+                        del self._tables[band][key]
+
+class DedupResult:
+    def __init__(self):
+        self.kept: List[Document] = []
+        self.signatures: List[str] = []
+        self.duplicates = 0
+        # 被丢弃片段所重复的其他文件 (这些文件变化时，本文件需要重新摄取)
+        self.linked_sources: Set[str] = set()
+
+def dedup_splits(index: SimHashIndex, source: str, splits: List[Document]) -> DedupResult:
+    """
+    过滤近似重复的片段，保留的片段登记进索引 (同一文件内部的重复也会被过滤)。
+    返回保留的片段及其签名 (与 kept 一一对应，过短未计算签名的为空字符串)
+    """
+    result = DedupResult()
+    for doc in splits:
+        text = doc.page_content
+        if len(text.strip()) < settings.INGEST_DEDUP_MIN_CHARS:
+            result.kept.append(doc)
+            result.signatures.append("")
+            continue
+        signature = simhash(text)
+        match = index.find(signature)
+        _checked.inc()
+        if match is not None:
+            result.duplicates += 1
+            if match[1] != source:
+                result.linked_sources.add(match[1])
+            continue
+        index.add(signature, doc.metadata["chunk_id"], source)
+        result.kept.append(doc)
+        result.signatures.append(format(signature, "016x"))
+    _dropped.inc(result.duplicates)
+    return result
+
+def invalidate_dependents(manifest: IngestManifest, source: str) -> List[str]:
+    """
+    source 的内容变化后，之前因与它重复而丢弃片段的文件从清单中移除，
+    下次摄取时会完整重新处理 (否则这些片段可能从知识库中消失)
+    """
+    dependents = [
+        other for other, entry in manifest.items()
+        if other != source and source in entry.get("linked_sources", [])
+    ]
+    for other in dependents:
+        manifest.remove(other)
+    if dependents:
+        print(f"'{source}' 已变化，以下文件引用了它的片段，将在下次摄取时重新处理: {', '.join(dependents)}")
+    return dependents
@@ -1,64 +1,218 @@
 # app/services/es_service.py
-from elasticsearch import Elasticsearch
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
 from app.core.config import settings
 
-# 初始化客户端
-es_client = Elasticsearch(settings.ES_URL)
+if TYPE_CHECKING:
+    from elasticsearch import AsyncElasticsearch, Elasticsearch
 
-def create_index_if_not_exists():
-    """创建索引"""
-    try:
-        if not es_client.indices.exists(index=settings.ES_INDEX):
-            print(f"正在创建 ES 索引: {settings.ES_INDEX} ...")
-            es_client.indices.create(
-                index=settings.ES_INDEX,
-                mappings={
-                    "properties": {
-                        "content": {"type": "text", "analyzer": "standard"},
-                        "source": {"type": "keyword"},
-                        "page": {"type": "integer"}
-                    }
-                }
-            )
-            print(f"ES 索引 '{settings.ES_INDEX}' 创建成功")
-    except Exception as e:
-        print(f"创建索引失败: {e}")
+INDEX_MAPPINGS = {
+    "properties": {
+        "content": {"type": "text", "analyzer": "standard"},
+        "chunk_id": {"type": "keyword"},
+        "source": {"type": "keyword"},
+        "page": {"type": "integer"}
+    }
+}
 
-def index_document(doc_id: str, content: str, metadata: dict):
-    """写入文档 (带数据清洗)"""
-    
-    # CAN: 关键修复 - 清洗 metadata，移除空值
-    # ES 的动态映射非常敏感，如果它认为某个字段是 Date，传空字符串就会报错
-    clean_metadata = {}
+def create_es_client() -> "AsyncElasticsearch":
+    """创建异步客户端，连接池大小由 ES_CONNECTIONS_PER_NODE 控制"""
+    from elasticsearch import AsyncElasticsearch
+    return AsyncElasticsearch(
+        settings.ES_URL,
+        connections_per_node=settings.ES_CONNECTIONS_PER_NODE,
+        request_timeout=settings.ES_REQUEST_TIMEOUT,
+        retry_on_timeout=True,
+        max_retries=settings.ES_MAX_RETRIES
+    )
+
+# 全局共享的客户端 (连接池绑定在 API 进程的事件循环上，由 lifespan 创建)
+_es_client: Optional["AsyncElasticsearch"] = None
+
+def get_es_client() -> "AsyncElasticsearch":
+    global _es_client
+    if _es_client is None:
+        _es_client = create_es_client()
+    return _es_client
+
+async def close_es_client():
+    """应用关闭时释放连接池"""
+    global _es_client
+    if _es_client is not None:
+        await _es_client.close()
+        _es_client = None
+
+def clean_metadata(metadata: dict) -> dict:
+    """
+    清洗 metadata，移除空值
+    ES 的动态映射非常敏感，如果它认为某个字段是 Date，传空字符串就会报错
+    """
+    clean = {}
     for k, v in metadata.items():
         # 剔除空字符串、None，以及可能导致问题的复杂对象
         if v == "" or v is None:
             continue
         # 确保值是基本类型
         if isinstance(v, (str, int, float, bool)):
-            clean_metadata[k] = v
+            clean[k] = v
         else:
             # 其他类型转字符串，求稳
-            clean_metadata[k] = str(v)
+            clean[k] = str(v)
+    return clean
 
-    doc_data = {
-        "content": content,
-        **clean_metadata
+def build_index_action(doc_id: str, content: str, metadata: dict) -> Dict[str, Any]:
+    """构造一条 bulk 写入动作 (带数据清洗)"""
+    return {
+        "_index": settings.ES_INDEX,
+        "_id": doc_id,
+        "_source": {
+            "content": content,
+            **clean_metadata(metadata)
+        }
     }
-    
+
+# --- 摄取链路 (同步客户端) ---
+# 上传任务线程、批量摄取脚本都在普通线程里写 ES：用一个进程内共享的同步客户端 (自带连接池)，
+# 每个窗口 / 每个文件复用同一批连接；索引是否存在每个进程只检查一次。
+# 不与 API 事件循环上的异步客户端混用，也不在调用方线程里另起事件循环。
+_sync_client: Optional["Elasticsearch"] = None
+_sync_lock = threading.Lock()
+_index_ready = False
+
+def get_sync_es_client() -> "Elasticsearch":
+    global _sync_client
+    if _sync_client is None:
+        with _sync_lock:
+            if _sync_client is None:
+                from elasticsearch import Elasticsearch
+                _sync_client = Elasticsearch(
+                    settings.ES_URL,
+                    connections_per_node=settings.ES_CONNECTIONS_PER_NODE,
+                    request_timeout=settings.ES_REQUEST_TIMEOUT,
+                    retry_on_timeout=True,
+                    max_retries=settings.ES_MAX_RETRIES
+                )
+    return _sync_client
+
+def close_sync_es_client():
+    global _sync_client, _index_ready
+    with _sync_lock:
+        client, _sync_client = _sync_client, None
+        _index_ready = False
+    if client is not None:
+        client.close()
+
+def create_index_if_not_exists(client: Optional["Elasticsearch"] = None):
+    """创建索引 (每个进程成功检查一次后不再重复请求)"""
+    global _index_ready
+    if _index_ready:
+        return
+    client = client or get_sync_es_client()
     try:
-        es_client.index(
-            index=settings.ES_INDEX, 
-            id=doc_id, 
-            document=doc_data
-        )
+        if not client.indices.exists(index=settings.ES_INDEX):
+            print(f"正在创建 ES 索引: {settings.ES_INDEX} ...")
+            client.options(ignore_status=400).indices.create(index=settings.ES_INDEX, mappings=INDEX_MAPPINGS)
+            print(f"ES 索引 '{settings.ES_INDEX}' 创建成功")
+        _index_ready = True
+    except Exception as e:
+        print(f"创建索引失败: {e}")
+
+def delete_index(client: Optional["Elasticsearch"] = None) -> bool:
+    """删除整个索引 (重置知识库时使用)，返回索引原先是否存在"""
+    global _index_ready
+    client = client or get_sync_es_client()
+    response = client.options(ignore_status=404).indices.delete(index=settings.ES_INDEX)
+    _index_ready = False
+    return bool(response.body.get("acknowledged"))
+
+def index_documents(
+    actions: Iterable[Dict[str, Any]],
+    client: Optional["Elasticsearch"] = None
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    流式 bulk 写入：按 ES_BULK_CHUNK_SIZE 分批提交，429 等可重试错误按指数退避重试。
+    返回 (成功条数, 失败条目列表)，单条失败不会中断整批写入。
+    """
+    from elasticsearch.helpers import streaming_bulk
+    client = client or get_sync_es_client()
+    create_index_if_not_exists(client)
+    success_count = 0
+    errors: List[Dict[str, Any]] = []
+
+    try:
+        for ok, item in streaming_bulk(
+            client,
+            actions,
+            chunk_size=settings.ES_BULK_CHUNK_SIZE,
+            max_retries=settings.ES_BULK_MAX_RETRIES,
+            initial_backoff=settings.ES_BULK_INITIAL_BACKOFF,
+            raise_on_error=False,
+            raise_on_exception=False
+        ):
+            if ok:
+                success_count += 1
+            else:
+                errors.append(item)
+                # item 形如 {"index": {"_id": ..., "status": ..., "error": ...}}
+                info = next(iter(item.values()), {})
+                print(f"写入 ES 失败 (ID: {info.get('_id')}, status: {info.get('status')}): {info.get('error')}")
+    except Exception as e:
+        # 连接层错误 (客户端自身的重试也已用完)，剩余文档无法写入
+        print(f"ES bulk 写入中断 (已成功 {success_count} 条): {e}")
+        errors.append({"error": str(e)})
+
+    return success_count, errors
+
+def delete_documents(
+    doc_ids: List[str],
+    source: Optional[str] = None,
+    client: Optional["Elasticsearch"] = None
+) -> int:
+    """
+    按 ID 批量删除片段；传入 source 时再按来源删除剩余的片段 (清理旧版 ID 规则留下的孤儿文档)。
+    不存在的文档不算失败，返回删除条数
+    """
+    from elasticsearch.helpers import streaming_bulk
+    client = client or get_sync_es_client()
+    deleted = 0
+    actions = ({"_op_type": "delete", "_index": settings.ES_INDEX, "_id": doc_id} for doc_id in doc_ids)
+    try:
+        for ok, item in streaming_bulk(
+            client,
+            actions,
+            chunk_size=settings.ES_BULK_CHUNK_SIZE,
+            max_retries=settings.ES_BULK_MAX_RETRIES,
+            initial_backoff=settings.ES_BULK_INITIAL_BACKOFF,
+            raise_on_error=False,
+            raise_on_exception=False
+        ):
+            info = next(iter(item.values()), {})
+            if ok:
+                deleted += 1
+            elif info.get("status") != 404:
+                print(f"删除 ES 文档失败 (ID: {info.get('_id')}): {info.get('error')}")
+        if source:
+            response = client.options(ignore_status=404).delete_by_query(
+                index=settings.ES_INDEX,
+                # 旧索引由动态映射生成，source 为 text 类型，同时匹配其 keyword 子字段
+                query={"bool": {"should": [
+                    {"term": {"source": source}},
+                    {"term": {"source.keyword": source}}
+                ]}},
+                conflicts="proceed"
+            )
+            deleted += response.body.get("deleted", 0)
     except Exception as e:
-        print(f"写入 ES 失败 (ID: {doc_id}): {e}")
+        print(f"ES 删除中断 (已删除 {deleted} 条): {e}")
+        raise
+    return deleted
 
-def search_keyword(query: str, k: int = 5):
+async def search_keyword(query: str, k: int = 5):
     """关键词检索"""
     try:
-        response = es_client.search(
+        response = await get_es_client().options(
+            request_timeout=settings.ES_SEARCH_TIMEOUT
+        ).search(
             index=settings.ES_INDEX,
             query={
                 "match": {
@@ -70,4 +224,13 @@ def search_keyword(query: str, k: int = 5):
         return response["hits"]["hits"]
     except Exception as e:
         print(f"ES 检索失败: {e}")
-        return []
\ No newline at end of file
+        return []
+
+async def get_documents_by_ids(doc_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """按 chunk_id 批量取回片段 (一次 mget)，返回 {chunk_id: _source}，不存在的 ID 不出现在结果里"""
+    if not doc_ids:
+        return {}
+    response = await get_es_client().options(
+        request_timeout=settings.ES_SEARCH_TIMEOUT
+    ).mget(index=settings.ES_INDEX, ids=doc_ids)
+    return {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
@@ -0,0 +1,138 @@
+# app/services/ingestion_job_service.py
+import os
+import time
+import uuid
+import tempfile
+import threading
+import redis as redis_sync # type: ignore
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.services.cache_service import get_redis_client
+
+# --- 上传摄取任务 ---
+# 上传接口只把文件分块写入临时文件 (spool) 并登记任务，立即返回 job_id；
+# 解析、向量化与写入在有界线程池中执行，不占用事件循环。
+# 任务状态存在 Redis Hash 中，多个 API worker 都能查询。
+
+INT_FIELDS = ("chunks", "duplicates", "pages", "es_indexed", "es_failed", "created_at", "updated_at")
+
+class IngestQueueFullError(Exception):
+    """排队与执行中的任务数已达上限"""
+
+_executor = ThreadPoolExecutor(max_workers=settings.INGEST_MAX_WORKERS, thread_name_prefix="ingest")
+# 排队 + 执行中的任务总数上限，超出时拒绝新的上传
+_slots = threading.BoundedSemaphore(settings.INGEST_MAX_PENDING)
+_sync_client: Optional[redis_sync.Redis] = None
+
+def _job_key(job_id: str) -> str:
+    return f"rag_ingest_job:{job_id}"
+
+def _get_sync_client() -> redis_sync.Redis:
+    """任务在线程池中运行，使用同步客户端更新状态"""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis_sync.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _sync_client
+
+def _encode_fields(fields: Dict[str, Any]) -> Dict[str, str]:
+    return {key: str(value) for key, value in fields.items() if value is not None}
+
+def _update_job(job_id: str, **fields):
+    fields["updated_at"] = int(time.time())
+    try:
+        client = _get_sync_client()
+        pipe = client.pipeline()
+        pipe.hset(_job_key(job_id), mapping=_encode_fields(fields))
+        pipe.expire(_job_key(job_id), settings.INGEST_JOB_TTL)
+        pipe.execute()
+    except Exception as e:
+        print(f"更新摄取任务状态失败 ({job_id}): {e}")
+
+async def spool_upload(file: UploadFile, job_id: str) -> str:
+    """按固定大小分块把上传内容写入临时文件，文件名带 job_id，不会与其他上传冲突"""
+    os.makedirs(settings.INGEST_SPOOL_DIR, exist_ok=True)
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    fd, spool_path = tempfile.mkstemp(dir=settings.INGEST_SPOOL_DIR, prefix=f"{job_id}-", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(settings.INGEST_UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await run_in_threadpool(out.write, chunk)
+    except Exception:
+        os.remove(spool_path)
+        raise
+    return spool_path
+
+def _run_job(job_id: str, spool_path: str, filename: str):
+    # 摄取链路依赖 pymupdf、langchain_community 等，在第一个任务执行时才导入
+    from app.services.ingestion_service import process_and_embed_document
+    last_info: Dict[str, Any] = {}
+
+    def report(stage: str, fraction: float, **info):
+        last_info.update(info)
+        _update_job(job_id, stage=stage, progress=round(fraction, 3), **info)
+
+    try:
+        _update_job(job_id, status="running", stage="started")
+        chunks = process_and_embed_document(spool_path, source_name=filename, progress=report)
+        # 片段全部与已有内容重复时也算成功
+        if chunks == 0 and not last_info.get("duplicates"):
+            _update_job(job_id, status="failed", chunks=0, error="未提取到文本")
+        else:
+            _update_job(job_id, status="succeeded", progress=1.0, chunks=chunks)
+    except Exception as e:
+        print(f"摄取任务失败 ({job_id}): {e}")
+        _update_job(job_id, status="failed", error=str(e))
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        _slots.release()
+
+async def submit_ingest_job(file: UploadFile) -> Dict[str, Any]:
+    """
+    写入临时文件并提交任务，返回初始状态。队列已满时抛出 IngestQueueFullError
+    """
+    if not _slots.acquire(blocking=False):
+        raise IngestQueueFullError()
+    job_id = uuid.uuid4().hex
+    filename = os.path.basename(file.filename or job_id)
+    spool_path = None
+    try:
+        spool_path = await spool_upload(file, job_id)
+        now = int(time.time())
+        status = {
+            "job_id": job_id,
+            "filename": filename,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0.0,
+            "created_at": now,
+            "updated_at": now
+        }
+        client = get_redis_client()
+        await client.hset(_job_key(job_id), mapping=_encode_fields(status))
+        await client.expire(_job_key(job_id), settings.INGEST_JOB_TTL)
+        _executor.submit(_run_job, job_id, spool_path, filename)
+    except Exception:
+        if spool_path and os.path.exists(spool_path):
+            os.remove(spool_path)
+        _slots.release()
+        raise
+    return status
+
+async def get_ingest_job(job_id: str) -> Optional[Dict[str, Any]]:
+    data = await get_redis_client().hgetall(_job_key(job_id))
+    if not data:
+        return None
+    status: Dict[str, Any] = dict(data)
+    for field in INT_FIELDS:
+        if field in status:
+            status[field] = int(status[field])
+    if "progress" in status:
+        status["progress"] = float(status["progress"])
+    return status
@@ -1,69 +1,279 @@
 # app/services/ingestion_service.py
 import os
-from typing import List
+import json
+import hashlib
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import pymupdf
 from minio import Minio
 from langchain_community.document_loaders import PyMuPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 from langchain_milvus import Milvus
-from langchain_core.embeddings import Embeddings 
 from app.core.config import settings
-from app.core.model_loader import get_embedding_model 
-from app.services.es_service import create_index_if_not_exists, index_document 
-
-# --- 1. 定义适配器类 (必须包含在这里) ---
-class GlobalLazyEmbeddings(Embeddings):
-    def __init__(self):
-        # 从全局加载器获取模型
-        model = get_embedding_model()
-        if model is None:
-            raise ValueError("Fatal Error: Embedding model failed to initialize. Please check docker logs.")
-        self.model = model
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        # 开启 normalize_embeddings 以优化余弦相似度
-        embeddings = self.model.encode(texts, normalize_embeddings=True)
-        return embeddings.tolist()
-
-    def embed_query(self, text: str) -> List[float]:
-        embedding = self.model.encode(text, normalize_embeddings=True)
-        return embedding.tolist()
+from app.services.minio_service import get_shared_minio_client, ensure_bucket, upload_file
+from app.services.es_service import build_index_action, index_documents, delete_documents
+from app.services.manifest_service import IngestManifest, file_sha256
+from app.services.dedup_service import SimHashIndex, dedup_splits, invalidate_dependents
+from app.services.milvus_service import build_index_params, get_connection_args, get_shared_embeddings, invalidate_vector_store
+from app.services.cache_service import bump_corpus_version
+# --- 1. 适配器类 (与检索链路共用) ---
+from app.core.embeddings import GlobalLazyEmbeddings
+
+def make_chunk_id(source: str, index: int, content: str) -> str:
+    """由来源文件、片段序号与正文生成确定性的片段 ID"""
+    return hashlib.md5(f"{source}\x00{index}\x00{content}".encode("utf-8")).hexdigest()
 
 # --- Minio 初始化 ---
 def init_minio_client():
-    """初始化 Minio 客户端"""
-    return Minio(
-        settings.MINIO_ENDPOINT,
-        access_key=settings.MINIO_ACCESS_KEY,
-        secret_key=settings.MINIO_SECRET_KEY,
-        secure=settings.MINIO_SECURE
-    )
+    """Minio 客户端 (进程内共享，见 minio_service)"""
+    return get_shared_minio_client()
 
-def upload_to_minio(file_path: str, object_name: str) -> str:
+# --- Minio 上传 ---
+def upload_to_minio(file_path: str, object_name: str, client: Optional[Minio] = None) -> str:
     """
-    将文件上传到 Minio，并返回下载链接（或桶内路径）
+    将文件上传到 Minio，并返回下载链接（或桶内路径）。
+    默认使用进程内共享的客户端，桶是否存在每个进程只检查一次
     """
-    client = init_minio_client()
     bucket_name = settings.MINIO_BUCKET_NAME
 
-    # 1. 检查桶是否存在，不存在则创建
-    if not client.bucket_exists(bucket_name):
-        print(f"Bucket '{bucket_name}' 不存在，正在创建...")
-        client.make_bucket(bucket_name)
+    # 1. 检查桶是否存在
+    client = client or get_shared_minio_client()
+    ensure_bucket(client)
     
-    # 2. 上传文件
+    # 2. 上传文件 (分片上传)
     print(f"正在上传文件 {object_name} 到 Minio...")
-    client.fput_object(bucket_name, object_name, file_path)
+    upload_file(file_path, object_name, client)
     print(f"上传成功！")
     
     return f"{bucket_name}/{object_name}"
 
-def process_and_embed_document(file_path: str, collection_name: str = settings.COLLECTION_NAME):
+def _build_loader(file_path: str):
+    if file_path.lower().endswith(".pdf"):
+        return PyMuPDFLoader(file_path)
+    if file_path.lower().endswith(".txt"):
+        return TextLoader(file_path, encoding="utf-8")
+    return None
+
+def _build_splitter() -> RecursiveCharacterTextSplitter:
+    # 优化切分参数：针对 BGE 模型和中文优化
+    return RecursiveCharacterTextSplitter(
+        chunk_size=600, 
+        chunk_overlap=100,
+        separators=["\n\n", "\n", "。", "！", "？", " ", ""],
+        # 记录片段在页内的字符偏移 (metadata 的 start_index)，检索后据此合并相邻片段
+        add_start_index=True
+    )
+
+def count_pages(file_path: str) -> Optional[int]:
+    """PDF 总页数 (只读目录信息，不解析内容)，用于上报进度"""
+    if not file_path.lower().endswith(".pdf"):
+        return None
+    try:
+        with pymupdf.open(file_path) as pdf:
+            return pdf.page_count
+    except Exception:
+        return None
+
+def iter_split_windows(
+    file_path: str,
+    minio_path: str,
+    source_name: Optional[str] = None,
+    window_pages: int = settings.INGEST_WINDOW_PAGES
+) -> Iterator[Tuple[int, List[Document]]]:
+    """
+    逐页读取 (lazy_load)，每凑满 window_pages 页切分一次，产出 (已读页数, 该窗口的片段)。
+    切分本来就按页进行，分窗口得到的片段与一次性切分完全相同；内存只与窗口大小有关
+    """
+    file_name = source_name or os.path.basename(file_path)
+
+    print(f"正在解析文档: {file_path}")
+    loader = _build_loader(file_path)
+    if loader is None:
+        print("不支持的文件格式")
+        return
+
+    text_splitter = _build_splitter()
+    chunk_index = 0
+    pages_read = 0
+    window: List[Document] = []
+
+    def split_window() -> List[Document]:
+        nonlocal chunk_index
+        splits = text_splitter.split_documents(window)
+        # 注入元数据 (Metadata)
+        for doc in splits:
+            doc.metadata["source"] = file_name
+            doc.metadata["minio_path"] = minio_path
+            # 稳定的片段 ID，同时写入 Milvus 与 ES，检索融合时据此去重
+            doc.metadata["chunk_id"] = make_chunk_id(file_name, chunk_index, doc.page_content)
+            chunk_index += 1
+        return splits
+
+    for page in loader.lazy_load():
+        window.append(page)
+        pages_read += 1
+        if len(window) >= window_pages:
+            yield pages_read, split_window()
+            window = []
+    if window:
+        yield pages_read, split_window()
+
+def load_and_split(file_path: str, minio_path: str, source_name: Optional[str] = None) -> List[Document]:
+    """
+    解析 PDF/TXT 并切分，注入来源与 chunk_id 等元数据。
+    纯 CPU 计算、输入输出均可序列化，批量摄取时在进程池中执行。
+    source_name 为记录的来源文件名 (默认取路径中的文件名，上传的临时文件需显式传入)
+    """
+    splits: List[Document] = []
+    for _, window_splits in iter_split_windows(file_path, minio_path, source_name):
+        splits.extend(window_splits)
+    return splits
+
+def get_ingest_vector_store(collection_name: str = settings.COLLECTION_NAME) -> Milvus:
+    """写入用的 Milvus 对象，集合不存在时按索引参数创建"""
+    return Milvus(
+        embedding_function=get_shared_embeddings(),
+        collection_name=collection_name,
+        connection_args=get_connection_args(),
+        auto_id=True,
+        # 索引参数 (MILVUS_INDEX_TYPE 等配置项)
+        index_params=build_index_params()
+    )
+
+def prepare_document(
+    file_path: str,
+    minio_path: str,
+    known_hash: Optional[str] = None,
+    source_name: Optional[str] = None
+) -> Tuple[str, Optional[List[Document]]]:
+    """
+    计算文件哈希，与清单中的哈希一致时不再解析，返回 (哈希, None)；否则返回 (哈希, 切分结果)。
+    source_name 为清单 Key / 片段来源 (批量摄取传入相对根目录的路径，不同目录下的同名文件互不干扰)
+    """
+    file_hash = file_sha256(file_path)
+    if file_hash == known_hash:
+        return file_hash, None
+    return file_hash, load_and_split(file_path, minio_path, source_name)
+
+def has_chunk_id_field(vector_store: Milvus) -> bool:
+    """
+    集合 schema 中是否有 chunk_id 标量字段。
+    引入 chunk_id 之前创建的集合没有该字段 (langchain_milvus 会丢弃 schema 之外的 metadata)，
+    对这类集合使用 chunk_id 表达式会直接报错
+    """
+    return any(field.name == "chunk_id" for field in vector_store.col.schema.fields)
+
+def delete_from_milvus(vector_store: Milvus, chunk_ids: List[str], source: Optional[str] = None, batch_size: int = 1000):
+    """
+    按 chunk_id 删除旧片段；传入 source 时再按来源删除 (清单里没有记录的文件，例如旧数据或中断的摄取)。
+    旧集合没有 chunk_id 字段时改为按来源删除
+    """
+    if vector_store.col is None:
+        return
+    expressions = []
+    if chunk_ids and not has_chunk_id_field(vector_store):
+        print("⚠️ 集合没有 chunk_id 字段 (旧版集合)，只能按来源删除旧片段；重建知识库后可按 chunk_id 精确删除")
+    else:
+        expressions = [
+            f"chunk_id in {json.dumps(chunk_ids[i:i + batch_size])}"
+            for i in range(0, len(chunk_ids), batch_size)
+        ]
+    if source:
+        expressions.append(f"source == {json.dumps(source, ensure_ascii=False)}")
+    for expr in expressions:
+        if not vector_store.delete(expr=expr):
+            print(f"Milvus 删除失败: {expr[:80]}")
+
+def remove_document_chunks(vector_store: Milvus, source: str, previous: Optional[dict]) -> int:
+    """
+    写入新片段之前删除该文件的旧片段，返回 ES 中删除的条数。
+    清单中有记录时按记录的 chunk_id 精确删除，没有记录时按来源兜底删除
+    """
+    chunk_ids = previous.get("chunk_ids", []) if previous else []
+    fallback_source = None if previous else source
+    milvus_source = fallback_source
+    if chunk_ids and vector_store.col is not None and not has_chunk_id_field(vector_store):
+        # 旧集合的片段没有 chunk_id，Milvus 侧按来源删除 (ES 以 chunk_id 为文档 _id，不受影响)
+        milvus_source = source
+    delete_from_milvus(vector_store, chunk_ids, milvus_source)
+    deleted = delete_documents(chunk_ids, fallback_source)
+    if deleted:
+        print(f"已删除 '{source}' 的旧片段 (ES {deleted} 条)")
+    return deleted
+
+def embed_splits(splits: List[Document]) -> np.ndarray:
+    """计算片段向量 (float32 矩阵)"""
+    return get_shared_embeddings().encode_documents([doc.page_content for doc in splits])
+
+def write_to_milvus(vector_store: Milvus, splits: List[Document], embeddings: Optional[Sequence] = None):
+    """
+    写入 Milvus；传入已算好的向量时不再重复计算。
+    embeddings 可以是 float32 矩阵：按行切成视图交给 pymilvus，不转换成 Python 浮点列表
+    """
+    if embeddings is None:
+        embeddings = embed_splits(splits)
+    vector_store.add_embeddings(
+        texts=[doc.page_content for doc in splits],
+        embeddings=list(embeddings),
+        metadatas=[doc.metadata for doc in splits]
+    )
+
+def write_to_es(splits: List[Document]) -> Tuple[int, list]:
+    """bulk 批量写入 Elasticsearch，返回 (成功条数, 错误列表)"""
+    actions = (
+        build_index_action(
+            # 与 Milvus 中的 chunk_id 保持一致
+            doc_id=doc.metadata["chunk_id"],
+            content=doc.page_content,
+            metadata=doc.metadata
+        )
+        for doc in splits
+    )
+    return index_documents(actions)
+
+ProgressCallback = Callable[..., None]
+
+def _report(progress: Optional[ProgressCallback], stage: str, fraction: float, **info):
+    if progress is not None:
+        try:
+            progress(stage, fraction, **info)
+        except Exception as e:
+            print(f"上报摄取进度失败: {e}")
+
+def process_and_embed_document(
+    file_path: str,
+    collection_name: str = settings.COLLECTION_NAME,
+    source_name: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None
+):
     """
     全流程处理：上传 Minio -> 解析 PDF/TXT -> 切分 -> 向量化 -> 存入 Milvus
+    内容与上次摄取相同的文件直接跳过；内容变化时先删除旧片段。
+    progress(stage, fraction, **info) 用于上报各阶段进度 (上传任务的状态查询)
     """
-    file_name = os.path.basename(file_path)
+    file_name = source_name or os.path.basename(file_path)
+
+    # --- 步骤 0: 对照摄取清单 ---
+    _report(progress, "hashing", 0.0)
+    manifest = IngestManifest(collection_name)
+    # 连接 Milvus
+    vector_store = get_ingest_vector_store(collection_name)
+    collection_created = vector_store.col is None
+    if collection_created and len(manifest):
+        # 集合不存在 (首次摄取或已被重置)：清单里的记录都已失效，不能再按哈希跳过
+        print("目标集合不存在，忽略并清空该集合的摄取清单")
+        manifest.clear()
+    previous = manifest.get(file_name)
+    file_hash = file_sha256(file_path)
+    if previous and previous.get("hash") == file_hash:
+        print(f"文件内容未变化，跳过: {file_name}")
+        chunks = len(previous.get("chunk_ids", []))
+        _report(progress, "skipped", 1.0, chunks=chunks)
+        return chunks
     
     # --- 步骤 1: 上传原始文件到 Minio ---
+    _report(progress, "uploading", 0.05)
     try:
         minio_path = upload_to_minio(file_path, file_name)
     except Exception as e:
@@ -71,74 +281,79 @@ def process_and_embed_document(file_path: str, collection_name: str = settings.C
         # 如果上传失败，我们可以选择继续或者返回，这里演示继续处理
         minio_path = f"local_error/{file_name}"
 
-    # --- 步骤 2: 加载与切分文档 ---
-    print(f"正在解析文档: {file_path}")
-    loader = None
-    if file_path.lower().endswith(".pdf"):
-        loader = PyMuPDFLoader(file_path)
-    elif file_path.lower().endswith(".txt"):
-        loader = TextLoader(file_path, encoding="utf-8")
+    # --- 步骤 2~4: 按页窗口流式解析、切分、向量化，并逐窗口写入 Milvus 与 ES ---
+    _report(progress, "parsing", 0.1)
+    total_pages = count_pages(file_path)
+    print(f"正在流式写入 Milvus ({settings.MILVUS_HOST}) 与 Elasticsearch (每 {settings.INGEST_WINDOW_PAGES} 页一批)...")
+
+    # 先删除旧片段，避免新旧片段并存
+    deleted = remove_document_chunks(vector_store, file_name, previous)
+
+    # 近似重复片段去重：签名索引由清单重建，本文件旧的签名先移除
+    dedup_index = None
+    if settings.INGEST_DEDUP_ENABLED:
+        dedup_index = SimHashIndex.from_manifest(manifest)
+        dedup_index.remove_source(file_name)
+        if previous:
+            invalidate_dependents(manifest, file_name)
+
+    chunk_ids: List[str] = []
+    signatures: List[str] = []
+    linked_sources: set = set()
+    duplicates = 0
+    es_success = 0
+    es_errors: list = []
+    for pages_read, splits in iter_split_windows(file_path, minio_path, file_name):
+        if dedup_index is not None and splits:
+            result = dedup_splits(dedup_index, file_name, splits)
+            splits = result.kept
+            signatures.extend(result.signatures)
+            linked_sources |= result.linked_sources
+            duplicates += result.duplicates
+        if not splits:
+            continue
+        # 写入数据 (窗口处理完即释放)
+        write_to_milvus(vector_store, splits, embed_splits(splits))
+        window_success, window_errors = write_to_es(splits)
+        es_success += window_success
+        es_errors.extend(window_errors)
+        chunk_ids.extend(doc.metadata["chunk_id"] for doc in splits)
+
+        fraction = pages_read / total_pages if total_pages else 0.5
+        _report(progress, "writing", 0.1 + 0.85 * min(fraction, 1.0), chunks=len(chunk_ids), pages=pages_read)
+
+    if not chunk_ids and not duplicates:
+        # 旧片段已删除：仍要记入清单并更新版本，否则清单与缓存还认为文件在库里
+        print("未提取到文本。")
     else:
-        print("不支持的文件格式")
-        return 0
+        print(f"写入 Milvus 完成！共 {len(chunk_ids)} 个文本块" + (f"，跳过重复片段 {duplicates} 个" if duplicates else ""))
+    if collection_created and chunk_ids:
+        # 集合是本次新建的，让检索侧缓存的 (空) 向量库对象失效
+        invalidate_vector_store(collection_name)
 
-    if not loader:
-        return 0
+    if es_errors:
+        print(f"ES 写入完成，成功 {es_success} 条，失败 {len(es_errors)} 条")
+    elif chunk_ids:
+        print(f"ES 写入完成！共 {es_success} 条")
 
-    documents = loader.load()
-    
-    # 优化切分参数：针对 BGE 模型和中文优化
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=600, 
-        chunk_overlap=100,
-        separators=["\n\n", "\n", "。", "！", "？", " ", ""]
-    )
-    splits = text_splitter.split_documents(documents)
-    
-    if not splits:
-        print("未提取到文本，跳过。")
-        return 0
+    # ES 有写入失败时不记入清单，下次摄取会重新处理该文件
+    if not es_errors:
+        manifest.record(
+            file_name, file_hash, chunk_ids,
+            signatures=signatures, linked_sources=sorted(linked_sources), duplicates=duplicates
+        )
+    # 被移除的依赖文件记录也要落盘
+    manifest.save()
 
-    # --- 步骤 3: 注入元数据 (Metadata) ---
-    for doc in splits:
-        doc.metadata["source"] = file_name
-        doc.metadata["minio_path"] = minio_path
+    # 写入了新片段或删除了旧片段时知识库内容已变化，旧的答案缓存与检索缓存随版本号一起失效
+    if chunk_ids or deleted or (previous and previous.get("chunk_ids")):
+        try:
+            bump_corpus_version(collection_name)
+        except Exception as e:
+            print(f"更新知识库版本失败: {e}")
 
-    # --- 步骤 4: 向量化并存入 Milvus ---
-    print(f"正在将 {len(splits)} 个文本块存入 Milvus ({settings.MILVUS_HOST})...")
-    
-    embeddings = GlobalLazyEmbeddings()
-    
-    # 连接 Milvus
-    vector_store = Milvus(
-        embedding_function=embeddings,
-        collection_name=collection_name,
-        connection_args={
-            "host": settings.MILVUS_HOST,
-            "port": str(settings.MILVUS_PORT), 
-            "alias": "default" 
-        },
-        auto_id=True,
-        # 索引参数
-        index_params={"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 1024}}
+    _report(
+        progress, "done", 1.0,
+        chunks=len(chunk_ids), duplicates=duplicates, es_indexed=es_success, es_failed=len(es_errors)
     )
-    
-    # 写入数据
-    vector_store.add_documents(splits)
-    print("写入 Milvus 完成！")
-    
-    # 同时存入 Elasticsearch 
-    print("正在同步写入 Elasticsearch...")
-    create_index_if_not_exists()
-    
-    for i, doc in enumerate(splits):
-        # 构造一个唯一的 ID，方便后续管理
-        doc_id = f"{file_name}_{i}"
-        index_document(
-            doc_id=doc_id,
-            content=doc.page_content,
-            metadata=doc.metadata
-        )
-    print("ES 写入完成！")
-    
-    return len(splits)
\ No newline at end of file
+    return len(chunk_ids)
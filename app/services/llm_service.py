@@ -0,0 +1,172 @@
+# app/services/llm_service.py
+import random
+import asyncio
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from pydantic import SecretStr
+from app.core.config import settings
+from app.core.metrics import counter
+
+if TYPE_CHECKING:
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+# --- 共享的 LLM 客户端 ---
+# 每次请求都新建 ChatOpenAI 会连带新建 HTTP 客户端，到 LLM 服务的 TCP + TLS 握手每次都要重来。
+# 这里整个进程共用一个长连接的 httpx.AsyncClient (可选 HTTP/2，多路复用同一条连接)，
+# ChatOpenAI 实例按 (base_url, 模型, 参数) 缓存复用。
+# 重试由传输层统一处理 (带抖动的指数退避)，ChatOpenAI 自身的重试关闭，避免两层叠加。
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_retries = counter("llm_http_retries")
+
+class RetryTransport:
+    """
+    包装 httpx 的异步传输层：连接失败或返回 429 / 5xx 时重试。
+    只重试连接阶段的错误与明确的错误状态码；请求已发出后的读超时不重试，避免重复生成。
+    (按 httpx.AsyncBaseTransport 的接口实现，不继承它，模块导入时不加载 httpx)
+    """
+
+    def __init__(self, transport, max_retries: int, backoff: float):
+        self.transport = transport
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def _delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), 30.0)
+            except ValueError:
+                pass
+        # Full jitter: 在 [0, backoff * 2^attempt] 内随机，避免大量请求同时重试
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    async def handle_async_request(self, request):
+        import httpx
+        attempt = 0
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._delay(attempt, None)
+            else:
+                if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    return response
+                delay = self._delay(attempt, response.headers.get("retry-after"))
+                await response.aclose()
+            _retries.inc()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    async def __aenter__(self):
+        await self.transport.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.transport.__aexit__(*args)
+
+def create_http_client() -> "httpx.AsyncClient":
+    import httpx
+
+    http2 = settings.LLM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("⚠️ 未安装 h2 (httpx[http2])，LLM 连接使用 HTTP/1.1")
+            http2 = False
+
+    transport = httpx.AsyncHTTPTransport(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY
+        )
+    )
+    return httpx.AsyncClient(
+        transport=RetryTransport(transport, settings.LLM_MAX_RETRIES, settings.LLM_RETRY_BACKOFF),
+        timeout=httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+    )
+
+_http_client: Optional["httpx.AsyncClient"] = None
+_chat_models: Dict[Tuple, "ChatOpenAI"] = {}
+_close_hooks: List[Callable[[], None]] = []
+_lock = threading.Lock()
+
+def on_llm_clients_closed(hook: Callable[[], None]):
+    """注册关闭回调：缓存了 ChatOpenAI 的对象 (例如 Agent 执行器) 在连接池关闭后需要丢弃"""
+    _close_hooks.append(hook)
+    return hook
+
+def get_http_client() -> "httpx.AsyncClient":
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _http_client = create_http_client()
+    return _http_client
+
+def chat_model_key(
+    api_key: SecretStr = settings.DEEPSEEK_API_KEY,
+    base_url: str = settings.LLM_BASE_URL,
+    model: str = settings.LLM_MODEL_NAME,
+    temperature: float = 0.3,
+    streaming: bool = False
+) -> Tuple:
+    """(base_url, 模型, 参数, 密钥哈希)：相同的 Key 对应同一个 ChatOpenAI (合并请求也按它区分)"""
+    return (
+        base_url, model, temperature, streaming,
+        hashlib.sha256(api_key.get_secret_value().encode("utf-8")).hexdigest()
+    )
+
+def get_chat_model(
+    api_key: SecretStr = settings.DEEPSEEK_API_KEY,
+    base_url: str = settings.LLM_BASE_URL,
+    model: str = settings.LLM_MODEL_NAME,
+    temperature: float = 0.3,
+    streaming: bool = False
+) -> "ChatOpenAI":
+    """按 chat_model_key() 复用 ChatOpenAI，所有实例共用同一个 HTTP 连接池"""
+    key = chat_model_key(api_key, base_url, model, temperature, streaming)
+    chat_model = _chat_models.get(key)
+    if chat_model is None:
+        # langchain_openai (连同 openai SDK) 只在第一次使用时导入，不拖慢 API 启动
+        from langchain_openai import ChatOpenAI
+        http_client = get_http_client()
+        with _lock:
+            chat_model = _chat_models.get(key)
+            if chat_model is None:
+                chat_model = ChatOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    model=model,
+                    temperature=temperature,
+                    streaming=streaming,
+                    http_async_client=http_client,
+                    # 重试交给共享传输层
+                    max_retries=0
+                )
+                _chat_models[key] = chat_model
+    return chat_model
+
+async def close_llm_clients():
+    """应用关闭时释放连接池"""
+    global _http_client
+    with _lock:
+        client, _http_client = _http_client, None
+        _chat_models.clear()
+    for hook in _close_hooks:
+        try:
+            hook()
+        except Exception as e:
+            print(f"LLM 客户端关闭回调出错: {e}")
+    if client is not None:
+        await client.aclose()
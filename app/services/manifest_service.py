@@ -0,0 +1,154 @@
+# app/services/manifest_service.py
+import os
+import json
+import fcntl
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+
+# --- 摄取清单 (manifest) ---
+# 记录每个来源文件的内容哈希与写入的 chunk_id：
+# 哈希未变的文件直接跳过；内容变化时先按旧的 chunk_id 删除 Milvus / ES 中的片段再写入新片段。
+# 清单按间隔落盘 (临时文件 + os.replace 原子替换)，批量摄取中断后重新运行即可从断点继续。
+# 上传接口与批量脚本可能同时写清单：落盘时加文件锁，重新读取磁盘上的清单后只合并本进程改动的条目。
+# 同一个清单文件按集合分区 ({"collections": {集合名: {来源: 条目}}})，每个 IngestManifest 只读写自己集合的条目。
+
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class IngestManifest:
+    def __init__(
+        self,
+        collection_name: str = settings.COLLECTION_NAME,
+        path: str = settings.INGEST_MANIFEST_PATH,
+        checkpoint_interval: float = 5.0
+    ):
+        self.collection_name = collection_name
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        # 本进程改动过的来源 (值为 None 表示已删除)
+        self._changes: Dict[str, Optional[Dict[str, Any]]] = {}
+        # clear() 之后下次落盘不再合并磁盘上本集合的旧条目
+        self._cleared = False
+        self._last_saved = time.monotonic()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _read_file(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """读取所有集合的条目"""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            # 清单损坏时按空清单处理：所有文件重新摄取 (删除按来源兜底，不会产生重复)
+            print(f"读取摄取清单失败，将重新摄取全部文件: {e}")
+            return {}
+        if "collections" in data:
+            return data["collections"]
+        # 旧版清单不分集合，当时只会写入默认集合
+        return {settings.COLLECTION_NAME: data.get("files", {})}
+
+    def _load(self):
+        self._entries = self._read_file().get(self.collection_name, {})
+        if self._entries:
+            print(f"已加载摄取清单 ({self.collection_name}): {len(self._entries)} 个文件")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, source: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(source)
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return list(self._entries.items())
+
+    def is_unchanged(self, source: str, file_hash: str) -> bool:
+        entry = self.get(source)
+        return entry is not None and entry.get("hash") == file_hash
+
+    def record(self, source: str, file_hash: str, chunk_ids: List[str], **extra):
+        """extra 为附加字段，例如去重阶段的 signatures / linked_sources / duplicates"""
+        entry = {
+            "hash": file_hash,
+            "chunk_ids": chunk_ids,
+            "updated_at": int(time.time()),
+            **extra
+        }
+        with self._lock:
+            self._entries[source] = entry
+            self._changes[source] = entry
+
+    def remove(self, source: str):
+        with self._lock:
+            self._entries.pop(source, None)
+            self._changes[source] = None
+
+    def clear(self):
+        """
+        清空本集合的条目 (目标集合不存在 / 知识库被重置时调用)：旧条目对应的片段已经不在库里，
+        继续按哈希跳过会让这些文件永远不再被摄取。其他集合的条目不受影响
+        """
+        with self._lock:
+            self._entries = {}
+            self._changes = {}
+            self._cleared = True
+
+    def checkpoint(self):
+        """距上次落盘超过 checkpoint_interval 秒时保存"""
+        if (self._changes or self._cleared) and time.monotonic() - self._last_saved >= self.checkpoint_interval:
+            self.save()
+
+    def save(self):
+        """写临时文件后原子替换，进程中途退出也不会留下半个清单"""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            cleared, self._cleared = self._cleared, False
+            self._last_saved = time.monotonic()
+        if not changes and not cleared:
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.path + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                collections = self._read_file()
+                entries = {} if cleared else collections.get(self.collection_name, {})
+                for source, entry in changes.items():
+                    if entry is None:
+                        entries.pop(source, None)
+                    else:
+                        entries[source] = entry
+                collections[self.collection_name] = entries
+                self._write_atomic(directory, json.dumps({"collections": collections}, ensure_ascii=False))
+        except Exception:
+            # 未落盘的改动留到下次保存
+            with self._lock:
+                self._changes = {**changes, **self._changes}
+                self._cleared = self._cleared or cleared
+            raise
+
+    def _write_atomic(self, directory: str, payload: str):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".manifest-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,202 @@
+# app/services/milvus_service.py
+import json
+import time
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple, Any
+from app.core.config import settings
+from app.core.embeddings import GlobalLazyEmbeddings
+
+if TYPE_CHECKING:
+    # langchain_milvus 会导入 pymilvus / grpc，只在第一次构建向量库对象时导入
+    from langchain_milvus import Milvus
+    from langchain_core.vectorstores import VectorStoreRetriever
+
+# --- 向量库注册表 ---
+# 每个 collection 只构建一次 Milvus 对象 (构建时会 describe collection、拉取 schema 和索引信息)，
+# 之后的请求直接复用；后台按固定间隔比对 schema 指纹 (含索引类型、度量与参数)，
+# 集合被重建、字段变化或索引被重建 (scripts/rebuild_index.py) 时才重新构建。
+
+class _RegistryEntry:
+    def __init__(self, vector_store: "Milvus", fingerprint: Optional[Tuple], checked_at: float):
+        self.vector_store = vector_store
+        self.fingerprint = fingerprint
+        self.checked_at = checked_at
+
+_registry: Dict[str, _RegistryEntry] = {}
+_registry_lock = threading.Lock()
+_shared_embeddings: Optional[GlobalLazyEmbeddings] = None
+
+def get_connection_args() -> Dict[str, Any]:
+    return {
+        "host": settings.MILVUS_HOST,
+        "port": str(settings.MILVUS_PORT),
+        "alias": "default"
+    }
+
+def get_shared_embeddings() -> GlobalLazyEmbeddings:
+    """进程内共享的 Embedding 适配器"""
+    global _shared_embeddings
+    if _shared_embeddings is None:
+        _shared_embeddings = GlobalLazyEmbeddings()
+    return _shared_embeddings
+
+INDEX_TYPES = ("FLAT", "IVF_FLAT", "IVF_SQ8", "IVF_PQ", "HNSW")
+# 各索引类型可用的构建参数与检索参数
+INDEX_BUILD_PARAMS = {
+    "FLAT": (),
+    "IVF_FLAT": ("nlist",),
+    "IVF_SQ8": ("nlist",),
+    "IVF_PQ": ("nlist", "m", "nbits"),
+    "HNSW": ("M", "efConstruction"),
+}
+INDEX_SEARCH_PARAMS = {
+    "FLAT": (),
+    "IVF_FLAT": ("nprobe",),
+    "IVF_SQ8": ("nprobe",),
+    "IVF_PQ": ("nprobe",),
+    "HNSW": ("ef",),
+}
+# describe_index 返回值中随构建进度变化的字段，不计入指纹
+_INDEX_PROGRESS_KEYS = {"total_rows", "indexed_rows", "pending_index_rows", "state"}
+
+def _apply_overrides(params: Dict[str, Any], overrides: Dict[str, Any], allowed: Tuple[str, ...], index_type: str):
+    """覆盖参数；传入不属于该索引类型的参数 (例如 HNSW 的 nlist) 时报错"""
+    overrides = {key: value for key, value in overrides.items() if value is not None}
+    invalid = sorted(set(overrides) - set(allowed))
+    if invalid:
+        raise ValueError(
+            f"参数 {', '.join(invalid)} 不适用于 {index_type} 索引 (可用: {', '.join(allowed) or '无'})"
+        )
+    params.update(overrides)
+
+def build_index_params(index_type: Optional[str] = None, metric_type: Optional[str] = None, **overrides) -> Dict[str, Any]:
+    """
+    按配置生成建索引参数，overrides 可覆盖单个构建参数 (例如 nlist=2048)，值为 None 的忽略
+    """
+    index_type = (index_type or settings.MILVUS_INDEX_TYPE).upper()
+    metric_type = (metric_type or settings.MILVUS_METRIC_TYPE).upper()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type} (可选: {', '.join(INDEX_TYPES)})")
+
+    if index_type == "FLAT":
+        params: Dict[str, Any] = {}
+    elif index_type == "HNSW":
+        params = {"M": settings.MILVUS_HNSW_M, "efConstruction": settings.MILVUS_HNSW_EF_CONSTRUCTION}
+    else:
+        params = {"nlist": settings.MILVUS_INDEX_NLIST}
+        if index_type == "IVF_PQ":
+            params.update(m=settings.MILVUS_INDEX_PQ_M, nbits=settings.MILVUS_INDEX_PQ_NBITS)
+    _apply_overrides(params, overrides, INDEX_BUILD_PARAMS[index_type], index_type)
+    return {"index_type": index_type, "metric_type": metric_type, "params": params}
+
+def build_search_params(index_type: Optional[str] = None, metric_type: Optional[str] = None, **overrides) -> Dict[str, Any]:
+    """检索参数必须与集合上实际的索引类型、度量一致"""
+    index_type = (index_type or settings.MILVUS_INDEX_TYPE).upper()
+    metric_type = (metric_type or settings.MILVUS_METRIC_TYPE).upper()
+    if index_type == "HNSW":
+        params: Dict[str, Any] = {"ef": settings.MILVUS_SEARCH_EF}
+    elif index_type.startswith("IVF"):
+        params = {"nprobe": settings.MILVUS_SEARCH_NPROBE}
+    else:
+        params = {}
+    _apply_overrides(params, overrides, INDEX_SEARCH_PARAMS.get(index_type, ()), index_type)
+    return {"metric_type": metric_type, "params": params}
+
+def describe_vector_index(vector_store: "Milvus") -> Optional[Dict[str, Any]]:
+    """读取集合向量字段上的索引参数 (index_type / metric_type / params)，集合或索引不存在时返回 None"""
+    if vector_store.col is None:
+        return None
+    for index in vector_store.col.indexes:
+        if index.field_name == vector_store._vector_field:
+            return dict(index.params)
+    return None
+
+def _schema_fingerprint(vector_store: "Milvus", collection_name: str) -> Optional[Tuple]:
+    """
+    集合的 schema 指纹: collection_id + 字段列表 + 索引 (类型、度量与参数)。
+    检索参数按构建时的索引生成，索引被重建后需要重新构建 Milvus 对象。
+    集合不存在时返回 None (此时 Milvus 对象的 col 为空，需要在集合创建后重建)
+    """
+    client = vector_store.client
+    if not client.has_collection(collection_name):
+        return None
+    desc = client.describe_collection(collection_name)
+    fields = tuple((f.get("name"), str(f.get("type"))) for f in desc.get("fields", []))
+    indexes = []
+    for index_name in client.list_indexes(collection_name):
+        index = client.describe_index(collection_name, index_name) or {}
+        stable = {key: value for key, value in index.items() if key not in _INDEX_PROGRESS_KEYS}
+        indexes.append(json.dumps(stable, sort_keys=True, default=str))
+    return (desc.get("collection_id"), fields, tuple(sorted(indexes)))
+
+def _build_entry(collection_name: str) -> _RegistryEntry:
+    print(f"构建 Milvus 向量库对象: {collection_name}")
+    from langchain_milvus import Milvus
+    vector_store = Milvus(
+        embedding_function=get_shared_embeddings(),
+        collection_name=collection_name,
+        connection_args=get_connection_args(),
+        auto_id=True
+    )
+    # 按集合上实际的索引生成检索参数 (旧集合可能仍是 IVF_FLAT + L2)，
+    # 未建索引时保持为空，由 langchain_milvus 在建索引后使用默认参数
+    index = describe_vector_index(vector_store)
+    if index is not None:
+        vector_store.search_params = build_search_params(index.get("index_type"), index.get("metric_type"))
+    try:
+        fingerprint = _schema_fingerprint(vector_store, collection_name)
+    except Exception as e:
+        print(f"读取集合 schema 失败: {e}")
+        fingerprint = None
+    return _RegistryEntry(vector_store, fingerprint, time.monotonic())
+
+def _needs_rebuild(entry: _RegistryEntry, collection_name: str) -> bool:
+    """到达检查间隔时比对 schema 指纹"""
+    if time.monotonic() - entry.checked_at < settings.MILVUS_SCHEMA_CHECK_INTERVAL:
+        return False
+    entry.checked_at = time.monotonic()
+    try:
+        fingerprint = _schema_fingerprint(entry.vector_store, collection_name)
+    except Exception as e:
+        # Milvus 短暂不可用时继续使用旧对象，下个周期再检查
+        print(f"检查集合 schema 失败: {e}")
+        return False
+    if fingerprint != entry.fingerprint:
+        print(f"集合 '{collection_name}' schema 已变化，重建向量库对象")
+        return True
+    return False
+
+def get_vector_store(collection_name: str = settings.COLLECTION_NAME) -> "Milvus":
+    """
+    获取 (必要时构建) collection 对应的 Milvus 向量库对象
+    """
+    entry = _registry.get(collection_name)
+    if entry is not None and not _needs_rebuild(entry, collection_name):
+        return entry.vector_store
+
+    with _registry_lock:
+        # 双重检查：其他线程可能已经完成了重建
+        current = _registry.get(collection_name)
+        if current is not None and current is not entry:
+            return current.vector_store
+        new_entry = _build_entry(collection_name)
+        _registry[collection_name] = new_entry
+        return new_entry.vector_store
+
+def get_retriever(collection_name: str = settings.COLLECTION_NAME, k: int = 5) -> "VectorStoreRetriever":
+    """基于已缓存的向量库对象生成检索器，k 按调用方需要传入"""
+    return get_vector_store(collection_name).as_retriever(search_kwargs={"k": k})
+
+def invalidate_vector_store(collection_name: str = settings.COLLECTION_NAME):
+    """
+    丢弃缓存的向量库对象 (例如摄取流程刚创建了集合、或集合被删除)，下次访问时重建
+    """
+    with _registry_lock:
+        _registry.pop(collection_name, None)
+
+def warm_up_vector_stores():
+    """启动时预热默认集合，避免第一个请求承担构建开销"""
+    try:
+        get_vector_store(settings.COLLECTION_NAME)
+    except Exception as e:
+        print(f"预热 Milvus 向量库失败: {e}")
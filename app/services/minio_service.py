@@ -1,18 +1,214 @@
 # app/services/minio_service.py
-from minio import Minio
+import os
+import time
+import hashlib
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple
 from app.core.config import settings
 
-def get_minio_client():
+if TYPE_CHECKING:
+    from minio import Minio
+
+# minio-py 未指定 part_size 时使用的分片大小 (旧脚本上传的对象按它计算 ETag)
+DEFAULT_PART_SIZE = 5 * 1024 * 1024
+
+def get_minio_client(max_connections: int = settings.MINIO_MAX_CONNECTIONS) -> "Minio":
     """
-    初始化并返回 Minio 客户端
+    初始化并返回 Minio 客户端。
+    连接池大小默认 10，并发上传时不够用，这里按 MINIO_MAX_CONNECTIONS 设置 (其余参数与 minio-py 默认一致)
     """
+    import certifi
+    import urllib3
+    from minio import Minio
+    timeout = 300
+    http_client = urllib3.PoolManager(
+        timeout=urllib3.Timeout(connect=timeout, read=timeout),
+        maxsize=max_connections,
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+    )
     client = Minio(
         settings.MINIO_ENDPOINT,
         access_key=settings.MINIO_ACCESS_KEY,
         secret_key=settings.MINIO_SECRET_KEY,
-        secure=settings.MINIO_SECURE
+        secure=settings.MINIO_SECURE,
+        http_client=http_client
     )
     return client
 
-# 创建一个单例客户端供全局使用
-minio_client = get_minio_client()
\ No newline at end of file
+# 全局共享的单例客户端 (API 进程在 lifespan 中创建，其他调用方第一次使用时创建)
+_shared_client: Optional["Minio"] = None
+_client_lock = threading.Lock()
+_checked_buckets = set()
+_bucket_lock = threading.Lock()
+
+def get_shared_minio_client() -> "Minio":
+    global _shared_client
+    if _shared_client is None:
+        with _client_lock:
+            if _shared_client is None:
+                _shared_client = get_minio_client()
+    return _shared_client
+
+def ensure_bucket(client: Optional["Minio"] = None, bucket_name: str = settings.MINIO_BUCKET_NAME):
+    """检查桶是否存在，不存在则创建；每个进程只检查一次"""
+    client = client or get_shared_minio_client()
+    if bucket_name in _checked_buckets:
+        return
+    with _bucket_lock:
+        if bucket_name in _checked_buckets:
+            return
+        if not client.bucket_exists(bucket_name):
+            print(f"Bucket '{bucket_name}' 不存在，正在创建...")
+            client.make_bucket(bucket_name)
+        _checked_buckets.add(bucket_name)
+
+def upload_file(
+    file_path: str,
+    object_name: str,
+    client: Optional["Minio"] = None,
+    bucket_name: str = settings.MINIO_BUCKET_NAME
+):
+    """按 MINIO_PART_SIZE 分片上传 (同一份文件每次上传得到的 ETag 相同，增量同步据此比较)"""
+    client = client or get_shared_minio_client()
+    content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    return client.fput_object(
+        bucket_name,
+        object_name,
+        file_path,
+        content_type=content_type,
+        part_size=settings.MINIO_PART_SIZE,
+        num_parallel_uploads=settings.MINIO_PART_UPLOADS
+    )
+
+# --- 增量同步 ---
+# 一次 list_objects 取回桶内对象的大小与 ETag，本地文件大小一致时再计算 ETag 比较，
+# 相同的跳过，只上传新增或变化的文件；对象名保留相对路径，不同目录下的同名文件不会互相覆盖。
+
+def local_etags(file_path: str, part_sizes: Sequence[int], block_size: int = 1024 * 1024) -> List[str]:
+    """
+    一次读取同时按多个分片大小计算 S3 ETag：
+    单次上传为整个文件的 MD5，分片上传为各分片 MD5 拼接后的 MD5 加 "-分片数"
+    """
+    size = os.path.getsize(file_path)
+    whole = hashlib.md5()
+    states = [{"part_size": p, "digests": [], "current": hashlib.md5(), "filled": 0} for p in part_sizes]
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            whole.update(block)
+            for state in states:
+                view = memoryview(block)
+                while view:
+                    take = min(len(view), state["part_size"] - state["filled"])
+                    state["current"].update(view[:take])
+                    state["filled"] += take
+                    view = view[take:]
+                    if state["filled"] == state["part_size"]:
+                        state["digests"].append(state["current"].digest())
+                        state["current"], state["filled"] = hashlib.md5(), 0
+
+    etags = []
+    for state in states:
+        if size <= state["part_size"]:
+            etags.append(whole.hexdigest())
+            continue
+        if state["filled"]:
+            state["digests"].append(state["current"].digest())
+        combined = hashlib.md5(b"".join(state["digests"])).hexdigest()
+        etags.append(f"{combined}-{len(state['digests'])}")
+    return etags
+
+def list_remote_objects(
+    prefix: str = "",
+    client: Optional["Minio"] = None,
+    bucket_name: str = settings.MINIO_BUCKET_NAME
+) -> Dict[str, Tuple[int, str]]:
+    """{对象名: (大小, ETag)}"""
+    client = client or get_shared_minio_client()
+    return {
+        obj.object_name: (obj.size, obj.etag)
+        for obj in client.list_objects(bucket_name, prefix=prefix or None, recursive=True)
+        if not obj.is_dir
+    }
+
+def is_unchanged(file_path: str, remote: Optional[Tuple[int, str]]) -> bool:
+    if remote is None:
+        return False
+    remote_size, remote_etag = remote
+    if remote_size != os.path.getsize(file_path):
+        return False
+    # 本脚本按 MINIO_PART_SIZE 上传；旧对象由 minio-py 默认分片上传
+    return remote_etag in local_etags(file_path, (settings.MINIO_PART_SIZE, DEFAULT_PART_SIZE))
+
+class SyncStats:
+    def __init__(self):
+        self.uploaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_uploaded = 0
+        self.bytes_skipped = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, size: int, uploaded: bool = False, skipped: bool = False):
+        with self._lock:
+            if uploaded:
+                self.uploaded += 1
+                self.bytes_uploaded += size
+            elif skipped:
+                self.skipped += 1
+                self.bytes_skipped += size
+            else:
+                self.failed += 1
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+def object_name_for(local_path: str, local_folder: str, prefix: str = "") -> str:
+    """对象名 = 前缀 + 相对路径 (统一使用 / 分隔)"""
+    relative = os.path.relpath(local_path, local_folder).replace(os.sep, "/")
+    return f"{prefix.rstrip('/')}/{relative}" if prefix else relative
+
+def sync_files(
+    files: Iterable[str],
+    local_folder: str,
+    prefix: str = "",
+    workers: int = settings.MINIO_SYNC_WORKERS,
+    dry_run: bool = False,
+    client: Optional["Minio"] = None,
+    bucket_name: str = settings.MINIO_BUCKET_NAME
+) -> SyncStats:
+    """
+    并发同步本地文件到桶内，大小与 ETag 都一致的对象跳过
+    """
+    client = client or get_shared_minio_client()
+    ensure_bucket(client, bucket_name)
+    remote = list_remote_objects(prefix, client, bucket_name)
+    stats = SyncStats()
+
+    def sync_one(local_path: str):
+        object_name = object_name_for(local_path, local_folder, prefix)
+        size = os.path.getsize(local_path)
+        try:
+            if is_unchanged(local_path, remote.get(object_name)):
+                stats.record(size, skipped=True)
+                return
+            if dry_run:
+                print(f"[dry-run] 需要上传: {object_name}")
+            else:
+                upload_file(local_path, object_name, client, bucket_name)
+            stats.record(size, uploaded=True)
+        except Exception as e:
+            print(f"上传失败 ({object_name}): {e}")
+            stats.record(size)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(sync_one, path) for path in files]
+        for done, _ in enumerate(as_completed(futures), 1):
+            if done % 100 == 0:
+                print(f"  进度 {done}/{len(futures)} (上传 {stats.uploaded}, 跳过 {stats.skipped}, 失败 {stats.failed})", flush=True)
+    return stats
@@ -1,197 +1,299 @@
 # app/services/rag_service.py
 import json
+import heapq
 import asyncio
-from typing import AsyncGenerator, List, Optional, Any
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Dict, List, Optional, Any
 from pydantic import SecretStr
-from langchain_openai import ChatOpenAI
-from pymilvus import connections
-from langchain_core.embeddings import Embeddings 
-from app.core.model_loader import get_embedding_model 
 
-from langchain_milvus import Milvus
-from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.documents import Document
 
-from sqlalchemy.orm import Session
 from app.core.config import settings
 from app.models.user import User
-from app.models.chat import Conversation, Message
-from app.services.cache_service import get_cache, set_cache
+from app.services.cache_service import (
+    get_cache, set_cache, generate_cache_key, cache_namespace, get_corpus_version,
+    get_retrieval_cache, set_retrieval_cache
+)
+from app.services.singleflight_service import get_inflight, join_or_start
+from app.services.chat_history_service import enqueue_chat
+from app.services.semantic_cache_service import lookup_semantic_cache, add_to_semantic_cache
+from app.services.rerank_service import rerank_documents
+from app.services.context_service import pack_context
+from app.services.llm_service import chat_model_key, get_chat_model
 # 引入 ES 服务 (确保你已经创建了 app/services/es_service.py)
-from app.services.es_service import search_keyword
+from app.services.es_service import search_keyword, get_documents_by_ids
+# --- 1. 向量检索：适配器与检索器统一由向量库注册表提供 ---
+from app.core.embeddings import GlobalLazyEmbeddings
+from app.services.milvus_service import get_retriever, get_vector_store, get_shared_embeddings
 
-# --- 1. 定义适配器类 ---
-class GlobalLazyEmbeddings(Embeddings):
-    def __init__(self):
-        model = get_embedding_model()
-        if model is None:
-            raise ValueError("Fatal Error: Embedding model failed to initialize.")
-        self.model = model
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        embeddings = self.model.encode(texts, normalize_embeddings=True)
-        return embeddings.tolist()
+# --- 2. RRF 融合算法 (核心新增) ---
+def get_chunk_key(doc: Document, use_content_key: bool = False) -> str:
+    """
+    文档片段的唯一标识：优先使用摄取时写入 Milvus 和 ES 的 chunk_id，
+    旧数据缺少 chunk_id 时退化为正文哈希
+    """
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id and not use_content_key:
+        return str(chunk_id)
+    return hashlib.md5(doc.page_content.encode("utf-8")).hexdigest()
 
-    def embed_query(self, text: str) -> List[float]:
-        embedding = self.model.encode(text, normalize_embeddings=True)
-        return embedding.tolist()
+def _fusion_settled(scores: Dict[str, float], top_n: int, bound: float) -> bool:
+    """
+    判断 top_n 是否已经确定：剩余名次最多还能给任何片段加 bound 分，
+    若前 top_n+1 名之间的分差都不小于 bound，且第 top_n 名不低于 bound (未出现的片段最多得 bound 分)，
+    则后续名次既不会改变 top_n 的成员，也不会改变它们的先后顺序
+    """
+    ordered = heapq.nlargest(top_n + 1, scores.values())
+    if len(ordered) < top_n or ordered[top_n - 1] < bound:
+        return False
+    return all(ordered[i] - ordered[i + 1] >= bound for i in range(len(ordered) - 1))
 
-# --- 2. RRF 融合算法 (核心新增) ---
-def reciprocal_rank_fusion(results: List[List[Any]], k=60):
+def reciprocal_rank_fusion(
+    results: List[List[Any]],
+    k: int = 60,
+    weights: Optional[List[float]] = None,
+    top_n: Optional[int] = None
+) -> List[Document]:
     """
     RRF 融合算法：合并多路检索结果
-    :param results: 多个列表，包含 Document 或 ES hit 对象
+    :param results: 多个列表，每个列表按相关度排好序 (Document 对象)
+    :param k: RRF 平滑常数
+    :param weights: 每一路的权重，默认均为 1
+    :param top_n: 只需要前 top_n 个结果时，名次确定后提前结束 (此时 rrf_score 为已累计的分数)
     """
-    fused_scores = {}
-    
-    for doc_list in results:
-        for rank, item in enumerate(doc_list):
-            # 统一转换为内容字符串和元数据字符串作为唯一 Key
-            if isinstance(item, Document):
-                content = item.page_content
-                # json dumps 保证字典顺序一致，作为唯一标识的一部分
-                meta_str = json.dumps(item.metadata, sort_keys=True, ensure_ascii=False)
-            else:
-                # 兼容可能的其他格式
-                content = str(item)
-                meta_str = "{}"
-
-            key = (content, meta_str)
-            
-            if key not in fused_scores:
-                fused_scores[key] = 0
-            
-            # RRF 公式: score = 1 / (rank + k)
-            fused_scores[key] += 1 / (rank + k)
-            
+    weights = weights or [1.0] * len(results)
+    results = [
+        [item if isinstance(item, Document) else Document(page_content=str(item)) for item in doc_list]
+        for doc_list in results
+    ]
+    # 只要有一路缺少 chunk_id (旧集合)，所有路统一按正文哈希合并，保证同一片段能对上
+    use_content_key = any("chunk_id" not in doc.metadata for doc_list in results for doc in doc_list)
+
+    fused_scores: Dict[str, float] = {}
+    first_seen: Dict[str, Document] = {}
+    max_depth = max((len(doc_list) for doc_list in results), default=0)
+
+    # 按名次逐层扫描各路结果
+    for rank in range(max_depth):
+        for doc_list, weight in zip(results, weights):
+            if rank >= len(doc_list):
+                continue
+            doc = doc_list[rank]
+            key = get_chunk_key(doc, use_content_key)
+            if key not in first_seen:
+                first_seen[key] = doc
+            # RRF 公式: score = weight / (rank + k)
+            fused_scores[key] = fused_scores.get(key, 0.0) + weight / (rank + k)
+
+        if top_n:
+            # 下一层及以后还能贡献的最大分数
+            bound = sum(w / (rank + 1 + k) for doc_list, w in zip(results, weights) if len(doc_list) > rank + 1)
+            if bound > 0 and _fusion_settled(fused_scores, top_n, bound):
+                break
+
     # 按分数倒序排列
     reranked = sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
-    
-    # 还原为 Document 对象
+    if top_n:
+        reranked = reranked[:top_n]
+
     final_docs = []
-    for (content, meta_str), score in reranked:
-        try:
-            meta = json.loads(meta_str)
-        except:
-            meta = {}
+    for key, score in reranked:
+        doc = first_seen[key]
         # 可以在 metadata 里把 score 加上，方便调试
-        meta["rrf_score"] = score
-        final_docs.append(Document(page_content=content, metadata=meta))
-    
+        final_docs.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "rrf_score": score}))
+
     return final_docs
 
-# --- 3. 数据库辅助函数 ---
-async def _save_chat_to_db(
-    db: Session, 
-    user_id: int, 
-    question: str, 
-    answer: str, 
-    sources: Optional[List[Any]] = None
-):
+# --- 3. 并行混合检索 ---
+# Milvus 客户端是同步调用，放到有界线程池中执行，避免阻塞事件循环；ES 使用原生异步客户端
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=settings.RETRIEVAL_MAX_WORKERS,
+    thread_name_prefix="retrieval"
+)
+
+def _in_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_retrieval_executor, functools.partial(func, *args, **kwargs))
+
+async def _run_retrieval_leg(name: str, timeout: float, awaitable) -> List[Any]:
+    """执行一路检索，超时或出错时返回空列表，不影响另一路"""
     try:
-        new_conversation = Conversation(user_id=user_id, title=question[:30])
-        db.add(new_conversation)
-        db.commit()
-        db.refresh(new_conversation)
-
-        user_msg = Message(
-            conversation_id=new_conversation.id,
-            role="user",
-            content=question
-        )
-        db.add(user_msg)
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"{name} 检索超时 ({timeout}s)，忽略该路结果")
+    except Exception as e:
+        print(f"{name} 检索出错: {e}")
+    return []
 
-        ai_msg = Message(
-            conversation_id=new_conversation.id,
-            role="assistant",
-            content=answer,
-            sources=sources 
+def _milvus_search(
+    question: str,
+    collection_name: str,
+    k: int,
+    query_vector: Optional[List[float]] = None
+) -> List[Document]:
+    # 同时给 Milvus RPC 本身设置超时，避免超时后线程仍被长时间占用
+    vector_store = get_vector_store(collection_name)
+    if query_vector is not None:
+        # 复用调用方已经算好的查询向量
+        return vector_store.similarity_search_by_vector(query_vector, k=k, timeout=settings.MILVUS_SEARCH_TIMEOUT)
+    return vector_store.similarity_search(question, k=k, timeout=settings.MILVUS_SEARCH_TIMEOUT)
+
+async def hybrid_search(
+    question: str,
+    collection_name: str = settings.COLLECTION_NAME,
+    milvus_k: Optional[int] = None,
+    es_k: Optional[int] = None,
+    top_n: Optional[int] = None,
+    query_vector: Optional[List[float]] = None,
+    version: Optional[int] = None
+) -> List[Document]:
+    """
+    并行执行向量检索与关键词检索，再做 RRF 融合。
+    总耗时取决于较慢的一路，而不是两路之和。
+    各路候选深度、融合权重与返回条数默认取自配置；传入 query_vector 时向量检索不再重复计算 embedding。
+    version 为知识库版本号，未传入时读取当前版本。
+    """
+    milvus_k = milvus_k or settings.MILVUS_CANDIDATE_K
+    es_k = es_k or settings.ES_CANDIDATE_K
+    top_n = top_n or settings.RETRIEVAL_TOP_N
+
+    # 检索结果缓存命中时跳过整个检索阶段
+    signature = f"m{milvus_k}e{es_k}n{top_n}"
+    if settings.RETRIEVAL_CACHE_ENABLED and version is None:
+        version = await get_corpus_version(collection_name)
+    if settings.RETRIEVAL_CACHE_ENABLED:
+        cached_docs = await _load_cached_retrieval(question, collection_name, signature, version)
+        if cached_docs is not None:
+            print(f"命中检索缓存 ({len(cached_docs)} 个片段)")
+            return cached_docs
+
+    milvus_docs, es_hits = await asyncio.gather(
+        _run_retrieval_leg("Milvus", settings.MILVUS_SEARCH_TIMEOUT, _in_executor(_milvus_search, question, collection_name, milvus_k, query_vector)),
+        _run_retrieval_leg("ES", settings.ES_SEARCH_TIMEOUT, search_keyword(question, k=es_k)),
+    )
+
+    es_docs = []
+    for hit in es_hits:
+        source = hit["_source"]
+        # 统一转为 Document
+        es_docs.append(Document(
+            page_content=source.get("content", ""),
+            metadata={k: v for k, v in source.items() if k != "content"}
+        ))
+
+    print(f"⚗️ 执行 RRF 融合 (向量: {len(milvus_docs)}, 关键词: {len(es_docs)})...")
+    fused_docs = reciprocal_rank_fusion(
+        [milvus_docs, es_docs],
+        k=settings.RRF_K,
+        weights=[settings.RRF_MILVUS_WEIGHT, settings.RRF_ES_WEIGHT],
+        top_n=top_n
+    )
+
+    # 只缓存能按 chunk_id 取回的结果 (旧数据没有 chunk_id)；任一路失败的残缺结果也不缓存
+    if (
+        settings.RETRIEVAL_CACHE_ENABLED and fused_docs and milvus_docs and es_docs
+        and all("chunk_id" in d.metadata for d in fused_docs)
+    ):
+        await set_retrieval_cache(
+            question, collection_name, signature, version,
+            [(d.metadata["chunk_id"], d.metadata["rrf_score"]) for d in fused_docs]
         )
-        db.add(ai_msg)
-        
-        db.commit()
+    return fused_docs
+
+async def _load_cached_retrieval(
+    question: str, collection_name: str, signature: str, version: int
+) -> Optional[List[Document]]:
+    """
+    读取检索缓存并按 chunk_id 从 ES 取回正文；任一片段已不存在时视为未命中
+    """
+    cached = await get_retrieval_cache(question, collection_name, signature, version)
+    if cached is None:
+        return None
+    try:
+        sources = await get_documents_by_ids([chunk_id for chunk_id, _ in cached])
     except Exception as e:
-        print(f"保存数据库失败: {e}")
-        db.rollback()
+        print(f"按 ID 取回片段失败: {e}")
+        return None
+    if len(sources) < len(cached):
+        return None
+
+    docs = []
+    for chunk_id, score in cached:
+        source = sources[chunk_id]
+        metadata = {k: v for k, v in source.items() if k != "content"}
+        metadata["rrf_score"] = score
+        docs.append(Document(page_content=source.get("content", ""), metadata=metadata))
+    return docs
 
-def get_retriever(collection_name: str = settings.COLLECTION_NAME, k: int = 5) -> VectorStoreRetriever:
+# --- 4. 缓存辅助函数 ---
+async def _replay_cached_answer(cached_data: dict) -> AsyncGenerator[str, None]:
+    """按与实时生成相同的格式输出缓存的答案与来源"""
+    yield cached_data["answer"]
+    yield "\n\n---SOURCES---\n"
+    cached_sources = cached_data.get("sources")
+    if cached_sources:
+        for sz in cached_sources:
+             yield json.dumps(sz, ensure_ascii=False) + "\n"
+
+async def _embed_question(question: str) -> Optional[List[float]]:
+    """计算查询向量，供语义缓存与向量检索共用；失败时返回 None (向量检索会自行计算)"""
     try:
-        if not connections.has_connection("default"):
-            connections.connect(
-                alias="default", 
-                host=settings.MILVUS_HOST, 
-                port=settings.MILVUS_PORT
-            )
+        return await get_shared_embeddings().aembed_query(question)
     except Exception as e:
-        print(f"底层连接警告: {e}")
+        print(f"计算查询向量失败: {e}")
+        return None
 
-    embeddings = GlobalLazyEmbeddings()
-    
-    vector_store = Milvus(
-        embedding_function=embeddings,
-        collection_name=collection_name,
-        connection_args={
-            "host": settings.MILVUS_HOST,
-            "port": str(settings.MILVUS_PORT), 
-            "alias": "default" 
-        },
-        auto_id=True
-    )
-    return vector_store.as_retriever(search_kwargs={"k": k})
+async def _cache_answer(
+    question: str,
+    answer: str,
+    sources: list,
+    query_vector: Optional[List[float]],
+    collection_name: str,
+    version: int
+):
+    try:
+        key = await set_cache(question, answer, sources, collection_name, version)
+        if query_vector is not None:
+            await add_to_semantic_cache(key, query_vector)
+    except Exception as e:
+        print(f"写入缓存失败: {e}")
 
-# --- 4. 核心 RAG 逻辑 (混合检索版) ---
-async def stream_rag_answer(
+# --- 5. 核心 RAG 逻辑 (混合检索版) ---
+ANSWER_TEMPERATURE = 0.3
+
+async def _generate_answer(
     question: str,
     llm_api_key: SecretStr,
     llm_base_url: str,
     llm_model: str,
-    db: Session,       
-    user: User,
-    collection_name: str = settings.COLLECTION_NAME
+    collection_name: str,
+    version: int,
+    query_vector: Optional[List[float]],
+    outcome: dict
 ) -> AsyncGenerator[str, None]:
-    
-    print(f"--- Hybrid RAG Start: {question} ---")
-    
-    # === 1. 检查 Redis 缓存 ===
-    cached_data = await get_cache(question)
-    if cached_data:
-        yield cached_data["answer"]
-        yield "\n\n---SOURCES---\n"
-        cached_sources = cached_data.get("sources")
-        if cached_sources:
-            for sz in cached_sources:
-                 yield json.dumps(sz, ensure_ascii=False) + "\n"
-        await _save_chat_to_db(db, user.id, question, cached_data["answer"], sources=cached_sources)
-        return
-
+    """
+    检索 + 生成 + 写缓存。在 single-flight 的后台任务中运行，
+    最终答案与来源写入 outcome，供每个订阅的请求保存会话记录。
+    """
     # === 2. 混合检索 (Hybrid Search) ===
     try:
-        # A. 向量检索 (Milvus)
-        print("🔍 执行 Milvus 向量检索...")
-        retriever = get_retriever(collection_name=collection_name, k=5)
-        milvus_docs = retriever.invoke(question)
-        
-        # B. 关键词检索 (ES)
-        print("🔍 执行 ES 关键词检索...")
-        es_hits = search_keyword(question, k=5)
-        es_docs = []
-        for hit in es_hits:
-            source = hit["_source"]
-            # 统一转为 Document
-            es_docs.append(Document(
-                page_content=source.get("content", ""),
-                metadata={k: v for k, v in source.items() if k != "content"}
-            ))
-
-        # C. RRF 融合
-        print(f"⚗️ 执行 RRF 融合 (向量: {len(milvus_docs)}, 关键词: {len(es_docs)})...")
-        final_docs = reciprocal_rank_fusion([milvus_docs, es_docs])
-        
-        # 取前 6 个
-        used_docs = final_docs[:6]
+        # Milvus 向量检索与 ES 关键词检索并行执行，并做 RRF 融合
+        print("🔍 并行执行 Milvus 向量检索与 ES 关键词检索...")
+        # 融合结果已按 RETRIEVAL_TOP_N 截断；开启重排时多取一些候选，交给交叉编码器挑出 RERANK_TOP_N 个
+        used_docs = await hybrid_search(
+            question, collection_name=collection_name, query_vector=query_vector, version=version,
+            top_n=settings.RERANK_CANDIDATE_N if settings.RERANK_ENABLED else None
+        )
+        if settings.RERANK_ENABLED:
+            used_docs = await rerank_documents(question, used_docs)
         
-        if used_docs:
+        if used_docs and settings.CONTEXT_PACKING_ENABLED:
+            # 合并相邻 / 重叠片段并按 token 预算截取，来源只列出实际放进 Prompt 的片段
+            context_text, used_docs = pack_context(used_docs)
+        elif used_docs:
             context_text = "\n\n------\n\n".join([d.page_content for d in used_docs])
         else:
             context_text = "没有找到相关文档，请依据你的通用知识回答。"
@@ -218,11 +320,12 @@ async def stream_rag_answer(
 """
 
     # === 4. 生成 (Generation) ===
-    llm = ChatOpenAI(
+    # 复用进程内缓存的 ChatOpenAI 与共享连接池，不再每次请求重新握手
+    llm = get_chat_model(
         api_key=llm_api_key,
         base_url=llm_base_url,
         model=llm_model,
-        temperature=0.3,
+        temperature=ANSWER_TEMPERATURE,
         streaming=True
     )
 
@@ -251,7 +354,58 @@ async def stream_rag_answer(
         yield json.dumps(meta, ensure_ascii=False) + "\n"
 
     if full_answer:
-        asyncio.create_task(set_cache(question, full_answer, doc_metadatas))
-        await _save_chat_to_db(db, user.id, question, full_answer, sources=doc_metadatas)
+        outcome["answer"] = full_answer
+        outcome["sources"] = doc_metadatas
+        await _cache_answer(question, full_answer, doc_metadatas, query_vector, collection_name, version)
+
+async def stream_rag_answer(
+    question: str,
+    llm_api_key: SecretStr,
+    llm_base_url: str,
+    llm_model: str,
+    user: User,
+    collection_name: str = settings.COLLECTION_NAME
+) -> AsyncGenerator[str, None]:
+    
+    print(f"--- Hybrid RAG Start: {question} ---")
+    
+    # === 1. 检查缓存 (进程内 L1 -> Redis，精确匹配) ===
+    # 缓存 Key 带知识库版本号，摄取新文档后旧答案自然失效
+    version = await get_corpus_version(collection_name)
+    cached_data = await get_cache(question, collection_name, version)
+
+    # 同一问题正在生成时直接加入，不再重复计算向量
+    # Key 包含与 LLM 客户端缓存相同的 (base_url, 模型, 参数, 密钥哈希)：不同端点的请求不会共享同一次生成
+    flight_key = (
+        chat_model_key(llm_api_key, llm_base_url, llm_model, ANSWER_TEMPERATURE, True),
+        generate_cache_key(question, collection_name, version)
+    )
+
+    # === 1.1 语义缓存：问法不同但语义相同的问题 ===
+    query_vector = None
+    if not cached_data and get_inflight(flight_key) is None:
+        query_vector = await _embed_question(question)
+        if query_vector is not None:
+            cached_data = await lookup_semantic_cache(query_vector, cache_namespace(collection_name, version))
+
+    if cached_data:
+        async for piece in _replay_cached_answer(cached_data):
+            yield piece
+        # 会话记录交给后台批量落库，不阻塞事件循环
+        await enqueue_chat(user.id, question, cached_data["answer"], sources=cached_data.get("sources"))
+        return
+
+    # === 2~5. 检索与生成：相同问题的并发请求共享同一次生成 ===
+    flight = join_or_start(
+        flight_key,
+        lambda f: _generate_answer(
+            question, llm_api_key, llm_base_url, llm_model, collection_name, version, query_vector, f.result
+        )
+    )
+    async for piece in flight.subscribe():
+        yield piece
+
+    if flight.result.get("answer"):
+        await enqueue_chat(user.id, question, flight.result["answer"], sources=flight.result["sources"])
 
-    print("--- RAG End ---")
\ No newline at end of file
+    print("--- RAG End ---")
@@ -0,0 +1,119 @@
+# app/services/rerank_service.py
+import time
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
+from app.core.config import settings
+from app.core.metrics import counter, histogram
+from app.services.cache_service import LocalLRUCache, normalize_query
+
+# --- 交叉编码器重排 ---
+# RRF 只看名次；重排阶段把 (问题, 片段) 成对送进交叉编码器，一次批量算出相关度，
+# 只把分数最高的 RERANK_TOP_N 个片段放进 Prompt。
+# 分数按 (问题哈希, chunk_id) 缓存：chunk_id 含正文哈希，片段内容变化后自然换 Key。
+# 打分超过时间预算时直接按 RRF 顺序截断，后台的打分仍会跑完并写入缓存，下次同样的问题即可命中。
+
+_model = None
+_model_failed = False
+_model_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(max_workers=settings.RERANK_MAX_WORKERS, thread_name_prefix="rerank")
+_score_cache = LocalLRUCache(settings.RERANK_CACHE_SIZE, settings.RERANK_CACHE_TTL)
+
+_cache_hits = counter("rerank_cache_hit")
+_cache_misses = counter("rerank_cache_miss")
+_timeouts = counter("rerank_timeout")
+_score_ms = histogram("rerank_score_ms", (5, 10, 20, 50, 100, 200, 500, 1000, 2000))
+
+def load_reranker():
+    """加载交叉编码器 (未开启重排时不加载)；加载失败后不再重试，重排阶段退化为 RRF 顺序"""
+    global _model, _model_failed
+    if not settings.RERANK_ENABLED or _model is not None or _model_failed:
+        return _model
+    with _model_lock:
+        if _model is None and not _model_failed:
+            print(f"正在加载重排模型: {settings.RERANK_MODEL_PATH}")
+            try:
+                from sentence_transformers import CrossEncoder
+                _model = CrossEncoder(settings.RERANK_MODEL_PATH, max_length=settings.RERANK_MAX_LENGTH)
+                print("重排模型加载成功！")
+            except Exception as e:
+                _model_failed = True
+                print(f"重排模型加载失败，按 RRF 顺序截断: {e}")
+    return _model
+
+def _cache_key(query_hash: str, doc: Document) -> str:
+    # 与 RRF 融合使用相同的片段标识：优先 chunk_id，旧数据退化为正文哈希
+    chunk_key = doc.metadata.get("chunk_id") or hashlib.md5(doc.page_content.encode("utf-8")).hexdigest()
+    return f"{query_hash}:{chunk_key}"
+
+def score_documents(question: str, docs: List[Document]) -> List[float]:
+    """返回每个片段的相关度分数；缓存未命中的片段合并为一次批量打分"""
+    model = load_reranker()
+    if model is None:
+        raise RuntimeError("重排模型不可用")
+
+    query_hash = hashlib.md5(normalize_query(question).encode("utf-8")).hexdigest()
+    keys = [_cache_key(query_hash, doc) for doc in docs]
+    scores: Dict[int, float] = {}
+    missing: List[int] = []
+    for i, key in enumerate(keys):
+        cached = _score_cache.get(key)
+        if cached is None:
+            missing.append(i)
+        else:
+            scores[i] = cached
+    _cache_hits.inc(len(docs) - len(missing))
+    _cache_misses.inc(len(missing))
+
+    if missing:
+        started = time.perf_counter()
+        predicted = model.predict(
+            [(question, docs[i].page_content) for i in missing],
+            batch_size=settings.RERANK_BATCH_SIZE,
+            show_progress_bar=False
+        )
+        _score_ms.observe((time.perf_counter() - started) * 1000)
+        for i, score in zip(missing, predicted):
+            scores[i] = float(score)
+            _score_cache.set(keys[i], scores[i])
+    return [scores[i] for i in range(len(docs))]
+
+async def rerank_documents(
+    question: str,
+    docs: List[Document],
+    top_n: Optional[int] = None,
+    timeout: Optional[float] = None
+) -> List[Document]:
+    """
+    按交叉编码器分数重排并保留 top_n 个片段 (分数写入 metadata 的 rerank_score)。
+    未开启、模型不可用、出错或超时时按原有 (RRF) 顺序截断
+    """
+    top_n = top_n or settings.RERANK_TOP_N
+    timeout = timeout if timeout is not None else settings.RERANK_TIMEOUT
+    if not settings.RERANK_ENABLED or len(docs) <= 1:
+        return docs[:top_n]
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, score_documents, question, docs)
+    # 超时返回后打分仍可能出错，取走异常避免 "exception was never retrieved" 警告
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    try:
+        # shield: 超时后不取消线程里的打分，让它跑完写入缓存
+        scores = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+    except asyncio.TimeoutError:
+        _timeouts.inc()
+        print(f"重排超时 ({timeout}s)，按 RRF 顺序截断")
+        return docs[:top_n]
+    except Exception as e:
+        print(f"重排出错，按 RRF 顺序截断: {e}")
+        return docs[:top_n]
+
+    ranked = sorted(zip(docs, scores), key=lambda item: item[1], reverse=True)[:top_n]
+    return [
+        Document(page_content=doc.page_content, metadata={**doc.metadata, "rerank_score": score})
+        for doc, score in ranked
+    ]
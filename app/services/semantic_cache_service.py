@@ -0,0 +1,309 @@
+# app/services/semantic_cache_service.py
+import time
+import base64
+import asyncio
+import threading
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple, Any
+from app.core.config import settings
+from app.core.metrics import counter, histogram
+from app.core.model_loader import get_embedding_model_name
+from app.services.cache_service import (
+    semantic_index_keys, get_redis_client, get_cache_by_key, on_corpus_version_change, parse_key_version
+)
+
+# --- 语义缓存 ---
+# 精确缓存 (问题 MD5) 之上的一层：把已缓存问题的查询向量放在进程内的 NumPy 矩阵里，
+# 新问题与其余弦相似度超过阈值时，直接复用对应的缓存答案。
+# 查询向量复用检索阶段算好的 embedding，不额外调用模型。
+# 不同模型 / 推理后端 / 维度的向量不能互相比较：按向量空间 (模型名:维度) 分别建索引，Redis 中也各用一组 Key。
+# 向量同时写入 Redis Hash，另用 ZSET 记录写入时间，超出容量时删除最旧的条目。
+# 索引是每个 worker 进程各自的：首次使用时从 Redis 全量加载 (顺带清理答案已过期的条目)，
+# 之后每隔 SEMANTIC_CACHE_SYNC_INTERVAL 秒按写入时间增量同步其他 worker 写入的向量。
+# 只在当前知识库版本的命名空间内匹配，版本变化时清理旧条目。
+
+# 增量同步时向前多取的秒数，容忍各 worker 之间的时钟误差 (重复取到的条目覆盖写入即可)
+SYNC_SKEW = 5.0
+
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.99, 1.0)
+
+_hits = counter("semantic_cache_hit")
+_misses = counter("semantic_cache_miss")
+_near_misses = counter("semantic_cache_near_miss")
+_best_similarity = histogram("semantic_cache_best_similarity", SIMILARITY_BUCKETS)
+
+def _namespace_of(key: str) -> str:
+    """缓存 Key 去掉问题哈希后的前缀，即 cache_namespace() 的返回值"""
+    return key[:key.rfind(":") + 1]
+
+class SemanticCacheIndex:
+    """
+    固定容量的向量索引 (环形覆盖最旧的条目)。
+    向量均已归一化，点积即余弦相似度。
+    每个位置记录所属命名空间的编号，检索时先按命名空间过滤再取最相似的条目。
+    """
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[Optional[str]] = [None] * self.capacity
+        self._namespaces = np.full(self.capacity, -1, dtype=np.int32)
+        self._namespace_ids: Dict[str, int] = {}
+        self._positions: Dict[str, int] = {}
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def add(self, key: str, vector: np.ndarray):
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            position = self._positions.get(key)
+            if position is None:
+                position = self._next
+                evicted = self._keys[position]
+                if evicted is not None:
+                    self._positions.pop(evicted, None)
+                self._next = (self._next + 1) % self.capacity
+                self._size = min(self._size + 1, self.capacity)
+            namespace = _namespace_of(key)
+            namespace_id = self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+            self._matrix[position] = vector
+            self._keys[position] = key
+            self._namespaces[position] = namespace_id
+            self._positions[key] = position
+
+    def remove(self, key: str):
+        with self._lock:
+            position = self._positions.pop(key, None)
+            if position is not None and self._matrix is not None:
+                # 置零后相似度恒为 0，不会再被命中
+                self._matrix[position] = 0
+                self._keys[position] = None
+                self._namespaces[position] = -1
+
+    def remove_where(self, predicate: Callable[[str], bool]) -> int:
+        with self._lock:
+            stale = [key for key in self._positions if predicate(key)]
+        for key in stale:
+            self.remove(key)
+        return len(stale)
+
+    def search(self, vector: np.ndarray, namespace: str) -> Optional[Tuple[str, float]]:
+        """返回属于 namespace 的条目中最相似的 (key, 相似度)"""
+        with self._lock:
+            if self._matrix is None or not self._positions:
+                return None
+            namespace_id = self._namespace_ids.get(namespace)
+            if namespace_id is None:
+                return None
+            # 其他模型 / 版本的条目先排除，不会挤掉当前命名空间里的命中
+            scores = np.where(self._namespaces[:self._size] == namespace_id, self._matrix[:self._size] @ vector, -np.inf)
+            position = int(np.argmax(scores))
+            if scores[position] == -np.inf:
+                return None
+            return self._keys[position], float(scores[position])
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(vector.astype(np.float32).tobytes()).decode("ascii")
+
+def _decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+class SemanticSpace:
+    """一个向量空间 (模型名:维度) 的进程内索引及其 Redis Key"""
+
+    def __init__(self, name: str, dim: int):
+        self.name = name
+        self.dim = dim
+        self.index = SemanticCacheIndex(settings.SEMANTIC_CACHE_CAPACITY)
+        self.index_key, self.order_key = semantic_index_keys(name)
+        self.loaded = False
+        # 上次从 Redis 同步时的时间 (墙上时间与单调时钟)
+        self.synced_at = 0.0
+        self.synced_monotonic = 0.0
+        self.lock = asyncio.Lock()
+
+    def add_encoded(self, key: str, data: str) -> bool:
+        """写入 Redis 中取出的向量；维度不符 (例如换过模型却沿用了同名 Key) 时跳过"""
+        vector = _decode_vector(data)
+        if vector.shape[0] != self.dim:
+            return False
+        self.index.add(key, vector)
+        return True
+
+    async def drop_entries(self, client, keys: List[str]):
+        """从 Redis 的向量表与写入时间表中删除条目"""
+        if keys:
+            pipe = client.pipeline(transaction=False)
+            pipe.hdel(self.index_key, *keys)
+            pipe.zrem(self.order_key, *keys)
+            await pipe.execute()
+
+    async def trim_entries(self, client, count: int):
+        """删除写入时间最早的 count 条"""
+        if count > 0:
+            oldest = await client.zpopmin(self.order_key, count)
+            if oldest:
+                await client.hdel(self.index_key, *[key for key, _ in oldest])
+
+    async def rebuild(self, client, batch_size: int = 500):
+        """
+        从 Redis 全量加载向量：答案已过期或维度不符的条目直接删除，其余按写入时间保留最新的 capacity 条
+        """
+        alive: List[Tuple[float, str, str]] = []
+        stale: List[str] = []
+
+        async def check(batch: List[Tuple[str, str]]):
+            pipe = client.pipeline(transaction=False)
+            for key, _ in batch:
+                pipe.exists(key)
+                pipe.zscore(self.order_key, key)
+            results = await pipe.execute()
+            for i, (key, data) in enumerate(batch):
+                if results[2 * i] and len(base64.b64decode(data)) == self.dim * 4:
+                    alive.append((results[2 * i + 1] or 0.0, key, data))
+                else:
+                    stale.append(key)
+
+        batch: List[Tuple[str, str]] = []
+        async for key, data in client.hscan_iter(self.index_key, count=batch_size):
+            batch.append((key, data))
+            if len(batch) >= batch_size:
+                await check(batch)
+                batch = []
+        if batch:
+            await check(batch)
+
+        for i in range(0, len(stale), batch_size):
+            await self.drop_entries(client, stale[i:i + batch_size])
+        unordered = {key: 0.0 for score, key, _ in alive if not score}
+        if unordered:
+            await client.zadd(self.order_key, unordered, nx=True)
+
+        alive.sort(reverse=True)
+        kept, overflow = alive[:self.index.capacity], alive[self.index.capacity:]
+        for i in range(0, len(overflow), batch_size):
+            await self.drop_entries(client, [key for _, key, _ in overflow[i:i + batch_size]])
+        # 从旧到新写入环形索引，之后新增的条目先覆盖最旧的
+        for _, key, data in reversed(kept):
+            self.add_encoded(key, data)
+        if stale or overflow:
+            print(f"语义缓存索引 [{self.name}] 清理过期 / 超出容量的条目: {len(stale) + len(overflow)} 条")
+
+    async def sync(self, client, batch_size: int = 500) -> int:
+        """增量加载上次同步之后 (其他 worker) 写入的向量"""
+        keys = await client.zrangebyscore(self.order_key, self.synced_at - SYNC_SKEW, "+inf")
+        added = 0
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            for key, data in zip(batch, await client.hmget(self.index_key, batch)):
+                if data is not None and self.add_encoded(key, data):
+                    added += 1
+        return added
+
+    async def ensure_synced(self):
+        """首次使用时全量加载，之后按间隔增量同步"""
+        now = time.monotonic()
+        if self.loaded and now - self.synced_monotonic < settings.SEMANTIC_CACHE_SYNC_INTERVAL:
+            return
+        async with self.lock:
+            if self.loaded and time.monotonic() - self.synced_monotonic < settings.SEMANTIC_CACHE_SYNC_INTERVAL:
+                return
+            started = time.time()
+            try:
+                client = get_redis_client()
+                if self.loaded:
+                    await self.sync(client)
+                else:
+                    await self.rebuild(client)
+                    print(f"语义缓存索引 [{self.name}] 已加载: {len(self.index)} 条")
+                self.synced_at = started
+            except Exception as e:
+                print(f"同步语义缓存索引失败: {e}")
+            # 加载失败时同样等到下个间隔再重试，不让每个请求都去访问 Redis
+            self.loaded = True
+            self.synced_monotonic = time.monotonic()
+
+_spaces: Dict[str, SemanticSpace] = {}
+
+def _get_space(dim: int) -> SemanticSpace:
+    name = f"{get_embedding_model_name()}:{dim}"
+    space = _spaces.get(name)
+    if space is None:
+        space = _spaces.setdefault(name, SemanticSpace(name, dim))
+    return space
+
+@on_corpus_version_change
+def _purge_stale_versions(collection_name: str, version: int):
+    """知识库版本变化时，清理进程内索引中属于旧版本的条目"""
+    prefix = f"rag_cache:{collection_name}:"
+
+    def is_stale(key: str) -> bool:
+        key_version = parse_key_version(key, prefix)
+        return key_version is not None and key_version < version
+
+    removed = sum(space.index.remove_where(is_stale) for space in list(_spaces.values()))
+    if removed:
+        print(f"语义缓存索引清理旧版本条目: {removed} 条")
+
+async def lookup_semantic_cache(query_vector: List[float], namespace: str) -> Optional[Dict[str, Any]]:
+    """
+    按查询向量查找语义相近的已缓存问题，相似度达到阈值时返回其缓存数据
+    :param namespace: 当前集合与知识库版本对应的缓存 Key 前缀，只在其中匹配
+    """
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return None
+    vector = np.asarray(query_vector, dtype=np.float32)
+    space = _get_space(vector.shape[0])
+    await space.ensure_synced()
+
+    result = space.index.search(vector, namespace)
+    if result is None:
+        _misses.inc()
+        return None
+
+    key, similarity = result
+    _best_similarity.observe(similarity)
+    if similarity < settings.SEMANTIC_CACHE_THRESHOLD:
+        if similarity >= settings.SEMANTIC_CACHE_THRESHOLD - settings.SEMANTIC_CACHE_NEAR_MISS_MARGIN:
+            # 接近阈值但未命中，用于评估阈值是否过严
+            _near_misses.inc()
+        _misses.inc()
+        return None
+
+    cached_data = await get_cache_by_key(key)
+    if cached_data is None:
+        # 答案已过期，清理对应的向量
+        space.index.remove(key)
+        try:
+            await space.drop_entries(get_redis_client(), [key])
+        except Exception as e:
+            print(f"清理语义缓存向量失败: {e}")
+        _misses.inc()
+        return None
+
+    print(f" 命中语义缓存 (相似度 {similarity:.4f}): {key}")
+    _hits.inc()
+    return cached_data
+
+async def add_to_semantic_cache(cache_key: str, query_vector: List[float]):
+    """答案写入精确缓存后，登记其查询向量"""
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return
+    vector = np.asarray(query_vector, dtype=np.float32)
+    space = _get_space(vector.shape[0])
+    space.index.add(cache_key, vector)
+    try:
+        client = get_redis_client()
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(space.index_key, cache_key, _encode_vector(vector))
+        pipe.zadd(space.order_key, {cache_key: time.time()})
+        pipe.zcard(space.order_key)
+        size = (await pipe.execute())[-1]
+        # Redis 中与进程内索引保持相同的容量上限
+        await space.trim_entries(client, size - space.index.capacity)
+    except Exception as e:
+        print(f"写入语义缓存向量失败: {e}")
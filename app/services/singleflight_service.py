@@ -0,0 +1,78 @@
+# app/services/singleflight_service.py
+import asyncio
+from typing import AsyncGenerator, Callable, Dict, Hashable, List, Optional, Any
+from app.core.metrics import counter
+
+# --- 同一问题的请求合并 (single-flight) ---
+# 同一个问题同时到达多次时，只有第一个请求 (leader) 真正执行检索与生成，
+# 生成过程放在独立的后台任务里，所有请求 (包括 leader 自己) 订阅同一个 token 流：
+# 先补发已生成的部分，再实时接收后续片段。任何一个客户端断开都不会影响其他订阅者。
+
+_leaders = counter("singleflight_leader")
+_followers = counter("singleflight_follower")
+
+class InflightStream:
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        # 生成方在结束前写入最终答案与来源，供各订阅者保存会话记录
+        self.result: Dict[str, Any] = {}
+        self.task: Optional[asyncio.Task] = None
+        self._cond = asyncio.Condition()
+
+    async def publish(self, chunk: str):
+        async with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    async def close(self):
+        async with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        index = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: len(self.chunks) > index or self.done)
+                pending = self.chunks[index:]
+                finished = self.done
+            index += len(pending)
+            for chunk in pending:
+                yield chunk
+            if finished and index >= len(self.chunks):
+                return
+
+_inflight: Dict[Hashable, InflightStream] = {}
+
+def get_inflight(key: Hashable) -> Optional[InflightStream]:
+    return _inflight.get(key)
+
+async def _drive(key: Hashable, flight: InflightStream, generator: AsyncGenerator[str, None]):
+    try:
+        async for chunk in generator:
+            await flight.publish(chunk)
+    except Exception as e:
+        print(f"合并请求的生成任务出错: {e}")
+    finally:
+        if _inflight.get(key) is flight:
+            _inflight.pop(key, None)
+        await flight.close()
+
+def join_or_start(
+    key: Hashable,
+    producer: Callable[[InflightStream], AsyncGenerator[str, None]]
+) -> InflightStream:
+    """
+    加入 key 对应的进行中的生成；没有则以 producer 启动一个新的后台生成任务
+    """
+    flight = _inflight.get(key)
+    if flight is not None:
+        _followers.inc()
+        return flight
+
+    _leaders.inc()
+    flight = InflightStream()
+    _inflight[key] = flight
+    flight.task = asyncio.create_task(_drive(key, flight, producer(flight)))
+    return flight
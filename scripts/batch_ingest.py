@@ -1,15 +1,295 @@
 import os
 import sys
 import time
+import queue
+import argparse
+import threading
+import multiprocessing
+import numpy as np
+from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 # --- 将项目根目录加入 Python 路径 ---
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.services.ingestion_service import process_and_embed_document
+from app.core.config import settings
+from app.services.ingestion_service import (
+    upload_to_minio, prepare_document,
+    get_ingest_vector_store, remove_document_chunks, write_to_milvus, write_to_es
+)
+from app.services.manifest_service import IngestManifest
+from app.services.minio_service import get_shared_minio_client, ensure_bucket, object_name_for
+from app.services.dedup_service import SimHashIndex, dedup_splits, invalidate_dependents
+from app.services.milvus_service import get_shared_embeddings, invalidate_vector_store
+from app.services.cache_service import bump_corpus_version
+from app.core.metrics import get_metrics_snapshot
 
-def batch_ingest_recursive(root_folder: str = "data/pdfs"):
+# --- 流水线式批量摄取 ---
+# 解析切分 (进程池) -> 向量化 (单线程攒批，让模型持续满载) -> 写入 (Milvus、ES、MinIO 并发)。
+# 各阶段之间是有界队列：下游跟不上时上游自动等待，内存占用不会随文件数增长。
+# 摄取清单记录每个文件的哈希：内容未变的文件在解析前就跳过，中断后重新运行即从断点继续。
+# 向量化之前按 SimHash 过滤近似重复的片段 (与已入库的文件、同一批的其他文件比较)。
+
+_DONE = object()
+
+class FileJob:
+    """在流水线各阶段之间传递的单个文件"""
+    def __init__(self, path: str, source: str, previous: Optional[dict], legacy_source: Optional[str] = None):
+        self.path = path
+        # 相对根目录的路径 (统一使用 / 分隔)：与片段 metadata 中的 source、MinIO 对象名一致，也是清单的 Key。
+        # 递归扫描时不同目录下可能有同名文件，不能只用文件名
+        self.source = source
+        self.name = source
+        self.previous = previous
+        # 旧版清单以文件名为 Key：previous 取自该旧记录，成功后移除旧记录
+        self.legacy_source = legacy_source
+        self.file_hash = ""
+        self.splits: list = []
+        # float32 矩阵 (向量化阶段整批结果的切片视图)
+        self.vectors: Optional[np.ndarray] = None
+        # 去重结果：保留片段的签名、被丢弃的片段数、被引用的其他文件
+        self.signatures: List[str] = []
+        self.duplicates = 0
+        self.linked_sources: List[str] = []
+        self.error = ""
+
+class IngestStats:
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.finished = 0
+        self.success = 0
+        self.skipped = 0
+        self.failed = 0
+        self.chunks = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def record(self, name: str, chunks: int = 0, error: str = "", skipped: bool = False, duplicates: int = 0):
+        with self._lock:
+            self.finished += 1
+            if skipped:
+                self.skipped += 1
+                message = " 未变化，跳过"
+            elif error:
+                self.failed += 1
+                message = f" 失败: {error}"
+            elif chunks == 0 and duplicates == 0:
+                self.failed += 1
+                message = "  警告 (内容为空)"
+            else:
+                self.success += 1
+                self.chunks += chunks
+                self.duplicates += duplicates
+                message = f" 成功 ({chunks} 片段" + (f", 重复 {duplicates} 个)" if duplicates else ")")
+            print(f"[{self.finished}/{self.total_files}] {name}:{message}", flush=True)
+
+def collect_pdf_files(root_folder: str):
+    """使用 os.walk 收集所有 PDF 文件的完整路径"""
+    pdf_files = []
+    for root, dirs, files in os.walk(root_folder):
+        for file in files:
+            if file.lower().endswith('.pdf'):
+                pdf_files.append(os.path.join(root, file))
+    return pdf_files
+
+def _parse_stage(jobs: List[FileJob], workers: int, parsed_queue: queue.Queue, stats: IngestStats):
+    """阶段 1：进程池计算哈希、解析与切分，进行中的任务数不超过 2 * workers"""
+    bucket_name = settings.MINIO_BUCKET_NAME
+    # spawn：避免 fork 已加载模型 / 已建立连接的主进程
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            pending = {}
+            remaining = iter(jobs)
+            while True:
+                for job in remaining:
+                    # 旧版清单的记录不按哈希跳过：按新的来源名重新摄取一次
+                    known_hash = job.previous.get("hash") if job.previous and not job.legacy_source else None
+                    minio_path = f"{bucket_name}/{job.source}"
+                    pending[pool.submit(prepare_document, job.path, minio_path, known_hash, job.source)] = job
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    try:
+                        job.file_hash, splits = future.result()
+                    except Exception as e:
+                        stats.record(job.name, error=f"解析失败 {e}")
+                        continue
+                    if splits is None:
+                        stats.record(job.name, skipped=True)
+                        continue
+                    if not splits:
+                        stats.record(job.name)
+                        continue
+                    job.splits = splits
+                    parsed_queue.put(job)
+    except Exception as e:
+        print(f"解析阶段异常终止: {e}")
+    finally:
+        parsed_queue.put(_DONE)
+
+def _dedup_job(job: FileJob, dedup_index: SimHashIndex, manifest: IngestManifest):
+    """移除该文件旧的签名后过滤重复片段；文件内容变化时，引用过它的文件下次重新摄取"""
+    dedup_index.remove_source(job.source)
+    if job.legacy_source:
+        dedup_index.remove_source(job.legacy_source)
+    if job.previous:
+        invalidate_dependents(manifest, job.legacy_source or job.source)
+    result = dedup_splits(dedup_index, job.source, job.splits)
+    job.splits = result.kept
+    job.signatures = result.signatures
+    job.duplicates = result.duplicates
+    job.linked_sources = sorted(result.linked_sources)
+
+def _embed_stage(
+    parsed_queue: queue.Queue,
+    sink_queue: queue.Queue,
+    batch_size: int,
+    sink_workers: int,
+    dedup_index: Optional[SimHashIndex],
+    manifest: IngestManifest
+):
+    """
+    阶段 2：把多个文件的片段攒成一批一次性 encode，再按文件拆开交给写入阶段。
+    队列里有现成的文件就继续攒，凑满 batch_size 或队列暂时为空时立即计算。
+    去重在这里按文件到达顺序串行进行，同一批里互相重复的文件也能识别
+    """
+    try:
+        embeddings = get_shared_embeddings()
+        finished = False
+        while not finished:
+            job = parsed_queue.get()
+            if job is _DONE:
+                break
+            if dedup_index is not None:
+                _dedup_job(job, dedup_index, manifest)
+            batch = [job]
+            pending_chunks = len(job.splits)
+            while pending_chunks < batch_size:
+                try:
+                    job = parsed_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _DONE:
+                    finished = True
+                    break
+                if dedup_index is not None:
+                    _dedup_job(job, dedup_index, manifest)
+                batch.append(job)
+                pending_chunks += len(job.splits)
+
+            texts = [doc.page_content for job in batch for doc in job.splits]
+            try:
+                vectors = embeddings.encode_documents(texts)
+            except Exception as e:
+                vectors = None
+                for job in batch:
+                    job.error = f"向量化失败 {e}"
+
+            offset = 0
+            for job in batch:
+                if vectors is not None:
+                    job.vectors = vectors[offset:offset + len(job.splits)]
+                    offset += len(job.splits)
+                sink_queue.put(job)
+    finally:
+        # 出错时也要通知写入线程结束，否则主线程等待它们时会一直挂起；异常继续向上抛出
+        for _ in range(sink_workers):
+            sink_queue.put(_DONE)
+
+def _sink_worker(
+    sink_queue: queue.Queue,
+    vector_store,
+    io_pool: ThreadPoolExecutor,
+    minio_client,
+    create_lock: threading.Lock,
+    manifest: IngestManifest,
+    dedup_index: Optional[SimHashIndex],
+    stats: IngestStats
+):
+    """
+    阶段 3：先删除该文件的旧片段，再并发写入 Milvus、ES 与 MinIO，成功后记入清单
     """
-    递归遍历文件夹及其所有子文件夹，处理所有 PDF 文件
+    while True:
+        job = sink_queue.get()
+        if job is _DONE:
+            return
+        if job.error:
+            if dedup_index is not None:
+                # 片段没有写入，撤销登记的签名
+                dedup_index.remove_source(job.source)
+            stats.record(job.name, error=job.error)
+            continue
+        try:
+            # 旧版清单的片段以文件名为来源
+            remove_document_chunks(vector_store, job.legacy_source or job.source, job.previous)
+
+            es_future = None
+            upload_future = None
+            if minio_client is not None:
+                # 对象名使用相对路径 (job.source)，不同目录下的同名文件不会互相覆盖
+                upload_future = io_pool.submit(upload_to_minio, job.path, job.source, minio_client)
+            # 片段全部是重复内容时只需要删除旧片段
+            if job.splits:
+                es_future = io_pool.submit(write_to_es, job.splits)
+                if vector_store.col is None:
+                    # 集合尚未创建：第一次写入加锁，避免多个线程同时建集合
+                    with create_lock:
+                        write_to_milvus(vector_store, job.splits, job.vectors)
+                else:
+                    write_to_milvus(vector_store, job.splits, job.vectors)
+
+            es_success, es_errors = es_future.result() if es_future is not None else (0, [])
+            if upload_future is not None:
+                try:
+                    upload_future.result()
+                except Exception as e:
+                    # 原文件上传失败不影响检索
+                    print(f"Minio 上传失败 ({job.name}): {e}")
+            if es_errors:
+                # 不记入清单，下次运行会重新处理该文件
+                stats.record(job.name, error=f"ES 写入失败 {len(es_errors)} 条")
+                continue
+
+            extra = {}
+            if dedup_index is not None:
+                extra = {"signatures": job.signatures, "linked_sources": job.linked_sources, "duplicates": job.duplicates}
+            manifest.record(job.source, job.file_hash, [doc.metadata["chunk_id"] for doc in job.splits], **extra)
+            if job.legacy_source:
+                manifest.remove(job.legacy_source)
+            manifest.checkpoint()
+            stats.record(job.name, chunks=len(job.splits), duplicates=job.duplicates)
+        except Exception as e:
+            if dedup_index is not None:
+                # 写入失败：撤销该文件登记的签名，否则之后的近似重复片段会被当作已存在而丢弃
+                dedup_index.remove_source(job.source)
+            stats.record(job.name, error=str(e))
+
+def _init_minio():
+    """共享一个客户端，桶只检查一次"""
+    try:
+        client = get_shared_minio_client()
+        ensure_bucket(client)
+        return client
+    except Exception as e:
+        print(f"Minio 不可用，跳过上传: {e}")
+        return None
+
+def batch_ingest_recursive(
+    root_folder: str = "data/pdfs",
+    workers: int = max(1, (os.cpu_count() or 2) - 1),
+    embed_batch_size: int = 256,
+    sink_workers: int = 4,
+    uploads: int = 8,
+    collection_name: str = settings.COLLECTION_NAME,
+    manifest_path: str = settings.INGEST_MANIFEST_PATH
+):
+    """
+    递归遍历文件夹及其所有子文件夹，以流水线方式增量处理所有 PDF 文件
     """
     # 1. 检查根目录是否存在
     if not os.path.exists(root_folder):
@@ -17,61 +297,124 @@ def batch_ingest_recursive(root_folder: str = "data/pdfs"):
         return
 
     print(f" 正在递归扫描 '{root_folder}' 下的所有 PDF 文件...")
-    
-    # 2. 使用 os.walk 收集所有 PDF 文件的完整路径
-    pdf_files = []
-    for root, dirs, files in os.walk(root_folder):
-        for file in files:
-            if file.lower().endswith('.pdf'):
-                # 组合成完整路径
-                full_path = os.path.join(root, file)
-                pdf_files.append(full_path)
-
+    pdf_files = collect_pdf_files(root_folder)
     total_files = len(pdf_files)
-    
+
     if total_files == 0:
         print(f"  未找到任何 PDF 文件。")
         return
 
-    print(f" 共发现 {total_files} 个 PDF 文件，准备开始处理...")
+    manifest = IngestManifest(collection_name, manifest_path)
+    vector_store = get_ingest_vector_store(collection_name)
+    collection_created = vector_store.col is None
+    if collection_created and len(manifest):
+        # 集合不存在 (首次摄取或已被重置)：清单里的记录都已失效，全部重新摄取
+        print(" 目标集合不存在，忽略并清空该集合的摄取清单")
+        manifest.clear()
+    dedup_index = SimHashIndex.from_manifest(manifest) if settings.INGEST_DEDUP_ENABLED else None
+    jobs = []
+    for path in pdf_files:
+        # 与 sync_minio 上传的对象名一致
+        source = object_name_for(path, root_folder)
+        previous = manifest.get(source)
+        legacy_source = None
+        if previous is None and source != os.path.basename(path):
+            # 旧版清单以文件名为 Key：沿用旧记录删除旧片段
+            legacy_source = os.path.basename(path)
+            previous = manifest.get(legacy_source)
+            if previous is None:
+                legacy_source = None
+        jobs.append(FileJob(path, source, previous, legacy_source))
+
+    print(f" 共发现 {total_files} 个 PDF 文件 (清单中已有 {len(manifest)} 个)，解析进程 {workers} 个，写入线程 {sink_workers} 个")
     print("=" * 60)
 
-    success_count = 0
-    fail_count = 0
     start_time = time.time()
+    stats = IngestStats(total_files)
+    parsed_queue: queue.Queue = queue.Queue(maxsize=workers * 2)
+    sink_queue: queue.Queue = queue.Queue(maxsize=sink_workers * 2)
 
-    # 3. 循环处理
-    for index, file_path in enumerate(pdf_files):
-        # 获取相对路径，打印出来好看一点 (例如: subfolder/book.pdf)
-        relative_name = os.path.relpath(file_path, root_folder)
-        current_num = index + 1
-        
-        print(f"[{current_num}/{total_files}] 处理中: {relative_name} ... ", end="", flush=True)
+    # 2. 解析阶段在后台运行
+    parse_thread = threading.Thread(
+        target=_parse_stage, args=(jobs, workers, parsed_queue, stats), daemon=True
+    )
+    parse_thread.start()
 
+    # 3. 写入阶段
+    minio_client = _init_minio()
+    create_lock = threading.Lock()
+    io_pool = ThreadPoolExecutor(max_workers=sink_workers + uploads)
+    sink_threads = [
+        threading.Thread(
+            target=_sink_worker,
+            args=(sink_queue, vector_store, io_pool, minio_client, create_lock, manifest, dedup_index, stats),
+            daemon=True
+        )
+        for _ in range(sink_workers)
+    ]
+    for thread in sink_threads:
+        thread.start()
+
+    # 4. 向量化阶段在主线程中运行
+    try:
         try:
-            chunks = process_and_embed_document(file_path)
-            
-            if chunks > 0:
-                print(f" 成功 ({chunks} 片段)")
-                success_count += 1
-            else:
-                print(f"  警告 (内容为空)")
-                fail_count += 1
-                
+            _embed_stage(parsed_queue, sink_queue, embed_batch_size, sink_workers, dedup_index, manifest)
+            parse_thread.join()
+        finally:
+            # 向量化阶段异常时解析线程 (守护线程) 不再等待；已交给写入线程的文件写完后再保存清单
+            for thread in sink_threads:
+                thread.join()
+            io_pool.shutdown()
+    finally:
+        # 无论是否中断都保存已完成的文件，下次从这里继续
+        manifest.save()
+
+    if stats.success:
+        if collection_created:
+            invalidate_vector_store(collection_name)
+        # 整批结束后只更新一次知识库版本
+        try:
+            bump_corpus_version(collection_name)
         except Exception as e:
-            print(f" 失败: {str(e)}")
-            fail_count += 1
+            print(f"更新知识库版本失败: {e}")
 
-    # 4. 总结
+    # 5. 总结
     duration = time.time() - start_time
     print("=" * 60)
-    print(f" 递归批量任务结束！耗时: {duration:.2f} 秒")
-    print(f" 统计: 成功 {success_count} | 失败 {fail_count} | 总计 {total_files}")
+    print(f" 递归批量任务结束！耗时: {duration:.2f} 秒 ({total_files / duration:.2f} 文件/秒, {stats.chunks / duration:.1f} 片段/秒)")
+    print(f" 统计: 成功 {stats.success} | 跳过 {stats.skipped} | 失败 {stats.failed} | 总计 {total_files}")
+    if stats.duplicates:
+        print(f" 去重: 跳过近似重复片段 {stats.duplicates} 个 (占 {stats.duplicates / (stats.chunks + stats.duplicates):.1%})")
+    metrics = get_metrics_snapshot()
+    encode_seconds = metrics["embedding_doc_batch_ms"]["sum"] / 1000
+    if encode_seconds > 0:
+        tokens = metrics["embedding_doc_tokens"]
+        print(f" 向量化: {tokens} tokens, 计算耗时 {encode_seconds:.1f} 秒 ({tokens / encode_seconds:.0f} tokens/秒)")
+    cache_hits = metrics.get("embedding_cache_hits", 0)
+    if cache_hits:
+        cache_total = cache_hits + metrics.get("embedding_cache_misses", 0)
+        print(f" 向量缓存: 命中 {cache_hits}/{cache_total} 个片段 ({cache_hits / cache_total:.1%})")
     print(" 知识库更新完毕！")
 
 if __name__ == "__main__":
-    TARGET_DIR = "data/pdfs"
-    if len(sys.argv) > 1:
-        TARGET_DIR = sys.argv[1]
+    parser = argparse.ArgumentParser(description="流水线式增量批量摄取 PDF")
+    parser.add_argument("root_folder", nargs="?", default="data/pdfs", help="PDF 根目录 (递归扫描)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="解析切分的进程数")
+    parser.add_argument("--embed-batch-size", type=int, default=256, help="向量化阶段每批的片段数")
+    parser.add_argument("--sink-workers", type=int, default=4, help="Milvus / ES 写入线程数")
+    parser.add_argument("--uploads", type=int, default=8, help="MinIO 并发上传数")
+    parser.add_argument("--manifest", default=settings.INGEST_MANIFEST_PATH, help="摄取清单路径")
+    args = parser.parse_args()
 
-    batch_ingest_recursive(TARGET_DIR)
\ No newline at end of file
+    try:
+        batch_ingest_recursive(
+            args.root_folder,
+            workers=args.workers,
+            embed_batch_size=args.embed_batch_size,
+            sink_workers=args.sink_workers,
+            uploads=args.uploads,
+            manifest_path=args.manifest
+        )
+    except Exception as e:
+        print(f"❌ 批量摄取异常终止: {e}")
+        sys.exit(1)
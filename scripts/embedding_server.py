@@ -0,0 +1,41 @@
+# scripts/embedding_server.py
+import os
+import sys
+import argparse
+
+# 将项目根目录加入 Python 路径，防止找不到 app 模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import DEFAULT_SECRET_KEY, settings
+from app.core import model_loader
+from app.core.embedding_server import EmbeddingServer
+
+# --- 独立的 Embedding 服务进程 ---
+# 每台机器启动一个，模型只加载一份；API 进程设置相同的 EMBEDDING_SERVER_SOCKET 后自动连接。
+# 推理后端 / 线程数沿用 EMBEDDING_BACKEND、EMBEDDING_NUM_THREADS 等配置。
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动进程外 Embedding 服务 (Unix socket)")
+    parser.add_argument(
+        "--socket", default=settings.EMBEDDING_SERVER_SOCKET or "/tmp/rag_embedding.sock",
+        help="监听的 Unix socket 路径 (API 进程的 EMBEDDING_SERVER_SOCKET 需与之一致)"
+    )
+    args = parser.parse_args()
+
+    if settings.SECRET_KEY.get_secret_value() == DEFAULT_SECRET_KEY:
+        print("❌ SECRET_KEY 仍是默认值，Embedding 服务未启动 (请在 .env 中设置 SECRET_KEY)")
+        sys.exit(1)
+
+    model_loader.load_local_model()
+    if model_loader.global_embedding_model is None:
+        print("❌ 模型加载失败，Embedding 服务未启动")
+        sys.exit(1)
+    server = EmbeddingServer(
+        model_loader.global_embedding_model,
+        model_loader.global_embedding_model_name,
+        model_loader.find_model_path()
+    )
+    try:
+        server.serve_forever(args.socket)
+    except KeyboardInterrupt:
+        print("Embedding 服务已停止")
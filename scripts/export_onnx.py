@@ -0,0 +1,173 @@
+# scripts/export_onnx.py
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from typing import Dict, List
+
+# 将项目根目录加入 Python 路径，防止找不到 app 模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.core.model_loader import find_model_path, onnx_file_name, load_torch_model, load_onnx_model
+
+# --- 导出 ONNX / int8 量化模型，并与 PyTorch 向量做一致性检查 ---
+# 1. 导出 <模型目录>/onnx/model.onnx (fp32)
+# 2. 可选：动态量化为 int8，写入 <模型目录>/onnx/model_qint8_<配置>.onnx
+# 3. 对比各后端与 PyTorch (CPU) 的向量：逐条余弦相似度、近邻排序一致性，以及编码延迟
+# 一致性达标后再把 .env 中的 EMBEDDING_BACKEND / EMBEDDING_ONNX_QUANTIZATION 切过去。
+
+SAMPLE_TEXTS = [
+    "计算机大厂面试主要看重哪些能力？",
+    "Java 中 HashMap 的底层结构是什么，扩容时发生了什么？",
+    "Python 的 GIL 对多线程程序有什么影响？",
+    "Linux 下如何查看某个端口被哪个进程占用？",
+    "TCP 三次握手与四次挥手的过程",
+    "数据库索引为什么使用 B+ 树而不是红黑树？",
+    "Redis 的持久化方式有 RDB 和 AOF 两种，各自的优缺点是什么？",
+    "什么是向量数据库？它和传统数据库有什么区别？",
+    "操作系统中进程和线程的区别",
+    "如何设计一个高并发的秒杀系统？",
+    "Docker 容器与虚拟机的区别是什么？",
+    "解释一下 MySQL 的事务隔离级别以及幻读问题",
+    "微服务架构中如何做服务发现与负载均衡？",
+    "简历中的项目经历应该怎么写才能突出重点？",
+    "快速排序的平均时间复杂度和最坏时间复杂度分别是多少？",
+    "Kafka 如何保证消息不丢失？",
+]
+
+def load_texts(path: str, limit: int) -> List[str]:
+    if not path:
+        return SAMPLE_TEXTS
+    with open(path, "r", encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    return texts[:limit]
+
+def export(model_path: str, quantizations: List[str]):
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    onnx_path = os.path.join(model_path, "onnx", onnx_file_name(""))
+    if os.path.exists(onnx_path):
+        print(f"已存在 fp32 ONNX 模型: {onnx_path}")
+    else:
+        print("正在导出 fp32 ONNX 模型...")
+        started = time.perf_counter()
+        # 目录中没有 onnx/model.onnx 时，sentence-transformers 会通过 optimum 自动导出
+        model = SentenceTransformer(model_path, device="cpu", backend="onnx")
+        model.save_pretrained(model_path)
+        print(f"✅ 导出完成 ({time.perf_counter() - started:.1f}s): {onnx_path}")
+
+    for quantization in quantizations:
+        print(f"正在量化 (int8, {quantization})...")
+        started = time.perf_counter()
+        model = SentenceTransformer(model_path, device="cpu", backend="onnx", model_kwargs={"file_name": onnx_file_name("")})
+        export_dynamic_quantized_onnx_model(model, quantization, model_path)
+        print(f"✅ 量化完成 ({time.perf_counter() - started:.1f}s): {os.path.join(model_path, 'onnx', onnx_file_name(quantization))}")
+
+def measure(model, texts: List[str], repeats: int) -> Dict[str, float]:
+    """整批编码耗时与单条查询延迟 (预热一次后取中位数)"""
+    model.encode(texts[:2], normalize_embeddings=True)
+    batch_times, single_times = [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        model.encode(texts, normalize_embeddings=True, batch_size=32)
+        batch_times.append(time.perf_counter() - started)
+    for text in texts:
+        started = time.perf_counter()
+        model.encode(text, normalize_embeddings=True)
+        single_times.append(time.perf_counter() - started)
+    return {
+        "batch_ms": float(np.median(batch_times)) * 1000,
+        "texts_per_sec": len(texts) / float(np.median(batch_times)),
+        "single_p50_ms": float(np.percentile(single_times, 50)) * 1000,
+        "single_p95_ms": float(np.percentile(single_times, 95)) * 1000,
+    }
+
+def neighbor_overlap(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    """每条文本在样本集内的 top-k 近邻，两组向量结果的平均重合比例 (衡量检索排序是否一致)"""
+    k = min(k, len(reference) - 1)
+    if k <= 0:
+        return 1.0
+
+    def top_k(vectors: np.ndarray) -> np.ndarray:
+        scores = vectors @ vectors.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    ref, cand = top_k(reference), top_k(candidate)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref, cand)]))
+
+def check_parity(model_path: str, quantizations: List[str], texts: List[str], k: int, repeats: int, min_cosine: float) -> bool:
+    print(f"一致性检查: {len(texts)} 条文本，线程数 {settings.EMBEDDING_NUM_THREADS or '默认'}")
+    reference_model = load_torch_model(model_path, device="cpu")
+    reference = reference_model.encode(texts, normalize_embeddings=True, batch_size=32)
+    results = {"torch-fp32": (None, measure(reference_model, texts, repeats))}
+    del reference_model
+
+    # 加载失败与精度不达标分开统计：前者是导出 / 环境问题，后者才是量化误差
+    load_failures: Dict[str, str] = {}
+    below_threshold: List[str] = []
+    for quantization in [""] + quantizations:
+        label = f"onnx-{quantization or 'fp32'}"
+        try:
+            model = load_onnx_model(model_path, quantization)
+        except Exception as e:
+            print(f"❌ {label} 加载失败: {e}")
+            load_failures[label] = str(e)
+            continue
+        vectors = model.encode(texts, normalize_embeddings=True, batch_size=32)
+        cosine = np.sum(reference * vectors, axis=1)
+        parity = {"cos_min": float(cosine.min()), "cos_mean": float(cosine.mean()), "overlap": neighbor_overlap(reference, vectors, k)}
+        results[label] = (parity, measure(model, texts, repeats))
+        if parity["cos_min"] < min_cosine:
+            below_threshold.append(label)
+        del model
+
+    base = results["torch-fp32"][1]
+    print("-" * 96)
+    print(f"{'后端':<22}{'最小余弦':>10}{'平均余弦':>10}{f'top-{k}重合':>10}{'整批ms':>10}{'条/秒':>10}{'单条p50':>10}{'单条p95':>10}{'加速':>8}")
+    for label, (parity, timing) in results.items():
+        cos_min = f"{parity['cos_min']:.4f}" if parity else "-"
+        cos_mean = f"{parity['cos_mean']:.4f}" if parity else "-"
+        overlap = f"{parity['overlap']:.2%}" if parity else "-"
+        speedup = base["batch_ms"] / timing["batch_ms"]
+        print(
+            f"{label:<22}{cos_min:>10}{cos_mean:>10}{overlap:>10}{timing['batch_ms']:>10.1f}"
+            f"{timing['texts_per_sec']:>10.1f}{timing['single_p50_ms']:>10.1f}{timing['single_p95_ms']:>10.1f}{speedup:>7.2f}x"
+        )
+    print("-" * 96)
+    for label, error in load_failures.items():
+        print(f"❌ {label} 加载失败，未参与一致性检查: {error}")
+    if below_threshold:
+        print(f"❌ 最小余弦相似度低于 {min_cosine}: {', '.join(below_threshold)}")
+    # 模型加载失败同样算未通过，否则全部失败时检查会误报通过
+    passed = not load_failures and not below_threshold
+    if passed:
+        print("✅ 一致性检查通过")
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出 ONNX / int8 量化的 Embedding 模型并检查与 PyTorch 的一致性")
+    parser.add_argument("--model-path", default=None, help="模型目录 (默认按 model_loader 的查找顺序)")
+    parser.add_argument(
+        "--quantize", nargs="*", default=[], choices=["avx512_vnni", "avx512", "avx2", "arm64"],
+        help="需要导出的 int8 量化配置 (按 CPU 指令集选择)"
+    )
+    parser.add_argument("--check-only", action="store_true", help="只做一致性检查，不导出")
+    parser.add_argument("--texts-file", default="", help="一致性检查用的文本 (每行一条，默认使用内置样例)")
+    parser.add_argument("--limit", type=int, default=1000, help="最多读取的文本条数")
+    parser.add_argument("--top-k", type=int, default=5, help="近邻排序一致性的 k")
+    parser.add_argument("--repeats", type=int, default=3, help="整批编码测速次数")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="逐条余弦相似度的下限")
+    args = parser.parse_args()
+
+    model_path = args.model_path or find_model_path()
+    if not model_path:
+        print("未找到模型文件，请先运行 download_model.py")
+        sys.exit(1)
+    if not args.check_only:
+        export(model_path, args.quantize)
+    ok = check_parity(model_path, args.quantize, load_texts(args.texts_file, args.limit), args.top_k, args.repeats, args.min_cosine)
+    sys.exit(0 if ok else 1)
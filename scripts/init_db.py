@@ -0,0 +1,27 @@
+# scripts/init_db.py
+import os
+import sys
+
+# 将项目根目录加入 Python 路径，防止找不到 app 模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.session import engine
+from app.models.user import Base
+# 导入所有模型，确保它们的表都注册到 Base.metadata 上
+import app.models.chat  # noqa: F401
+
+def init_db():
+    """
+    建表 (只创建不存在的表，不修改已有表结构)。
+    部署时在启动 API 之前执行一次，API 进程本身不再连接 MySQL 建表
+    """
+    print(f"🔌 正在连接 MySQL ({engine.url.host}:{engine.url.port}/{engine.url.database})...")
+    try:
+        Base.metadata.create_all(bind=engine)
+        print(f"✅ 数据表已就绪: {', '.join(sorted(Base.metadata.tables))}")
+    except Exception as e:
+        print(f"❌ 建表失败: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    init_db()
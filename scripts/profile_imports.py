@@ -0,0 +1,68 @@
+# scripts/profile_imports.py
+import os
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# --- 导入耗时分析 ---
+# 在子进程中以 python -X importtime 导入目标模块，汇总 stderr 中的逐模块耗时：
+# 按累计耗时列出最慢的模块、按顶层包汇总自身耗时。
+# 传入 --max-ms 时总耗时超过阈值则以非零状态退出，可放进 CI 防止启动变慢。
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_importtime(module: str) -> Tuple[List[Tuple[str, int, int, int]], int]:
+    """返回 ([(模块名, 缩进层级, 自身耗时 us, 累计耗时 us)], 子进程退出码)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True
+    )
+    records = []
+    for line in result.stderr.splitlines():
+        # 格式: "import time:       123 |       4567 |   package.module"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+    return records, result.returncode
+
+def summarize(records: List[Tuple[str, int, int, int]], top: int) -> int:
+    # 顶层 (depth 0) 的累计耗时之和就是整个 import 的耗时
+    total_us = sum(cumulative for _, depth, _, cumulative in records if depth == 0)
+    by_package: Dict[str, int] = defaultdict(int)
+    for name, _, self_us, _ in records:
+        by_package[name.split(".")[0]] += self_us
+
+    print(f"总导入耗时: {total_us / 1000:.1f} ms ({len(records)} 个模块)")
+    print("-" * 60)
+    print(f"累计耗时最高的 {top} 个模块:")
+    for name, _, _, cumulative in sorted(records, key=lambda r: -r[3])[:top]:
+        print(f"  {cumulative / 1000:9.1f} ms  {name}")
+    print("-" * 60)
+    print(f"自身耗时最高的 {top} 个顶层包:")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {self_us / 1000:9.1f} ms  {package}")
+    return total_us
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分析模块导入耗时 (python -X importtime 汇总)")
+    parser.add_argument("module", nargs="?", default="app.main", help="要导入的模块")
+    parser.add_argument("--top", type=int, default=15, help="列出的条数")
+    parser.add_argument("--max-ms", type=float, default=None, help="总耗时上限 (毫秒)，超过时以状态码 1 退出")
+    args = parser.parse_args()
+
+    records, returncode = run_importtime(args.module)
+    if returncode != 0:
+        print(f"❌ 导入 {args.module} 失败")
+        sys.exit(returncode)
+    total_us = summarize(records, args.top)
+    if args.max_ms is not None and total_us / 1000 > args.max_ms:
+        print(f"❌ 导入耗时 {total_us / 1000:.1f} ms 超过上限 {args.max_ms} ms")
+        sys.exit(1)
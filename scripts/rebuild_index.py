@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+# --- 将项目根目录加入 Python 路径 ---
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymilvus import Collection, DataType, connections, utility
+from app.core.config import settings
+from app.services.milvus_service import (
+    INDEX_TYPES, build_index_params, build_search_params, get_connection_args
+)
+from app.services.cache_service import bump_corpus_version
+
+# --- 离线重建向量索引 ---
+# 释放集合 -> 删除旧索引 -> 按配置 (或命令行参数) 建新索引 -> 重新加载，
+# 并报告构建耗时、加载后的内存占用与检索延迟，用来比较不同索引类型 / 参数的取舍。
+# 重建期间集合不可检索，请在低峰期运行。
+# 运行中的 API 按 MILVUS_SCHEMA_CHECK_INTERVAL 比对集合指纹 (含索引)，发现索引变化后按新索引重新生成检索参数。
+
+# 每个向量在索引中的大致字节数 (不含 HNSW 图结构、IVF 聚类中心等额外开销)
+def estimate_vector_bytes(index_type: str, dim: int, params: Dict[str, Any]) -> float:
+    if index_type == "IVF_SQ8":
+        return dim
+    if index_type == "IVF_PQ":
+        return params.get("m", settings.MILVUS_INDEX_PQ_M) * params.get("nbits", settings.MILVUS_INDEX_PQ_NBITS) / 8
+    if index_type == "HNSW":
+        # 原始向量 + 每层约 2*M 个邻居 (int32)
+        return dim * 4 + params.get("M", settings.MILVUS_HNSW_M) * 2 * 4
+    return dim * 4
+
+def find_vector_field(collection: Collection):
+    for field in collection.schema.fields:
+        if field.dtype == DataType.FLOAT_VECTOR:
+            return field
+    raise RuntimeError(f"集合 '{collection.name}' 中没有 FLOAT_VECTOR 字段")
+
+def loaded_memory_bytes(collection_name: str) -> Optional[int]:
+    """QueryNode 上已加载段的内存合计 (Milvus 未返回时为 None)"""
+    try:
+        segments = utility.get_query_segment_info(collection_name)
+    except Exception as e:
+        print(f"⚠️ 读取段内存信息失败: {e}")
+        return None
+    return sum(getattr(segment, "mem_size", 0) for segment in segments)
+
+def sample_query_vectors(collection: Collection, vector_field: str, dim: int, count: int) -> np.ndarray:
+    """优先取集合中已有的向量作为查询 (分布与真实查询接近)，取不到时用随机单位向量"""
+    try:
+        rows = collection.query(expr="", output_fields=[vector_field], limit=count)
+        vectors = np.asarray([row[vector_field] for row in rows], dtype=np.float32)
+        if len(vectors):
+            return vectors
+    except Exception as e:
+        print(f"⚠️ 读取样本向量失败，改用随机向量: {e}")
+    vectors = np.random.default_rng(0).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def measure_latency(collection: Collection, vector_field: str, queries: np.ndarray, search_params: Dict[str, Any], k: int) -> List[float]:
+    # 先跑一次预热，避免首个请求的冷启动计入
+    collection.search(queries[:1].tolist(), vector_field, search_params, limit=k)
+    latencies = []
+    for vector in queries:
+        started = time.perf_counter()
+        collection.search([vector.tolist()], vector_field, search_params, limit=k)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+def rebuild_index(args):
+    connections.connect(**get_connection_args())
+    collection_name = args.collection
+    if not utility.has_collection(collection_name):
+        print(f"❌ 集合 '{collection_name}' 不存在")
+        return
+
+    collection = Collection(collection_name)
+    vector_field = find_vector_field(collection)
+    dim = vector_field.params["dim"]
+    rows = collection.num_entities
+
+    old_index = next((index for index in collection.indexes if index.field_name == vector_field.name), None)
+    old_metric = old_index.params.get("metric_type") if old_index else None
+    try:
+        # 不属于所选索引类型的参数 (例如 HNSW 上的 --nlist) 直接报错，不静默带入
+        index_params = build_index_params(
+            args.index_type, args.metric_type or old_metric,
+            nlist=args.nlist, m=args.m, nbits=args.nbits, M=args.hnsw_m, efConstruction=args.ef_construction
+        )
+        search_params = build_search_params(
+            index_params["index_type"], index_params["metric_type"], nprobe=args.nprobe, ef=args.ef
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    print(f"集合 '{collection_name}': {rows} 条向量, 维度 {dim}")
+    print(f"  旧索引: {old_index.params if old_index else '无'}")
+    print(f"  新索引: {index_params}")
+    print(f"  检索参数: {search_params}")
+
+    # 索引不能在加载状态下删除
+    collection.release()
+    if old_index is not None:
+        collection.drop_index(index_name=old_index.index_name)
+
+    started = time.perf_counter()
+    collection.create_index(vector_field.name, index_params)
+    utility.wait_for_index_building_complete(collection_name)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    collection.load()
+    load_seconds = time.perf_counter() - started
+
+    # 缓存答案可能基于旧索引的召回结果 (版本号在 Redis 中，运行中的 API 同样生效)
+    try:
+        bump_corpus_version(collection_name)
+    except Exception as e:
+        print(f"⚠️ 更新知识库版本失败: {e}")
+
+    memory = loaded_memory_bytes(collection_name)
+    estimated = rows * estimate_vector_bytes(index_params["index_type"], dim, index_params["params"])
+    queries = sample_query_vectors(collection, vector_field.name, dim, args.queries)
+    latencies = measure_latency(collection, vector_field.name, queries, search_params, args.top_k)
+
+    print("✅ 索引重建完成")
+    print(f"  构建耗时: {build_seconds:.2f}s, 加载耗时: {load_seconds:.2f}s")
+    if memory is not None:
+        print(f"  加载后内存: {memory / 1024 / 1024:.1f} MB")
+    print(f"  向量部分估算: {estimated / 1024 / 1024:.1f} MB")
+    print(
+        f"  检索延迟 ({len(latencies)} 次, top_k={args.top_k}): "
+        f"p50 {np.percentile(latencies, 50):.2f} ms, "
+        f"p95 {np.percentile(latencies, 95):.2f} ms, "
+        f"p99 {np.percentile(latencies, 99):.2f} ms"
+    )
+    print(
+        f"提示: 运行中的 API 会在 {settings.MILVUS_SCHEMA_CHECK_INTERVAL}s 内发现索引变化并按新索引生成检索参数；"
+        "如需固定 ef / nprobe 等检索参数，请同步修改 .env 中的 MILVUS_SEARCH_* 配置"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线重建 Milvus 向量索引并报告构建耗时、内存与检索延迟")
+    parser.add_argument("--collection", default=settings.COLLECTION_NAME, help="集合名称")
+    parser.add_argument("--index-type", type=str.upper, choices=INDEX_TYPES, default=None, help="索引类型 (默认 MILVUS_INDEX_TYPE)")
+    parser.add_argument("--metric-type", type=str.upper, choices=("L2", "IP", "COSINE"), default=None, help="度量 (默认沿用旧索引，没有旧索引时用 MILVUS_METRIC_TYPE)")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF 聚类数")
+    parser.add_argument("--m", type=int, default=None, help="IVF_PQ 子向量个数")
+    parser.add_argument("--nbits", type=int, default=None, help="IVF_PQ 编码位数")
+    parser.add_argument("--hnsw-m", type=int, default=None, help="HNSW 每个节点的邻居数")
+    parser.add_argument("--ef-construction", type=int, default=None, help="HNSW 构建时的候选列表长度")
+    parser.add_argument("--nprobe", type=int, default=None, help="检索时探测的聚类数")
+    parser.add_argument("--ef", type=int, default=None, help="HNSW 检索时的候选列表长度")
+    parser.add_argument("--queries", type=int, default=200, help="延迟测试的查询次数")
+    parser.add_argument("--top-k", type=int, default=settings.MILVUS_CANDIDATE_K, help="延迟测试的 top_k")
+    args = parser.parse_args()
+    rebuild_index(args)
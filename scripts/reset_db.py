@@ -7,6 +7,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from pymilvus import MilvusClient
 from app.core.config import settings
+from app.services.cache_service import bump_corpus_version
+from app.services.es_service import delete_index
+from app.services.manifest_service import IngestManifest
 
 def reset_milvus():
     # 拼接 URI 地址 (例如 http://milvus-standalone:19530)
@@ -27,12 +30,38 @@ def reset_milvus():
             print("✅ 集合已删除！数据已清空。")
         else:
             print(f"集合 '{collection_name}' 不存在，无需清理。")
-            
+        return True
+
     except Exception as e:
         print(f"❌ 连接或操作失败: {e}")
         # 如果是 host 解析失败，提示用户
         if "Name or service not known" in str(e):
             print("提示: 如果你在容器外运行此脚本，请设置环境变量 MILVUS_HOST=localhost")
+        return False
+
+def reset_es():
+    print(f"🔌 正在删除 ES 索引 '{settings.ES_INDEX}' ({settings.ES_URL})...")
+    try:
+        if delete_index():
+            print("✅ ES 索引已删除！")
+        else:
+            print(f"ES 索引 '{settings.ES_INDEX}' 不存在，无需清理。")
+    except Exception as e:
+        print(f"❌ 删除 ES 索引失败: {e}")
+
+def reset_manifest():
+    # 清单记录的文件哈希已对应不到任何片段，不清空的话下次摄取会把所有文件当作"未变化"跳过
+    manifest = IngestManifest(settings.COLLECTION_NAME)
+    manifest.clear()
+    manifest.save()
+    print(f"✅ 摄取清单中 '{settings.COLLECTION_NAME}' 的记录已清空: {settings.INGEST_MANIFEST_PATH}")
 
 if __name__ == "__main__":
-    reset_milvus()
\ No newline at end of file
+    if reset_milvus():
+        reset_es()
+        reset_manifest()
+        # 让基于旧数据的缓存答案失效
+        try:
+            bump_corpus_version(settings.COLLECTION_NAME)
+        except Exception as e:
+            print(f"⚠️ 更新知识库版本失败: {e}")
\ No newline at end of file
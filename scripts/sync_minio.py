@@ -1,54 +1,59 @@
 # scripts/sync_minio.py
 import os
 import sys
+import argparse
 
 # 将项目根目录加入 python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.services.minio_service import minio_client
+from app.services.minio_service import sync_files
 from app.core.config import settings
 
-def sync_local_to_minio(local_folder: str = "data/pdfs"):
+def collect_files(local_folder: str, extensions):
+    """递归收集待同步的文件 (按扩展名过滤，不区分大小写)"""
+    files = []
+    for root, dirs, names in os.walk(local_folder):
+        for filename in names:
+            if filename.lower().endswith(extensions):
+                files.append(os.path.join(root, filename))
+    return files
+
+def sync_local_to_minio(
+    local_folder: str = "data/pdfs",
+    prefix: str = "",
+    workers: int = settings.MINIO_SYNC_WORKERS,
+    extensions=(".pdf",),
+    dry_run: bool = False
+):
     """
-    将本地文件夹中的 PDF 同步上传到 Minio
+    将本地文件夹增量同步到 Minio：保留相对路径，大小与 ETag 一致的对象跳过，并发上传
     """
     bucket_name = settings.MINIO_BUCKET_NAME
+    if not os.path.isdir(local_folder):
+        print(f" 错误：文件夹 '{local_folder}' 不存在！")
+        return
+
+    files = collect_files(local_folder, tuple(extensions))
+    total_bytes = sum(os.path.getsize(path) for path in files)
+    print(f" 开始将 '{local_folder}' 同步到 Minio: {bucket_name}/{prefix} ...")
+    print(f" 共 {len(files)} 个文件 ({total_bytes / 1024 / 1024:.1f} MB)，并发 {workers}，分片 {settings.MINIO_PART_SIZE // 1024 // 1024} MB")
 
-    # 1. 确保 Bucket 存在
-    if not minio_client.bucket_exists(bucket_name):
-        print(f" Bucket '{bucket_name}' 不存在，正在创建...")
-        minio_client.make_bucket(bucket_name)
-
-    print(f" 开始将 '{local_folder}' 同步到 Minio: {bucket_name} ...")
-    
-    success_count = 0
-    
-    # 2. 遍历本地文件
-    for root, dirs, files in os.walk(local_folder):
-        for filename in files:
-            if filename.lower().endswith('.pdf'):
-                local_path = os.path.join(root, filename)
-                # 在 Minio 中的文件名 (保持相对路径结构，或者直接用文件名)
-                # 这里为了简单，我们直接用文件名，如果你有重名文件可能需要注意
-                object_name = filename 
-                
-                print(f"正在上传: {object_name} ... ", end="", flush=True)
-                
-                try:
-                    # fput_object 专门用来上传本地文件
-                    minio_client.fput_object(
-                        bucket_name, 
-                        object_name, 
-                        local_path,
-                        content_type="application/pdf"
-                    )
-                    print("成功")
-                    success_count += 1
-                except Exception as e:
-                    print(f"失败: {e}")
+    stats = sync_files(files, local_folder, prefix=prefix, workers=workers, dry_run=dry_run)
 
+    elapsed = stats.elapsed
+    megabytes = stats.bytes_uploaded / 1024 / 1024
     print("-" * 50)
-    print(f"同步完成！共上传 {success_count} 个文件。")
+    print(f"同步完成！耗时 {elapsed:.2f} 秒")
+    print(f" 上传 {stats.uploaded} 个 ({megabytes:.1f} MB) | 未变化跳过 {stats.skipped} 个 ({stats.bytes_skipped / 1024 / 1024:.1f} MB) | 失败 {stats.failed} 个")
+    if elapsed > 0 and stats.uploaded and not dry_run:
+        print(f" 吞吐: {megabytes / elapsed:.1f} MB/秒, {stats.uploaded / elapsed:.1f} 文件/秒")
 
 if __name__ == "__main__":
-    sync_local_to_minio()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="增量同步本地文件夹到 Minio")
+    parser.add_argument("local_folder", nargs="?", default="data/pdfs", help="本地根目录 (递归扫描)")
+    parser.add_argument("--prefix", default="", help="桶内对象名前缀")
+    parser.add_argument("--workers", type=int, default=settings.MINIO_SYNC_WORKERS, help="并发上传的文件数")
+    parser.add_argument("--ext", nargs="+", default=[".pdf"], help="需要同步的扩展名")
+    parser.add_argument("--dry-run", action="store_true", help="只列出需要上传的文件")
+    args = parser.parse_args()
+    sync_local_to_minio(args.local_folder, args.prefix, args.workers, [e.lower() for e in args.ext], args.dry_run)
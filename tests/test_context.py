@@ -0,0 +1,91 @@
+# tests/test_context.py
+from langchain_core.documents import Document
+from app.core.config import settings
+from app.services.context_service import SEPARATOR, count_tokens, merge_chunks, pack_context
+
+# 一页英文正文，片段从中按偏移截取
+PAGE = " ".join(f"sentence{i:03d} about retrieval augmented generation." for i in range(40))
+
+def chunk(start: int, end: int, source: str = "a.pdf", page: int = 1, offset: bool = True) -> Document:
+    metadata = {"source": source, "page": page}
+    if offset:
+        metadata["start_index"] = start
+    return Document(page_content=PAGE[start:end], metadata=metadata)
+
+def test_overlapping_chunks_merge_by_offset():
+    docs = [chunk(100, 300), chunk(0, 150)]
+    text, used = pack_context(docs, max_tokens=10000)
+    assert text == PAGE[0:300]
+    # 块内片段按偏移排列
+    assert used == [docs[1], docs[0]]
+
+def test_adjacent_chunks_merge_by_offset():
+    """紧邻的片段直接拼接；中间隔着被切掉的分隔符时补一个换行"""
+    text, _ = pack_context([chunk(0, 100), chunk(100, 200)], max_tokens=10000)
+    assert text == PAGE[0:200]
+    text, _ = pack_context([chunk(0, 100), chunk(101, 200)], max_tokens=10000)
+    assert text == PAGE[0:100] + "\n" + PAGE[101:200]
+
+def test_contained_chunk_is_absorbed():
+    text, used = pack_context([chunk(0, 300), chunk(50, 120)], max_tokens=10000)
+    assert text == PAGE[0:300]
+    assert len(used) == 2
+
+def test_distant_chunks_and_other_pages_stay_separate():
+    docs = [chunk(0, 100), chunk(500, 600), chunk(0, 100, page=2)]
+    text, used = pack_context(docs, max_tokens=10000)
+    assert text == SEPARATOR.join(d.page_content for d in docs)
+    assert used == docs
+
+def test_merged_block_takes_best_rank():
+    """合并后的块按块内最相关片段的名次排序"""
+    docs = [chunk(0, 100, source="b.pdf"), chunk(200, 300), chunk(0, 220)]
+    blocks = merge_chunks(docs)
+    assert [block.text for block in blocks] == [PAGE[0:100], PAGE[0:300]]
+    assert blocks[1].rank == 1
+
+def test_chunks_without_start_index_merge_by_text():
+    """没有偏移信息时，按首尾重叠的正文合并"""
+    docs = [chunk(100, 300, offset=False), chunk(0, 150, offset=False)]
+    text, used = pack_context(docs, max_tokens=10000)
+    assert text == PAGE[0:300]
+    assert len(used) == 2
+
+def test_short_text_overlap_is_not_merged():
+    """首尾重叠不足 MIN_TEXT_OVERLAP 时不认为是同一段文字"""
+    docs = [chunk(0, 100, offset=False), chunk(90, 200, offset=False)]
+    text, _ = pack_context(docs, max_tokens=10000)
+    assert text == SEPARATOR.join(d.page_content for d in docs)
+
+def test_budget_skips_blocks_that_do_not_fit(monkeypatch):
+    """放不下的块跳过，继续放后面更短的块"""
+    monkeypatch.setattr(settings, "CONTEXT_ESTIMATE_HEADROOM", 0.0)
+    medium = chunk(0, 400, source="a.pdf")
+    large = chunk(0, 1000, source="b.pdf")
+    small = chunk(0, 100, source="c.pdf")
+    budget = count_tokens(medium.page_content) + count_tokens(SEPARATOR) + count_tokens(small.page_content)
+    text, used = pack_context([medium, large, small], max_tokens=budget)
+    assert text == medium.page_content + SEPARATOR + small.page_content
+    assert used == [medium, small]
+
+def test_first_block_over_budget_is_truncated():
+    """最相关的块本身超出预算时截断放入，上下文不为空"""
+    large = chunk(0, 1000)
+    text, used = pack_context([large, chunk(0, 100, source="b.pdf")], max_tokens=50)
+    assert text
+    assert large.page_content.startswith(text)
+    assert count_tokens(text) <= 50
+    assert used == [large]
+
+def test_estimated_budget_keeps_headroom(monkeypatch):
+    """没有分词器、按字符数估算时，实际使用的预算按 CONTEXT_ESTIMATE_HEADROOM 收紧"""
+    monkeypatch.setattr(settings, "CONTEXT_ESTIMATE_HEADROOM", 0.2)
+    first = chunk(0, 100, source="a.pdf")
+    second = chunk(0, 100, source="b.pdf")
+    budget = count_tokens(first.page_content) + count_tokens(SEPARATOR) + count_tokens(second.page_content)
+    text, used = pack_context([first, second], max_tokens=budget)
+    assert used == [first]
+    assert count_tokens(text) <= budget * 0.8
+
+def test_empty_docs():
+    assert pack_context([]) == ("", [])
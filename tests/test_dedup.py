@@ -0,0 +1,118 @@
+# tests/test_dedup.py
+import hashlib
+import pytest
+from langchain_core.documents import Document
+from app.services.dedup_service import (
+    SIGNATURE_BITS, SHINGLE_SIZE, SimHashIndex, dedup_splits, hamming_distance, simhash
+)
+
+TEXT = (
+    "Python 的垃圾回收以引用计数为主，循环引用由分代回收器处理。"
+    "对象的引用计数降为零时立即释放内存，分代回收则定期扫描容器对象，找出不可达的循环引用并回收。"
+)
+
+def make_doc(chunk_id: str, text: str) -> Document:
+    return Document(page_content=text, metadata={"chunk_id": chunk_id})
+
+def flip_bits(signature: int, count: int) -> int:
+    """翻转分布在不同位置的 count 位"""
+    for i in range(count):
+        signature ^= 1 << (i * 17 % SIGNATURE_BITS)
+    return signature
+
+def test_simhash_bit_packing():
+    """第 i 位等于所有 n-gram 哈希第 i 位的多数票"""
+    normalized = TEXT.replace(" ", "").lower()
+    shingles = [normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)]
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles]
+    expected = 0
+    for bit in range(SIGNATURE_BITS):
+        ones = sum((h >> bit) & 1 for h in hashes)
+        if ones * 2 > len(hashes):
+            expected |= 1 << bit
+    assert simhash(TEXT) == expected
+    assert 0 <= simhash(TEXT) < 1 << SIGNATURE_BITS
+
+def test_simhash_ignores_whitespace_and_case():
+    assert simhash("Hello World  foo\nbar") == simhash("helloworld FOO bar")
+
+def test_index_hamming_threshold():
+    """海明距离不超过阈值的签名能通过分段索引找到，超过阈值的找不到"""
+    index = SimHashIndex(max_distance=3)
+    signature = simhash(TEXT)
+    index.add(signature, "c1", "a.pdf")
+
+    assert index.find(signature) == ("c1", "a.pdf")
+    within = flip_bits(signature, 3)
+    assert hamming_distance(signature, within) == 3
+    assert index.find(within) == ("c1", "a.pdf")
+    beyond = flip_bits(signature, 4)
+    assert hamming_distance(signature, beyond) == 4
+    assert index.find(beyond) is None
+
+@pytest.mark.parametrize("max_distance", [0, 3, 6, 10, 20, 40, 63])
+def test_bands_partition_signature(max_distance):
+    """各段互不重叠、宽度都不为零，且正好覆盖 64 位"""
+    index = SimHashIndex(max_distance=max_distance)
+    assert len(index.band_widths) == max_distance + 1
+    assert min(index.band_widths) >= 1
+    assert max(index.band_widths) - min(index.band_widths) <= 1
+    covered = 0
+    for offset, width in zip(index._band_offsets, index.band_widths):
+        band_mask = ((1 << width) - 1) << offset
+        assert covered & band_mask == 0
+        covered |= band_mask
+    assert covered == (1 << SIGNATURE_BITS) - 1
+
+@pytest.mark.parametrize("max_distance", [10, 20, 40])
+def test_large_threshold_finds_worst_case(max_distance):
+    """差异位分散在除最后一段外的每一段里 (最坏情况)，仍能在阈值处找到"""
+    index = SimHashIndex(max_distance=max_distance)
+    signature = simhash(TEXT)
+    index.add(signature, "c1", "a.pdf")
+    within = signature
+    for offset in index._band_offsets[:-1]:
+        within ^= 1 << offset
+    assert hamming_distance(signature, within) == max_distance
+    assert index.find(within) == ("c1", "a.pdf")
+    assert index.find(flip_bits(signature, max_distance + 1)) is None
+
+def test_out_of_range_threshold_is_clamped():
+    assert SimHashIndex(max_distance=100).max_distance == SIGNATURE_BITS - 1
+    assert SimHashIndex(max_distance=-1).max_distance == 0
+
+def test_index_remove_source():
+    index = SimHashIndex(max_distance=3)
+    signature = simhash(TEXT)
+    index.add(signature, "c1", "a.pdf")
+    index.add(signature ^ 1, "c2", "b.pdf")
+    index.remove_source("a.pdf")
+    assert len(index) == 1
+    assert index.find(signature) == ("c2", "b.pdf")
+
+def test_dedup_splits():
+    """完全重复与近似重复的片段被丢弃，不同的文本保留"""
+    index = SimHashIndex(max_distance=3)
+    first = dedup_splits(index, "a.pdf", [make_doc("a-0", TEXT)])
+    assert first.duplicates == 0
+    assert first.signatures == [format(simhash(TEXT), "016x")]
+
+    # 近似重复：结尾标点不同，空白与大小写也不同 (再版 PDF 常见的差异)
+    near = TEXT[:-1].replace("Python ", "python\n", 1) + "！"
+    assert hamming_distance(simhash(TEXT), simhash(near)) <= 3
+    other = "Elasticsearch 的倒排索引把每个词项映射到包含它的文档列表，BM25 根据词频与逆文档频率为文档打分。" * 2
+    result = dedup_splits(index, "b.pdf", [
+        make_doc("b-0", TEXT),
+        make_doc("b-1", near),
+        make_doc("b-2", other),
+    ])
+    assert [d.metadata["chunk_id"] for d in result.kept] == ["b-2"]
+    assert result.duplicates == 2
+    assert result.linked_sources == {"a.pdf"}
+
+def test_dedup_keeps_short_chunks():
+    """过短的片段不计算签名，总是保留"""
+    index = SimHashIndex(max_distance=3)
+    result = dedup_splits(index, "a.pdf", [make_doc("a-0", "目录"), make_doc("a-1", "目录")])
+    assert len(result.kept) == 2
+    assert result.signatures == ["", ""]
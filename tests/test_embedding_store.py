@@ -0,0 +1,72 @@
+# tests/test_embedding_store.py
+import os
+import zlib
+import numpy as np
+from app.core.embedding_store import EmbeddingStore
+
+DIM = 8
+
+def fake_encoder(calls):
+    """按文本生成确定的向量，并记录每次实际计算的文本"""
+    def encode(texts):
+        calls.append(list(texts))
+        return np.stack([
+            np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(DIM).astype(np.float32)
+            for text in texts
+        ])
+    return encode
+
+def test_encode_only_computes_misses(tmp_path):
+    calls = []
+    store = EmbeddingStore(str(tmp_path), "bge", DIM)
+    first = store.encode(["a", "b"], fake_encoder(calls))
+    second = store.encode(["b", "c", "a"], fake_encoder(calls))
+    assert calls == [["a", "b"], ["c"]]
+    np.testing.assert_array_equal(second[0], first[1])
+    np.testing.assert_array_equal(second[2], first[0])
+    assert len(store) == 3
+
+def test_round_trip_through_memmap(tmp_path):
+    """重新打开目录后从磁盘 (memmap) 读出的向量与写入时完全一致"""
+    calls = []
+    texts = [f"chunk {i}" for i in range(50)]
+    written = EmbeddingStore(str(tmp_path), "bge", DIM).encode(texts, fake_encoder(calls))
+
+    reopened = EmbeddingStore(str(tmp_path), "bge", DIM)
+    assert len(reopened) == 50
+    positions, vectors = reopened.get_many([reopened.make_key(text) for text in reversed(texts)])
+    assert positions == list(range(50))
+    np.testing.assert_array_equal(vectors, written[::-1])
+    assert vectors.dtype == np.float32
+
+def test_models_do_not_share_vectors(tmp_path):
+    calls = []
+    EmbeddingStore(str(tmp_path), "bge", DIM).encode(["a"], fake_encoder(calls))
+    EmbeddingStore(str(tmp_path), "bge@onnx-fp32", DIM).encode(["a"], fake_encoder(calls))
+    assert calls == [["a"], ["a"]]
+
+def test_sees_rows_appended_by_another_writer(tmp_path):
+    """同一目录的两个实例 (例如 API 与批量脚本) 能看到对方新写入的条目"""
+    calls = []
+    reader = EmbeddingStore(str(tmp_path), "bge", DIM)
+    writer = EmbeddingStore(str(tmp_path), "bge", DIM)
+    reader.encode(["a"], fake_encoder(calls))
+    expected = writer.encode(["b"], fake_encoder(calls))
+    result = reader.encode(["a", "b"], fake_encoder(calls))
+    assert calls == [["a"], ["b"]]
+    np.testing.assert_array_equal(result[1], expected[0])
+
+def test_recovers_from_torn_write(tmp_path):
+    """上次中断时写了一半的向量行被忽略，之后的写入仍按行对齐"""
+    calls = []
+    store = EmbeddingStore(str(tmp_path), "bge", DIM)
+    kept = store.encode(["a"], fake_encoder(calls))
+    with open(os.path.join(store.directory, "vectors.f32"), "ab") as f:
+        f.write(b"\x00" * (DIM * 4 // 2))
+
+    reopened = EmbeddingStore(str(tmp_path), "bge", DIM)
+    added = reopened.encode(["b"], fake_encoder(calls))
+    again = EmbeddingStore(str(tmp_path), "bge", DIM)
+    _, vectors = again.get_many([again.make_key("a"), again.make_key("b")])
+    np.testing.assert_array_equal(vectors, np.vstack([kept, added]))
+    assert os.path.getsize(os.path.join(store.directory, "vectors.f32")) == 2 * DIM * 4
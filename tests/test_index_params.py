@@ -0,0 +1,58 @@
+# tests/test_index_params.py
+import pytest
+from app.services import milvus_service
+from app.services.milvus_service import build_index_params, build_search_params
+
+def test_overrides_apply_to_matching_index():
+    params = build_index_params("HNSW", "COSINE", M=32, efConstruction=None)
+    assert params["index_type"] == "HNSW"
+    assert params["params"]["M"] == 32
+    assert "nlist" not in params["params"]
+    assert build_search_params("IVF_PQ", "L2", nprobe=64)["params"] == {"nprobe": 64}
+
+@pytest.mark.parametrize("index_type, overrides", [
+    ("HNSW", {"nlist": 1024}),
+    ("IVF_FLAT", {"M": 16}),
+    ("IVF_SQ8", {"m": 8}),
+    ("FLAT", {"nlist": 128}),
+])
+def test_rejects_params_of_other_index_types(index_type, overrides):
+    with pytest.raises(ValueError):
+        build_index_params(index_type, "L2", **overrides)
+
+def test_rejects_search_params_of_other_index_types():
+    with pytest.raises(ValueError):
+        build_search_params("IVF_FLAT", "L2", ef=64)
+    with pytest.raises(ValueError):
+        build_search_params("HNSW", "COSINE", nprobe=16)
+
+class _FakeClient:
+    def __init__(self, index):
+        self.index = index
+
+    def has_collection(self, name):
+        return True
+
+    def describe_collection(self, name):
+        return {"collection_id": 1, "fields": [{"name": "vector", "type": "FLOAT_VECTOR"}]}
+
+    def list_indexes(self, name):
+        return ["vector"]
+
+    def describe_index(self, name, index_name):
+        return dict(self.index)
+
+class _FakeStore:
+    def __init__(self, client):
+        self.client = client
+
+def test_fingerprint_tracks_index_but_not_build_progress():
+    client = _FakeClient({"index_type": "HNSW", "metric_type": "COSINE", "M": "16", "state": "InProgress", "indexed_rows": 0})
+    store = _FakeStore(client)
+    building = milvus_service._schema_fingerprint(store, "docs")
+
+    client.index.update(state="Finished", indexed_rows=100)
+    assert milvus_service._schema_fingerprint(store, "docs") == building
+
+    client.index = {"index_type": "IVF_FLAT", "metric_type": "COSINE", "nlist": "128"}
+    assert milvus_service._schema_fingerprint(store, "docs") != building
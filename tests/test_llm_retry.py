@@ -0,0 +1,114 @@
+# tests/test_llm_retry.py
+import httpx
+import pytest
+from app.services import llm_service
+from app.services.llm_service import RetryTransport
+
+class ScriptedTransport:
+    """按顺序返回预设的响应或抛出预设的异常"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.closed_responses = 0
+
+    async def handle_async_request(self, request):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        status, headers = outcome if isinstance(outcome, tuple) else (outcome, {})
+        transport = self
+
+        class Stream(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                yield b""
+
+            async def aclose(self):
+                transport.closed_responses += 1
+
+        return httpx.Response(status, headers=headers, stream=Stream())
+
+    async def aclose(self):
+        pass
+
+@pytest.fixture
+def delays(monkeypatch):
+    """记录退避时间，不真的等待"""
+    recorded = []
+
+    async def fake_sleep(seconds):
+        recorded.append(seconds)
+
+    monkeypatch.setattr(llm_service.asyncio, "sleep", fake_sleep)
+    return recorded
+
+def request():
+    return httpx.Request("POST", "https://llm.example/v1/chat/completions")
+
+@pytest.mark.asyncio
+async def test_retries_retryable_status_then_succeeds(delays):
+    inner = ScriptedTransport([503, 429, 200])
+    response = await RetryTransport(inner, max_retries=3, backoff=0.5).handle_async_request(request())
+    assert response.status_code == 200
+    assert inner.calls == 3
+    # 重试前关闭失败的响应，连接归还连接池
+    assert inner.closed_responses == 2
+    assert len(delays) == 2
+
+@pytest.mark.asyncio
+async def test_backoff_is_jittered_exponential(delays, monkeypatch):
+    monkeypatch.setattr(llm_service.random, "uniform", lambda low, high: high)
+    inner = ScriptedTransport([500, 502, 504, 200])
+    await RetryTransport(inner, max_retries=3, backoff=0.5).handle_async_request(request())
+    assert delays == [0.5, 1.0, 2.0]
+
+def test_delay_stays_within_jitter_window():
+    transport = RetryTransport(None, max_retries=3, backoff=0.5)
+    for attempt in range(4):
+        for _ in range(50):
+            assert 0 <= transport._delay(attempt, None) <= 0.5 * 2 ** attempt
+
+@pytest.mark.asyncio
+async def test_honours_retry_after(delays):
+    inner = ScriptedTransport([(429, {"retry-after": "2"}), (503, {"retry-after": "120"}), 200])
+    await RetryTransport(inner, max_retries=3, backoff=0.5).handle_async_request(request())
+    # Retry-After 优先，最长等待 30 秒
+    assert delays == [2.0, 30.0]
+
+@pytest.mark.asyncio
+async def test_does_not_retry_client_errors(delays):
+    inner = ScriptedTransport([400])
+    response = await RetryTransport(inner, max_retries=3, backoff=0.5).handle_async_request(request())
+    assert response.status_code == 400
+    assert inner.calls == 1
+    assert delays == []
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_retries(delays):
+    inner = ScriptedTransport([503, 503, 503])
+    response = await RetryTransport(inner, max_retries=2, backoff=0.5).handle_async_request(request())
+    assert response.status_code == 503
+    assert inner.calls == 3
+
+@pytest.mark.asyncio
+async def test_retries_connect_errors(delays):
+    inner = ScriptedTransport([httpx.ConnectError("refused"), httpx.ConnectTimeout("timeout"), 200])
+    response = await RetryTransport(inner, max_retries=3, backoff=0.5).handle_async_request(request())
+    assert response.status_code == 200
+    assert inner.calls == 3
+
+@pytest.mark.asyncio
+async def test_connect_error_raised_after_max_retries(delays):
+    inner = ScriptedTransport([httpx.ConnectError("refused")] * 2)
+    with pytest.raises(httpx.ConnectError):
+        await RetryTransport(inner, max_retries=1, backoff=0.5).handle_async_request(request())
+    assert inner.calls == 2
+
+@pytest.mark.asyncio
+async def test_read_timeout_is_not_retried(delays):
+    """请求已发出后的读超时不重试，避免重复生成"""
+    inner = ScriptedTransport([httpx.ReadTimeout("slow"), 200])
+    with pytest.raises(httpx.ReadTimeout):
+        await RetryTransport(inner, max_retries=3, backoff=0.5).handle_async_request(request())
+    assert inner.calls == 1
@@ -0,0 +1,91 @@
+# tests/test_manifest.py
+import json
+import threading
+from app.core.config import settings
+from app.services.manifest_service import IngestManifest
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestManifest("docs", path)
+    manifest.record("a/intro.pdf", "h1", ["c1", "c2"], duplicates=1)
+    manifest.save()
+
+    reloaded = IngestManifest("docs", path)
+    assert reloaded.get("a/intro.pdf")["chunk_ids"] == ["c1", "c2"]
+    assert reloaded.get("a/intro.pdf")["duplicates"] == 1
+    assert reloaded.is_unchanged("a/intro.pdf", "h1")
+    assert not reloaded.is_unchanged("a/intro.pdf", "h2")
+
+def test_save_merges_changes_from_other_writers(tmp_path):
+    """两个进程各自落盘时只合并自己改动的条目，不覆盖对方写入的内容"""
+    path = str(tmp_path / "manifest.json")
+    seed = IngestManifest("docs", path)
+    seed.record("old.pdf", "h0", ["c0"])
+    seed.save()
+
+    first = IngestManifest("docs", path)
+    second = IngestManifest("docs", path)
+    first.record("a.pdf", "h1", ["c1"])
+    second.record("b.pdf", "h2", ["c2"])
+    second.remove("old.pdf")
+    first.save()
+    second.save()
+
+    merged = IngestManifest("docs", path)
+    assert sorted(source for source, _ in merged.items()) == ["a.pdf", "b.pdf"]
+
+def test_collections_are_isolated(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    docs = IngestManifest("docs", path)
+    docs.record("a.pdf", "h1", ["c1"])
+    docs.save()
+    other = IngestManifest("other", path)
+    other.record("a.pdf", "h2", ["c2"])
+    other.save()
+
+    # 清空一个集合不影响另一个集合
+    docs = IngestManifest("docs", path)
+    docs.clear()
+    docs.save()
+    assert len(IngestManifest("docs", path)) == 0
+    assert IngestManifest("other", path).get("a.pdf")["hash"] == "h2"
+
+def test_clear_drops_entries_written_by_others(tmp_path):
+    """clear() 之后落盘不再合并磁盘上本集合的旧条目"""
+    path = str(tmp_path / "manifest.json")
+    writer = IngestManifest("docs", path)
+    resetter = IngestManifest("docs", path)
+    writer.record("a.pdf", "h1", ["c1"])
+    writer.save()
+    resetter.clear()
+    resetter.record("b.pdf", "h2", ["c2"])
+    resetter.save()
+    assert [source for source, _ in IngestManifest("docs", path).items()] == ["b.pdf"]
+
+def test_legacy_format_belongs_to_default_collection(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps({"files": {"a.pdf": {"hash": "h1", "chunk_ids": ["c1"]}}}), encoding="utf-8")
+    assert IngestManifest(settings.COLLECTION_NAME, str(path)).get("a.pdf")["hash"] == "h1"
+    assert len(IngestManifest("other", str(path))) == 0
+
+def test_concurrent_saves_keep_every_entry(tmp_path):
+    """多个写入方同时落盘：文件锁保证读取-合并-替换不会互相覆盖"""
+    path = str(tmp_path / "manifest.json")
+
+    def writer(worker: int):
+        manifest = IngestManifest("docs", path)
+        for i in range(20):
+            manifest.record(f"w{worker}/{i}.pdf", "h", [f"c{worker}-{i}"])
+            manifest.save()
+
+    threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(IngestManifest("docs", path)) == 160
+
+def test_corrupt_file_is_treated_as_empty(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text("{not json", encoding="utf-8")
+    assert len(IngestManifest("docs", str(path))) == 0
@@ -0,0 +1,53 @@
+# tests/test_minio_etags.py
+import hashlib
+import os
+import pytest
+from app.services.minio_service import is_unchanged, local_etags, object_name_for
+
+def multipart_etag(data: bytes, part_size: int) -> str:
+    """S3 分片上传的 ETag：各分片 MD5 拼接后再取 MD5，加 "-分片数" """
+    parts = [data[i:i + part_size] for i in range(0, len(data), part_size)]
+    combined = hashlib.md5(b"".join(hashlib.md5(part).digest() for part in parts)).hexdigest()
+    return f"{combined}-{len(parts)}"
+
+@pytest.fixture
+def make_file(tmp_path):
+    def make(size: int) -> str:
+        path = tmp_path / f"file-{size}.bin"
+        path.write_bytes(bytes((i * 31 + 7) % 256 for i in range(size)))
+        return str(path)
+    return make
+
+def test_single_part_is_plain_md5(make_file):
+    path = make_file(1000)
+    data = open(path, "rb").read()
+    assert local_etags(path, [4096]) == [hashlib.md5(data).hexdigest()]
+    # 刚好等于分片大小时仍是单次上传
+    assert local_etags(path, [1000]) == [hashlib.md5(data).hexdigest()]
+
+@pytest.mark.parametrize("size, part_size", [(1001, 1000), (3000, 1000), (3500, 1024)])
+def test_multipart_etag(make_file, size, part_size):
+    path = make_file(size)
+    data = open(path, "rb").read()
+    # 读取块大小与分片大小不对齐时，分片边界落在块中间
+    assert local_etags(path, [part_size], block_size=333) == [multipart_etag(data, part_size)]
+
+def test_several_part_sizes_in_one_pass(make_file):
+    path = make_file(5000)
+    data = open(path, "rb").read()
+    assert local_etags(path, [1024, 2048, 8192], block_size=700) == [
+        multipart_etag(data, 1024), multipart_etag(data, 2048), hashlib.md5(data).hexdigest()
+    ]
+
+def test_is_unchanged(make_file):
+    path = make_file(1000)
+    etag = hashlib.md5(open(path, "rb").read()).hexdigest()
+    assert is_unchanged(path, (1000, etag))
+    assert not is_unchanged(path, (999, etag))
+    assert not is_unchanged(path, (1000, "0" * 32))
+    assert not is_unchanged(path, None)
+
+def test_object_name_keeps_relative_path(tmp_path):
+    path = os.path.join(str(tmp_path), "a", "intro.pdf")
+    assert object_name_for(path, str(tmp_path)) == "a/intro.pdf"
+    assert object_name_for(path, str(tmp_path), prefix="docs/") == "docs/a/intro.pdf"
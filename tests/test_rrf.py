@@ -0,0 +1,76 @@
+# tests/test_rrf.py
+import random
+from langchain_core.documents import Document
+from app.services.rag_service import reciprocal_rank_fusion, _fusion_settled
+
+def make_doc(chunk_id: str, content: str = None) -> Document:
+    return Document(page_content=content or f"content of {chunk_id}", metadata={"chunk_id": chunk_id})
+
+def ids(docs):
+    return [d.metadata["chunk_id"] for d in docs]
+
+def test_scores_follow_rrf_formula():
+    """同一片段在两路中出现时分数累加：1/(0+k) + 1/(1+k)"""
+    fused = reciprocal_rank_fusion([[make_doc("a"), make_doc("b")], [make_doc("b"), make_doc("a")]], k=60)
+    assert sorted(ids(fused)) == ["a", "b"]
+    for doc in fused:
+        assert abs(doc.metadata["rrf_score"] - (1 / 60 + 1 / 61)) < 1e-12
+
+def test_ties_keep_first_seen_order():
+    """分数相同的片段按扫描顺序 (名次优先，其次是路的顺序) 排列"""
+    fused = reciprocal_rank_fusion([[make_doc("a"), make_doc("c")], [make_doc("b"), make_doc("d")]])
+    assert ids(fused) == ["a", "b", "c", "d"]
+    assert fused[0].metadata["rrf_score"] == fused[1].metadata["rrf_score"]
+
+def test_ties_do_not_stop_early():
+    """前两名打平时第一名尚未确定，不能提前结束"""
+    scores = {"a": 1 / 60, "b": 1 / 60}
+    assert not _fusion_settled(scores, top_n=1, bound=1 / 61)
+
+    results = [
+        [make_doc("a"), make_doc("x"), make_doc("b")],
+        [make_doc("b"), make_doc("y"), make_doc("a")],
+    ]
+    assert ids(reciprocal_rank_fusion(results, top_n=1)) == ids(reciprocal_rank_fusion(results)[:1])
+
+def test_weights():
+    """权重高的一路排在前面，分数按权重缩放"""
+    fused = reciprocal_rank_fusion([[make_doc("a")], [make_doc("b")]], k=60, weights=[1.0, 2.0])
+    assert ids(fused) == ["b", "a"]
+    assert abs(fused[0].metadata["rrf_score"] - 2 / 60) < 1e-12
+    assert abs(fused[1].metadata["rrf_score"] - 1 / 60) < 1e-12
+
+def test_weighted_early_stop():
+    """一路权重很大时，它的第一名在第一层之后就已确定"""
+    results = [[make_doc(f"m{i}") for i in range(20)], [make_doc(f"e{i}") for i in range(20)]]
+    fused = reciprocal_rank_fusion(results, k=1, weights=[10.0, 0.1], top_n=1)
+    assert ids(fused) == ["m0"]
+    # 提前结束时 rrf_score 只累计到停止的那一层
+    assert abs(fused[0].metadata["rrf_score"] - 10.0) < 1e-12
+
+def test_early_stop_matches_full_fusion():
+    """随机结果上，提前结束得到的 top_n 与完整融合后截取的 top_n 一致 (成员与顺序)"""
+    rng = random.Random(42)
+    pool = [f"c{i}" for i in range(40)]
+    for _ in range(300):
+        legs = rng.randint(1, 3)
+        results = [[make_doc(c) for c in rng.sample(pool, rng.randint(0, 25))] for _ in range(legs)]
+        weights = [rng.choice([0.5, 1.0, 2.0]) for _ in range(legs)]
+        k = rng.choice([1, 5, 60])
+        top_n = rng.randint(1, 8)
+        expected = ids(reciprocal_rank_fusion(results, k=k, weights=weights)[:top_n])
+        assert ids(reciprocal_rank_fusion(results, k=k, weights=weights, top_n=top_n)) == expected
+
+def test_merges_by_chunk_id():
+    """chunk_id 相同即视为同一片段，保留第一次出现的文档"""
+    fused = reciprocal_rank_fusion([[make_doc("a", "milvus text")], [make_doc("a", "es text")]])
+    assert len(fused) == 1
+    assert fused[0].page_content == "milvus text"
+
+def test_falls_back_to_content_key_without_chunk_id():
+    """有一路缺少 chunk_id 时所有路按正文合并"""
+    fused = reciprocal_rank_fusion([
+        [make_doc("a", "same text"), make_doc("b", "other text")],
+        [Document(page_content="same text")],
+    ])
+    assert [d.page_content for d in fused] == ["same text", "other text"]
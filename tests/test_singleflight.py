@@ -0,0 +1,106 @@
+# tests/test_singleflight.py
+import asyncio
+import pytest
+from pydantic import SecretStr
+from app.services import singleflight_service
+from app.services.llm_service import chat_model_key
+from app.services.singleflight_service import get_inflight, join_or_start
+
+def make_producer(chunks, calls, gate=None, fail_after=None):
+    """逐个产出 chunks；gate 不为空时每个片段前等待放行，fail_after 个片段后抛出异常"""
+    def producer(flight):
+        calls.append(flight)
+
+        async def generate():
+            for i, chunk in enumerate(chunks):
+                if fail_after is not None and i == fail_after:
+                    raise RuntimeError("LLM 连接中断")
+                if gate is not None:
+                    await gate.get()
+                yield chunk
+            flight.result["answer"] = "".join(chunks)
+        return generate()
+    return producer
+
+async def collect(flight):
+    return [chunk async for chunk in flight.subscribe()]
+
+@pytest.mark.asyncio
+async def test_fan_out_to_late_followers():
+    """所有订阅者 (包括中途加入的) 都收到完整且相同的片段，生成只执行一次"""
+    calls = []
+    gate = asyncio.Queue()
+    chunks = ["a", "b", "c", "d"]
+    leader = join_or_start("q", make_producer(chunks, calls, gate))
+    early = asyncio.create_task(collect(leader))
+
+    await gate.put(None)
+    await gate.put(None)
+    while len(leader.chunks) < 2:
+        await asyncio.sleep(0)
+    # 已生成两个片段后加入：先补发已有部分，再接收后续片段
+    followers = [join_or_start("q", make_producer(chunks, calls)) for _ in range(5)]
+    assert all(flight is leader for flight in followers)
+    late = [asyncio.create_task(collect(flight)) for flight in followers]
+
+    for _ in range(2):
+        await gate.put(None)
+    results = await asyncio.gather(early, *late)
+    assert all(result == chunks for result in results)
+    assert len(calls) == 1
+    assert leader.result["answer"] == "abcd"
+    # 结束后移除，下一次相同的问题重新生成
+    assert get_inflight("q") is None
+
+@pytest.mark.asyncio
+async def test_leader_disconnect_does_not_stop_generation():
+    """发起生成的客户端断开后，生成在后台继续，其他订阅者照常收到完整答案"""
+    calls = []
+    gate = asyncio.Queue()
+    chunks = ["x", "y", "z"]
+    flight = join_or_start("q", make_producer(chunks, calls, gate))
+    leader_stream = flight.subscribe()
+    follower = asyncio.create_task(collect(join_or_start("q", make_producer(chunks, calls))))
+
+    await gate.put(None)
+    assert await leader_stream.__anext__() == "x"
+    await leader_stream.aclose()
+
+    for _ in range(2):
+        await gate.put(None)
+    assert await follower == chunks
+    assert not flight.task.cancelled()
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_producer_error_ends_streams_and_clears_key():
+    """生成出错时订阅者拿到已生成的部分后正常结束，Key 被移除，下一次请求重新生成"""
+    calls = []
+    flight = join_or_start("q", make_producer(["a", "b", "c"], calls, fail_after=2))
+    results = await asyncio.gather(collect(flight), collect(flight))
+    assert results == [["a", "b"], ["a", "b"]]
+    assert "answer" not in flight.result
+    assert get_inflight("q") is None
+
+    retry = join_or_start("q", make_producer(["a", "b", "c"], calls))
+    assert retry is not flight
+    assert await collect(retry) == ["a", "b", "c"]
+    assert len(calls) == 2
+
+@pytest.mark.asyncio
+async def test_different_keys_do_not_share():
+    calls = []
+    first = join_or_start(("endpoint-a", "q"), make_producer(["1"], calls))
+    second = join_or_start(("endpoint-b", "q"), make_producer(["2"], calls))
+    assert first is not second
+    assert await collect(first) == ["1"]
+    assert await collect(second) == ["2"]
+    assert not singleflight_service._inflight
+
+def test_flight_key_follows_llm_client_key():
+    """rag_service 的合并 Key 与 LLM 客户端缓存同源：端点或密钥不同的请求不共享生成"""
+    base = chat_model_key(SecretStr("k1"), "https://a/v1", "deepseek-chat", 0.3, True)
+    assert base == chat_model_key(SecretStr("k1"), "https://a/v1", "deepseek-chat", 0.3, True)
+    assert base != chat_model_key(SecretStr("k1"), "https://b/v1", "deepseek-chat", 0.3, True)
+    assert base != chat_model_key(SecretStr("k2"), "https://a/v1", "deepseek-chat", 0.3, True)
+    assert "k1" not in repr(base)